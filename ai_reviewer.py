@@ -9,21 +9,20 @@ Enhanced v2.0 with Multi-File Context, Confidence Scoring, Learning Resources, a
 import os
 import sys
 import re
-from typing import Dict, List, Tuple
+import argparse
+from typing import Dict, List, Optional, Tuple
 
 # Import all modules
 from config import Config
 from clients import BitbucketClient, OpenAIClient
-from filters import DiffFilter
-from formatters import CommentFormatter
-from utils import logger, calculate_cost
-from enhancements import (
-    MultiFileContext,
-    ConfidenceScorer,
-    SimilaritySearch
-)
-from language_detector import LanguageDetector
-from reviewer_factory import ReviewerFactory
+from local_git import LocalGitClient
+from pipeline import run_review
+from async_pipeline import run_review_blocking, run_review_queue_blocking, unsupported_async_options
+from batch_review import BatchReviewRunner
+from deadline import Deadline
+from profiling import StageProfiler, activate
+from resilience import LLMResilience
+from utils import configure_logging, logger
 
 
 def parse_pr_url(pr_url: str) -> Tuple[str, str, str]:
@@ -41,121 +40,228 @@ def parse_pr_url(pr_url: str) -> Tuple[str, str, str]:
         raise ValueError(f"Invalid Bitbucket PR URL format: {pr_url}")
     
     workspace, repo, pr_id = match.groups()
-    logger.info(f"Parsed PR URL: workspace={workspace}, repo={repo}, pr_id={pr_id}")
+    logger.info("Parsed PR URL: workspace=%s, repo=%s, pr_id=%s", workspace, repo, pr_id)
     return workspace, repo, pr_id
 
 
-def main():
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line options (credentials and PR selection still come from the environment)"""
+    parser = argparse.ArgumentParser(description="CodeWise AI code review")
+    parser.add_argument('--local', action='store_true', default=os.getenv('CODEWISE_LOCAL', '').lower() in ('1', 'true', 'yes'),
+                        help="Review a local git diff instead of a Bitbucket PR and print the review to stdout")
+    parser.add_argument('--base', default=os.getenv('CODEWISE_BASE_REF', 'origin/main'),
+                        help="Base ref for local mode (diff is base...head)")
+    parser.add_argument('--head', default=os.getenv('CODEWISE_HEAD_REF', 'HEAD'),
+                        help="Head ref for local mode")
+    parser.add_argument('--repo-path', default=os.getenv('CODEWISE_REPO_PATH', '.'),
+                        help="Path of the local git checkout")
+    parser.add_argument('--config', default=os.getenv('CONFIG_FILE', 'config.yaml'),
+                        help="Path of the configuration file")
+    parser.add_argument('--async-pipeline', action='store_true',
+                        help="Run the review on the asyncio clients so network-bound stages overlap")
+    parser.add_argument('--profile', action='store_true', default=os.getenv('CODEWISE_PROFILE', '').lower() in ('1', 'true', 'yes'),
+                        help="Profile CPU time and allocations of each pipeline stage and write a report")
+    parser.add_argument('--profile-output', default=os.getenv('CODEWISE_PROFILE_OUTPUT', 'codewise-profile.txt'),
+                        help="Path of the profile report")
+    parser.add_argument('--profile-top', type=int, default=int(os.getenv('CODEWISE_PROFILE_TOP', '20')),
+                        help="Hotspots and allocation sites listed per stage")
+    parser.add_argument('--profile-exclude-network', action='store_true',
+                        default=os.getenv('CODEWISE_PROFILE_EXCLUDE_NETWORK', '').lower() in ('1', 'true', 'yes'),
+                        help="Measure hotspots in CPU time so network wait is left out")
+    parser.add_argument('--batch-submit', nargs='+', metavar='PR',
+                        help="Submit reviews of these PRs (URLs, or IDs in BITBUCKET_WORKSPACE/REPO_SLUG) as a Batch API job")
+    parser.add_argument('--batch-collect', action='store_true',
+                        help="Wait for the submitted batch and post its reviews")
+    parser.add_argument('--batch-state', default=os.getenv('CODEWISE_BATCH_STATE', '.codewise/batch_state.json'),
+                        help="Checkpoint file that makes batch submit/collect resumable")
+    parser.add_argument('--no-wait', action='store_true',
+                        help="With --batch-collect, check the batch once instead of polling until it finishes")
+    parser.add_argument('--review-queue', nargs='+', metavar='PR',
+                        help="Review these PRs (URLs, or IDs in BITBUCKET_WORKSPACE/REPO_SLUG) through the review scheduler: "
+                             "smallest first, fair across repositories, review_scheduler.max_concurrency at a time")
+    parser.add_argument('--deadline', type=float, default=float(os.getenv('CODEWISE_DEADLINE', '0') or 0),
+                        help="Seconds the whole run may take (overrides deadline.seconds); stages cut their scope "
+                             "as it nears and a partial review is posted when it arrives")
+    return parser.parse_args(argv)
+
+
+def create_ai_client(config: Config, openai_key: str, deadline: Optional[Deadline] = None) -> OpenAIClient:
+    """Create the OpenAI client from configuration"""
+    return OpenAIClient(
+        openai_key,
+        model=config.get('model', 'gpt-3.5-turbo'),
+        temperature=config.get('temperature', 0.2),
+        max_tokens=config.get('max_tokens', 2000),
+        resilience=LLMResilience.from_config(config),
+        deadline=deadline
+    )
+
+
+def parse_batch_target(target: str) -> Tuple[str, str, str]:
+    """Resolve a batch target (PR URL or bare PR ID) to (workspace, repo, pr_id)"""
+    if target.isdigit():
+        workspace = os.getenv('BITBUCKET_WORKSPACE')
+        repo = os.getenv('BITBUCKET_REPO_SLUG')
+        if not (workspace and repo):
+            raise ValueError(f"PR ID {target} needs BITBUCKET_WORKSPACE and BITBUCKET_REPO_SLUG")
+        return workspace, repo, target
+    return parse_pr_url(target)
+
+
+def run_batch_mode(args: argparse.Namespace, config: Config, bb_token: str, openai_key: str):
+    """Submit and/or collect an offline Batch API review run"""
+    if not all([bb_token, openai_key]):
+        logger.error("Batch mode requires BITBUCKET_APP_PASSWORD and OPENAI_KEY")
+        sys.exit(1)
+    
+    try:
+        targets = [parse_batch_target(target) for target in args.batch_submit or []]
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    
+    try:
+        runner = BatchReviewRunner(
+            create_ai_client(config, openai_key),
+            config,
+            lambda workspace, repo: BitbucketClient.from_config(workspace, repo, bb_token, config),
+            state_path=args.batch_state
+        )
+        if targets:
+            runner.submit(targets)
+        if args.batch_collect:
+            runner.collect(wait=not args.no_wait)
+        sys.exit(0)
+        
+    except Exception as e:
+        logger.error("❌ Batch review failed: %s", e, exc_info=True)
+        sys.exit(1)
+
+
+def run_queue_mode(args: argparse.Namespace, config: Config, bb_token: str, openai_key: str, deadline: Optional[Deadline] = None):
+    """Review several PRs, possibly of different repositories, through the review scheduler"""
+    if not all([bb_token, openai_key]):
+        logger.error("Queue mode requires BITBUCKET_APP_PASSWORD and OPENAI_KEY")
+        sys.exit(1)
+    
+    try:
+        targets = [parse_batch_target(target) for target in args.review_queue]
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    
+    try:
+        failed = run_review_queue_blocking(targets, bb_token, openai_key, config, deadline)
+        sys.exit(1 if failed else 0)
+    except Exception as e:
+        logger.error("❌ Queued reviews failed: %s", e, exc_info=True)
+        sys.exit(1)
+
+
+def main(argv: Optional[List[str]] = None):
     """Main execution flow with multi-language support"""
-    logger.info("Starting AI Code Review Bot v2.0 (Multi-Language)")
+    args = parse_args(argv)
     
     # Load configuration
-    config = Config()
+    config = Config(args.config)
+    # Environment variables take precedence over config.yaml
+    configure_logging(
+        os.getenv('CODEWISE_LOG_LEVEL') or config.get('log_level', 'INFO'),
+        json_lines=os.getenv('CODEWISE_LOG_FORMAT', config.get('log_format', 'text')).lower() == 'json'
+    )
+    logger.info("Starting AI Code Review Bot v2.0 (Multi-Language)")
+    
+    # The deadline covers the whole run, from here
+    deadline = Deadline.from_config(config, args.deadline)
     
     # Get environment variables
     pr_url = os.getenv('BITBUCKET_PR_URL')
     bb_token = os.getenv('BITBUCKET_APP_PASSWORD')
     openai_key = os.getenv('OPENAI_KEY')
     
-    # Parse PR URL if provided (new simplified method)
-    if pr_url:
-        try:
-            workspace, repo, pr_id = parse_pr_url(pr_url)
-        except ValueError as e:
-            logger.error(str(e))
+    if args.batch_submit or args.batch_collect:
+        run_batch_mode(args, config, bb_token, openai_key)
+    
+    # Queued reviews and --async-pipeline run on the async clients; fail before any work if they cannot
+    # honour the configuration
+    if args.review_queue or (not args.local and (args.async_pipeline or config.get('async_pipeline', False))):
+        unsupported = unsupported_async_options(config, args.profile)
+        if unsupported:
+            logger.error(
+                "Not supported on the async pipeline (--review-queue, --async-pipeline): %s; "
+                "disable them or run the synchronous pipeline", ', '.join(unsupported)
+            )
             sys.exit(1)
-    else:
-        # Fallback to separate env vars (backward compatibility)
-        workspace = os.getenv('BITBUCKET_WORKSPACE')
-        repo = os.getenv('BITBUCKET_REPO_SLUG')
-        pr_id = os.getenv('BITBUCKET_PR_ID')
-    
-    # Validate required variables
-    if not all([workspace, repo, pr_id, bb_token, openai_key]):
-        logger.error("Missing required environment variables")
-        logger.error("\nOption 1 (Simplified):")
-        logger.error("  - BITBUCKET_PR_URL (e.g., https://bitbucket.org/workspace/repo/pull-requests/123)")
-        logger.error("  - BITBUCKET_APP_PASSWORD")
-        logger.error("  - OPENAI_KEY")
-        logger.error("\nOption 2 (Legacy):")
-        logger.error("  - BITBUCKET_WORKSPACE, BITBUCKET_REPO_SLUG, BITBUCKET_PR_ID")
-        logger.error("  - BITBUCKET_APP_PASSWORD")
-        logger.error("  - OPENAI_KEY")
-        sys.exit(1)
     
-    logger.info(f"Reviewing PR #{pr_id} in {workspace}/{repo}")
+    if args.review_queue:
+        run_queue_mode(args, config, bb_token, openai_key, deadline)
     
-    try:
-        # Initialize clients
-        bb_client = BitbucketClient(workspace, repo, bb_token)
-        ai_client = OpenAIClient(
-            openai_key,
-            model=config.get('model', 'gpt-3.5-turbo'),
-            temperature=config.get('temperature', 0.2),
-            max_tokens=config.get('max_tokens', 2000)
-        )
-        
-        # Fetch PR details and diff
-        logger.info("Fetching PR details...")
-        pr_details = bb_client.get_pr_details(pr_id)
-        
-        logger.info("Fetching PR diff...")
-        raw_diff = bb_client.get_pr_diff(pr_id)
+    if args.local:
+        # Local mode needs no Bitbucket credentials
+        if not openai_key:
+            logger.error("Missing required environment variable: OPENAI_KEY")
+            sys.exit(1)
+        workspace, repo, pr_id = None, None, 'local'
+        logger.info("Reviewing local diff %s...%s in %s", args.base, args.head, args.repo_path)
+    else:
+        # Parse PR URL if provided (new simplified method)
+        if pr_url:
+            try:
+                workspace, repo, pr_id = parse_pr_url(pr_url)
+            except ValueError as e:
+                logger.error(str(e))
+                sys.exit(1)
+        else:
+            # Fallback to separate env vars (backward compatibility)
+            workspace = os.getenv('BITBUCKET_WORKSPACE')
+            repo = os.getenv('BITBUCKET_REPO_SLUG')
+            pr_id = os.getenv('BITBUCKET_PR_ID')
         
-        # Filter diff
-        logger.info("Filtering diff...")
-        diff_filter = DiffFilter(
-            config.get('exclude_patterns', []),
-            config.get('max_diff_size', 5000),
-            config.get('max_files', 50)
-        )
-        filtered_diff, diff_stats = diff_filter.filter_diff(raw_diff)
+        # Validate required variables
+        if not all([workspace, repo, pr_id, bb_token, openai_key]):
+            logger.error("Missing required environment variables")
+            logger.error("\nOption 1 (Simplified):")
+            logger.error("  - BITBUCKET_PR_URL (e.g., https://bitbucket.org/workspace/repo/pull-requests/123)")
+            logger.error("  - BITBUCKET_APP_PASSWORD")
+            logger.error("  - OPENAI_KEY")
+            logger.error("\nOption 2 (Legacy):")
+            logger.error("  - BITBUCKET_WORKSPACE, BITBUCKET_REPO_SLUG, BITBUCKET_PR_ID")
+            logger.error("  - BITBUCKET_APP_PASSWORD")
+            logger.error("  - OPENAI_KEY")
+            logger.error("\nOption 3 (Local): --local [--base REF] [--head REF]")
+            logger.error("  - OPENAI_KEY")
+            sys.exit(1)
         
-        # Check if PR is too large
-        if diff_stats['exceeds_limit'] and config.get('skip_large_prs', True):
-            if config.get('post_warning_on_skip', True):
-                warning = f"""## ⚠️ AI Code Review Skipped
-This pull request is too large for automated AI review.
-**Diff size:** {diff_stats['diff_lines']} lines (limit: {config.get('max_diff_size', 5000)})
-**Files changed:** {diff_stats['total_files']}
-*AI code review works best with focused PRs under 1000 lines of changes.*"""
-                bb_client.post_comment(pr_id, warning)
-                logger.warning("PR exceeds size limits, review skipped")
+        logger.info("Reviewing PR #%s in %s/%s", pr_id, workspace, repo)
+    
+    profiler = None
+    if args.profile:
+        profiler = StageProfiler(top_n=args.profile_top, exclude_network_wait=args.profile_exclude_network)
+        activate(profiler)
+    
+    try:
+        if not args.local and (args.async_pipeline or config.get('async_pipeline', False)):
+            run_review_blocking(workspace, repo, bb_token, openai_key, pr_id, config, deadline)
             sys.exit(0)
         
-        logger.info(f"Diff stats: {diff_stats['total_files']} files, {diff_stats['diff_lines']} lines")
-        
-        # LANGUAGE DETECTION - Detect programming language from changed files
-        logger.info("Detecting programming language...")
-        language, framework, lang_stats = LanguageDetector.detect_from_diff(
-            filtered_diff, 
-            diff_stats.get('changed_files', [])
-        )
-        language_name = LanguageDetector.get_language_name(language, framework)
-        logger.info(f"Detected language: {language_name}")
-        
-        # Check if language is supported
-        if not ReviewerFactory.is_language_supported(language):
-            supported = ', '.join(ReviewerFactory.get_supported_languages())
-            warning = f"""## ⚠️ Language Not Supported
-The detected language **{language}** is not currently supported for automated review.
-
-**Supported languages:** {supported}
-
-**Language distribution in this PR:**
-{chr(10).join([f'- {lang}: {count} files' for lang, count in lang_stats.get('language_distribution', {}).items()])}
-
-*Please ensure the PR contains code in one of the supported languages.*"""
-            bb_client.post_comment(pr_id, warning)
-            logger.warning(f"Language {language} not supported")
-            sys.exit(0)
+        # Initialize clients
+        if args.local:
+            bb_client = LocalGitClient(args.repo_path, base=args.base, head=args.head, deadline=deadline)
+        else:
+            bb_client = BitbucketClient.from_config(workspace, repo, bb_token, config, deadline=deadline)
+        ai_client = create_ai_client(config, openai_key, deadline)
         
-        logger.info(f"✅ AI code review completed successfully ({language_name}, v2.0)")
+        run_review(bb_client, ai_client, pr_id, config)
         sys.exit(0)
         
     except Exception as e:
-        logger.error(f"❌ AI code review failed: {e}", exc_info=True)
+        logger.error("❌ AI code review failed: %s", e, exc_info=True)
         sys.exit(1)
+    
+    finally:
+        if profiler:
+            activate(None)
+            profiler.write_report(args.profile_output)
 
 
 if __name__ == "__main__":
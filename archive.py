@@ -0,0 +1,84 @@
+"""
+Bulk file retrieval from a repository archive
+Above a file-count threshold the context files of a review are read from one download of the
+source archive (tar.gz) instead of one request per file. The archive is decompressed and parsed
+as it streams in: nothing is written to disk, only the wanted members are kept in memory, and
+reading stops as soon as all of them have been seen.
+"""
+
+import io
+import queue
+import re
+import tarfile
+from typing import Dict, Iterable
+from urllib.parse import quote
+
+
+# Archives are served by the website, not by the REST API
+ARCHIVE_HOSTS = {'https://api.bitbucket.org/2.0': 'https://bitbucket.org'}
+
+
+def archive_url(base_url: str, workspace: str, repo: str, ref: str) -> str:
+    """URL of the tar.gz archive of a branch or commit; other API hosts serve it next to /2.0"""
+    base_url = base_url.rstrip('/')
+    root = ARCHIVE_HOSTS.get(base_url) or re.sub(r'/2\.0$', '', base_url)
+    return f"{root}/{workspace}/{repo}/get/{quote(ref, safe='')}.tar.gz"
+
+
+def read_members(fileobj, filepaths: Iterable[str]) -> Dict[str, str]:
+    """Contents of the wanted files from a streamed tar.gz; files not in the archive are left out"""
+    wanted = set(filepaths)
+    contents = {}
+    if not wanted:
+        return contents
+    
+    with tarfile.open(fileobj=fileobj, mode='r|gz') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            # Archives wrap the tree in one top-level directory ({workspace}-{repo}-{commit}/)
+            path = member.name.partition('/')[2]
+            if path not in wanted or path in contents:
+                continue
+            contents[path] = archive.extractfile(member).read().decode('utf-8', errors='replace')
+            if len(contents) == len(wanted):
+                break
+    return contents
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Blocking file object over byte chunks pushed by another thread, so an archive downloaded
+    on the event loop can be parsed by read_members in a worker thread
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._chunks: queue.Queue = queue.Queue()
+        self._buffer = b''
+        self._finished = False
+    
+    def feed(self, chunk: bytes):
+        if chunk:
+            self._chunks.put(chunk)
+    
+    def finish(self):
+        """Signal the end of the download; the reader sees end of file once the buffer is drained"""
+        self._chunks.put(None)
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            if self._finished:
+                return 0
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._finished = True
+                return 0
+            self._buffer = chunk
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
@@ -0,0 +1,420 @@
+"""
+Asyncio API clients for Bitbucket and OpenAI
+Same interface as clients.py with awaitable methods, so network-bound stages can overlap
+"""
+
+import asyncio
+import io
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+from archive import ChunkStream, archive_url, read_members
+from clients import BitbucketClient
+from comment_posting import CommentPoster
+from deadline import Deadline, DeadlineExceeded
+from file_cache import FileContentCache
+from resilience import LLMResilience
+from utils import logger
+
+
+class AsyncBitbucketClient:
+    """Bitbucket API client on a shared httpx.AsyncClient connection pool"""
+    
+    def __init__(
+        self,
+        workspace: str,
+        repo: str,
+        token: str,
+        base_url: str = "https://api.bitbucket.org/2.0",
+        max_connections: int = 20,
+        archive_threshold: int = 20,
+        file_cache: Optional[FileContentCache] = None,
+        deadline: Optional[Deadline] = None,
+        comment_poster: Optional[CommentPoster] = None
+    ):
+        self.workspace = workspace
+        self.repo = repo
+        self.base_url = base_url
+        # get_files_content reads this many files or more from one archive download (0 = never)
+        self.archive_threshold = archive_threshold
+        # Contents read at a commit hash are served from and stored in this cache (small local files,
+        # read and written inline)
+        self.file_cache = file_cache
+        # Run deadline every request (including its retries) must finish within
+        self.deadline = deadline
+        # Splits long comments into parts and updates earlier ones instead of posting duplicates
+        self.comment_poster = comment_poster or CommentPoster()
+        self.http = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/json"
+            },
+            timeout=30,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections)
+        )
+        # Bounds per-file fan-out so one large PR cannot take the whole pool
+        self._fanout = asyncio.Semaphore(max_connections)
+    
+    @staticmethod
+    def from_config(workspace: str, repo: str, token: str, config, **kwargs) -> 'AsyncBitbucketClient':
+        return AsyncBitbucketClient(
+            workspace, repo, token,
+            archive_threshold=config.get('archive_threshold', 20),
+            file_cache=FileContentCache.from_config(config),
+            comment_poster=CommentPoster.from_config(config),
+            **kwargs
+        )
+    
+    async def __aenter__(self) -> 'AsyncBitbucketClient':
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    
+    async def aclose(self):
+        await self.http.aclose()
+    
+    async def _request(self, method: str, endpoint: str, final: bool = False, max_retries: int = 3, **kwargs) -> httpx.Response:
+        """
+        Make HTTP request with retries and asyncio backoff
+        final requests (posting the review) may use the deadline's reserve
+        """
+        url = endpoint if endpoint.startswith('http') else f"{self.base_url}{endpoint}"
+        
+        for attempt in range(max_retries):
+            timeout = self.deadline.timeout(30, f"{method} {endpoint}", final) if self.deadline else None
+            try:
+                logger.debug("API request: %s %s", method, url)
+                response = await asyncio.wait_for(self.http.request(method, url, **kwargs), timeout)
+                response.raise_for_status()
+                return response
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+                # Client errors other than rate limiting (missing files, bad paths) do not go away on retry
+                if status is not None and 400 <= status < 500 and status != 429:
+                    raise
+                if attempt == max_retries - 1:
+                    logger.error("Bitbucket API request failed after %s attempts: %s", max_retries, e)
+                    raise
+                if self.deadline and not self.deadline.allows_wait(2 ** attempt, final):
+                    raise DeadlineExceeded(f"Run deadline leaves no time to retry {method} {endpoint}: {e}") from e
+                logger.warning("Retry %s/%s after error: %s", attempt + 1, max_retries, e)
+                await asyncio.sleep(2 ** attempt)
+    
+    async def get_pr_details(self, pr_id: str) -> Dict:
+        """Fetch PR metadata"""
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}"
+        response = await self._request("GET", endpoint)
+        return response.json()
+    
+    async def get_pr_diff(self, pr_id: str) -> str:
+        """Fetch PR diff"""
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/diff"
+        response = await self._request("GET", endpoint)
+        return response.text
+    
+    async def get_pr_diffstat(self, pr_id: str) -> List[Dict]:
+        """Fetch per-file diffstat entries, following pagination"""
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/diffstat"
+        params = {'pagelen': 500}
+        entries = []
+        
+        while endpoint:
+            data = (await self._request("GET", endpoint, params=params)).json()
+            entries.extend(data.get('values', []))
+            endpoint = data.get('next')
+            params = None
+        
+        return entries
+    
+    async def get_pr_diff_for_files(self, pr_id: str, filepaths: List[str], max_workers: int = 8) -> str:
+        """Fetch the PR diff for the given files only, all files concurrently"""
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/diff"
+        limit = asyncio.Semaphore(max(1, max_workers))
+        
+        async def fetch(filepath: str) -> str:
+            async with limit:
+                response = await self._request("GET", endpoint, params={'path': filepath})
+            return BitbucketClient._extract_file_diff(response.text, filepath)
+        
+        file_diffs = await asyncio.gather(*(fetch(filepath) for filepath in filepaths))
+        return ''.join(d if d.endswith('\n') else d + '\n' for d in file_diffs if d)
+    
+    def _cache_for(self, ref: str) -> Optional[FileContentCache]:
+        """The file cache when contents at ref are immutable (a commit hash)"""
+        if self.file_cache is not None and FileContentCache.cacheable(ref):
+            return self.file_cache
+        return None
+    
+    async def get_file_content(self, filepath: str, branch: str) -> str:
+        """Fetch full file content from a specific branch or commit"""
+        cache = self._cache_for(branch)
+        if cache is not None:
+            content = cache.get(branch, filepath)
+            if content is not None:
+                return content
+        
+        content = await self._fetch_file_content(filepath, branch)
+        if cache is not None and content:
+            cache.put(branch, filepath, content)
+        return content
+    
+    async def _fetch_file_content(self, filepath: str, branch: str) -> str:
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/src/{branch}/{filepath}"
+        try:
+            async with self._fanout:
+                response = await self._request("GET", endpoint)
+            return response.text
+        except Exception as e:
+            logger.warning("Failed to fetch %s: %s", filepath, e)
+            return ""
+    
+    async def get_files_content(self, filepaths: List[str], branch: str) -> Dict[str, str]:
+        """
+        Fetch several files: cached ones from file_cache, the rest from the branch archive
+        above archive_threshold files, else concurrently per file
+        """
+        cache = self._cache_for(branch)
+        cached = cache.get_many(branch, filepaths) if cache is not None else {}
+        missing = [filepath for filepath in filepaths if filepath not in cached]
+        if not missing:
+            return cached
+        
+        contents = None
+        if self.archive_threshold and len(missing) >= self.archive_threshold:
+            try:
+                contents = await self.get_archive_contents(missing, branch)
+                logger.info("Read %s of %s files from the archive of %s", len(contents), len(missing), branch)
+            except Exception as e:
+                logger.warning("Archive retrieval failed, fetching %s files one by one: %s", len(missing), e)
+        
+        if contents is None:
+            fetched = await asyncio.gather(*(self._fetch_file_content(filepath, branch) for filepath in missing))
+            contents = {filepath: content for filepath, content in zip(missing, fetched) if content}
+        
+        if cache is not None:
+            for filepath, content in contents.items():
+                cache.put(branch, filepath, content)
+        contents.update(cached)
+        return {filepath: contents[filepath] for filepath in filepaths if filepath in contents}
+    
+    async def get_archive_contents(self, filepaths: List[str], branch: str) -> Dict[str, str]:
+        """Download the branch archive once; a worker thread extracts the given files while it streams in"""
+        url = archive_url(self.base_url, self.workspace, self.repo, branch)
+        timeout = self.deadline.timeout(30, "archive download") if self.deadline else 30
+        stream = ChunkStream()
+        reader = asyncio.get_running_loop().run_in_executor(None, read_members, io.BufferedReader(stream), filepaths)
+        try:
+            logger.debug("Archive request: GET %s", url)
+            async with self._fanout, self.http.stream(
+                "GET", url, headers={"Accept": "application/x-gzip, */*"}, timeout=timeout
+            ) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    # The reader stops early once every file has been seen
+                    if reader.done():
+                        break
+                    stream.feed(chunk)
+        except BaseException:
+            stream.finish()
+            await asyncio.gather(reader, return_exceptions=True)
+            raise
+        stream.finish()
+        return await reader
+    
+    async def list_directory(self, dirpath: str, branch: str) -> Dict[str, Optional[str]]:
+        """Files directly in a directory at a branch, mapped to their blob hash (not provided by Bitbucket)"""
+        directory = f"{dirpath.strip('/')}/" if dirpath.strip('/') else ''
+        url = f"/repositories/{self.workspace}/{self.repo}/src/{branch}/{directory}?pagelen=100"
+        files = {}
+        while url:
+            async with self._fanout:
+                response = await self._request("GET", url)
+            data = response.json()
+            files.update({entry['path']: None for entry in data.get('values', []) if entry.get('type') == 'commit_file'})
+            url = data.get('next')
+        return files
+    
+    async def list_comments(self, pr_id: str) -> List[Dict]:
+        """All comments on a PR, following pagination"""
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/comments"
+        params = {'pagelen': 100}
+        comments = []
+        while endpoint:
+            response = await self._request("GET", endpoint, final=True, params=params)
+            data = response.json()
+            comments.extend(data.get('values', []))
+            endpoint = data.get('next')
+            params = None
+        return comments
+    
+    async def create_comment(self, pr_id: str, content: str) -> Dict:
+        """POST one comment; not retried here, CommentPoster checks whether a failed POST landed first"""
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/comments"
+        response = await self._request("POST", endpoint, final=True, max_retries=1, json={"content": {"raw": content}})
+        return response.json()
+    
+    async def update_comment(self, pr_id: str, comment_id: int, content: str) -> Dict:
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/comments/{comment_id}"
+        response = await self._request("PUT", endpoint, final=True, json={"content": {"raw": content}})
+        return response.json()
+    
+    async def delete_comment(self, pr_id: str, comment_id: int):
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/comments/{comment_id}"
+        try:
+            await self._request("DELETE", endpoint, final=True)
+        except httpx.HTTPStatusError as e:
+            # Already gone (a retried DELETE, or removed by hand)
+            if e.response.status_code != 404:
+                raise
+    
+    async def post_comment(self, pr_id: str, content: str, key: Optional[str] = None) -> Dict:
+        """
+        Post comment on PR, split into parts when it is too long; the comments an earlier run
+        posted under the same key are updated instead of posting new ones
+        """
+        return await self.comment_poster.publish_async(self, pr_id, content, key)
+
+
+class AsyncOpenAIClient:
+    """OpenAI API client on AsyncOpenAI; concurrent review_code calls overlap"""
+    
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-3.5-turbo",
+        temperature: float = 0.2,
+        max_tokens: int = 2000,
+        base_url: Optional[str] = None,
+        resilience: Optional[LLMResilience] = None,
+        deadline: Optional[Deadline] = None
+    ):
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.resilience = resilience
+        self.deadline = deadline
+        self.last_usage = {'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0}
+        self.total_usage = {'calls': 0, 'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0}
+    
+    async def aclose(self):
+        await self.client.close()
+    
+    async def _create_completion(self, model: str, system_prompt: str, user_prompt: str, json_output: bool = False):
+        kwargs = {}
+        client = self.client
+        if self.resilience and self.resilience.request_timeout:
+            kwargs['timeout'] = self.resilience.request_timeout
+        if self.deadline:
+            kwargs['timeout'] = self.deadline.timeout(kwargs.get('timeout'), "the LLM call")
+            client = client.with_options(max_retries=0)
+        if json_output:
+            kwargs['response_format'] = {"type": "json_object"}
+        return await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            **kwargs
+        )
+    
+    async def _hedged_completion(self, model: str, system_prompt: str, user_prompt: str, json_output: bool = False):
+        """Async counterpart of OpenAIClient._hedged_completion; the slower request is cancelled"""
+        resilience = self.resilience
+        delay = resilience.hedge_delay(model) if resilience else None
+        
+        async def call():
+            start = time.monotonic()
+            response = await self._create_completion(model, system_prompt, user_prompt, json_output)
+            if resilience:
+                resilience.record_latency(model, time.monotonic() - start)
+            return response
+        
+        if delay is None:
+            return await call()
+        
+        primary = asyncio.create_task(call())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                logger.info("No response after %.1fs, sending hedged request", delay)
+                resilience.count('hedged')
+                tasks.add(asyncio.create_task(call()))
+            
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            resilience.count('hedge_wins')
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def review_code(self, system_prompt: str, user_prompt: str, json_output: bool = False) -> Tuple[str, int, int, int]:
+        """
+        Send code for AI review, returns (response, input_tokens, output_tokens, cached_tokens),
+        the same contract as OpenAIClient.review_code; usage is returned rather than read from
+        last_usage, which concurrent calls share
+        """
+        max_retries = 3
+        
+        for attempt in range(max_retries):
+            model = self.resilience.select_model(self.model) if self.resilience else self.model
+            try:
+                logger.debug("Calling OpenAI API with model %s", model)
+                response = await self._hedged_completion(model, system_prompt, user_prompt, json_output)
+                if self.resilience:
+                    self.resilience.record_result(model, self.model, success=True)
+                
+                usage = response.usage
+                details = getattr(usage, 'prompt_tokens_details', None)
+                cached_tokens = (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+                self.last_usage = {
+                    'input_tokens': usage.prompt_tokens,
+                    'cached_tokens': cached_tokens,
+                    'output_tokens': usage.completion_tokens
+                }
+                self.total_usage['calls'] += 1
+                for key, value in self.last_usage.items():
+                    self.total_usage[key] += value
+                
+                logger.info(
+                    "OpenAI API success (%s): %s input tokens (%s cached), %s output tokens",
+                    model, usage.prompt_tokens, cached_tokens, usage.completion_tokens
+                )
+                return response.choices[0].message.content, usage.prompt_tokens, usage.completion_tokens, cached_tokens
+            
+            except (DeadlineExceeded, asyncio.CancelledError):
+                # Not the model's fault: no failure is recorded, but a half-open probe must not stay in flight
+                if self.resilience:
+                    self.resilience.release(model, self.model)
+                raise
+            except Exception as e:
+                if self.resilience:
+                    self.resilience.record_result(model, self.model, success=False)
+                if self.deadline and attempt < max_retries - 1 and not self.deadline.allows_wait(2 ** (attempt + 1)):
+                    raise DeadlineExceeded(f"Run deadline leaves no time to retry the LLM call: {e}") from e
+                if "rate_limit" in str(e).lower() and attempt < max_retries - 1:
+                    wait_time = 2 ** (attempt + 1)
+                    logger.warning("Rate limit hit, waiting %ss before retry %s/%s", wait_time, attempt + 1, max_retries)
+                    await asyncio.sleep(wait_time)
+                elif attempt == max_retries - 1:
+                    logger.error("OpenAI API failed after %s attempts: %s", max_retries, e)
+                    raise
+                else:
+                    logger.warning("OpenAI API error, retry %s/%s: %s", attempt + 1, max_retries, e)
+                    await asyncio.sleep(2 ** attempt)
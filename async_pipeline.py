@@ -0,0 +1,390 @@
+"""
+Asyncio review pipeline
+Same stages as pipeline.py, but network-bound steps overlap: PR details are fetched while the
+diff is being selected and downloaded, file contents are fetched concurrently, and several PRs
+can be reviewed at once on shared connection pools.
+"""
+
+import asyncio
+import functools
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from async_clients import AsyncBitbucketClient, AsyncOpenAIClient
+from coalescing import AsyncReviewCoalescer, ReviewCoalescer
+from comment_posting import WARNING_KEY
+from deadline import Deadline, DeadlineExceeded
+from dedupe import neutralize_paths, restore_paths
+from enhancements import MultiFileContext
+from pipeline import (
+    REUSED_FINDINGS_NOTE,
+    build_prepared,
+    collect_symbol_context,
+    context_allowed,
+    context_ref,
+    create_diff_filter,
+    deadline_notice,
+    degrade_on_deadline,
+    detect_language,
+    filter_raw_diff,
+    fit_to_deadline,
+    local_only,
+    local_rules_review,
+    lookup_reusable_findings,
+    merge_local_findings,
+    render_review,
+    size_warning,
+    unsupported_language_warning
+)
+from reviewer_factory import ReviewerFactory
+from resilience import LLMResilience
+from scheduler import ReviewScheduler
+from utils import logger
+
+
+async def fetch_filtered_diff_async(bb_client: AsyncBitbucketClient, pr_id: str, config: Config,
+                                    diffstat: Optional[List[Dict]] = None) -> Optional[Tuple[str, Dict]]:
+    """Async counterpart of pipeline.fetch_filtered_diff; diffstat is used instead of fetching it again when given"""
+    diff_filter = create_diff_filter(config)
+    
+    raw_diff = None
+    if config.get('use_diffstat', True):
+        if diffstat is None:
+            logger.info("Fetching PR diffstat...")
+            try:
+                diffstat = await bb_client.get_pr_diffstat(pr_id)
+            except Exception as e:
+                logger.warning("Diffstat unavailable, falling back to full diff: %s", e)
+                diffstat = None
+        
+        if diffstat is not None:
+            selected_files, diffstat_stats = diff_filter.filter_diffstat(diffstat)
+            if diffstat_stats['exceeds_limit'] and config.get('skip_large_prs', True):
+                warning = size_warning(diffstat_stats, config)
+                if warning:
+                    await bb_client.post_comment(pr_id, warning, key=WARNING_KEY)
+                return None
+            
+            if len(selected_files) == len(diffstat):
+                raw_diff = await bb_client.get_pr_diff(pr_id)
+            else:
+                logger.info("Fetching diffs for %s of %s files...", len(selected_files), len(diffstat))
+                raw_diff = await bb_client.get_pr_diff_for_files(
+                    pr_id,
+                    selected_files,
+                    max_workers=config.get('diff_fetch_workers', 8)
+                )
+    
+    if raw_diff is None:
+        logger.info("Fetching PR diff...")
+        raw_diff = await bb_client.get_pr_diff(pr_id)
+    
+    filtered_diff, diff_stats, too_large = filter_raw_diff(raw_diff, diff_filter, config)
+    if too_large:
+        warning = size_warning(diff_stats, config)
+        if warning:
+            await bb_client.post_comment(pr_id, warning, key=WARNING_KEY)
+        return None
+    return filtered_diff, diff_stats
+
+
+class BlockingBitbucketClient:
+    """Blocking view of an AsyncBitbucketClient for code running in a worker thread"""
+    
+    def __init__(self, bb_client: AsyncBitbucketClient, loop: asyncio.AbstractEventLoop):
+        self.bb_client = bb_client
+        self.loop = loop
+        self.deadline = bb_client.deadline
+    
+    def _wait(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+    
+    def get_file_content(self, filepath: str, branch: str) -> str:
+        return self._wait(self.bb_client.get_file_content(filepath, branch))
+    
+    def list_directory(self, dirpath: str, branch: str) -> Dict[str, Optional[str]]:
+        return self._wait(self.bb_client.list_directory(dirpath, branch))
+
+
+async def prepare_review_async(bb_client: AsyncBitbucketClient, pr_id: str, config: Config,
+                               progress: Optional[Dict] = None, diffstat: Optional[List[Dict]] = None) -> Optional[Dict]:
+    """Async counterpart of pipeline.prepare_review; diffstat: already fetched (by the scheduler's size estimate)"""
+    progress = {} if progress is None else progress
+    # PR details are only needed for context and prompt, fetch them alongside the diff
+    logger.info("Fetching PR details...")
+    details_task = asyncio.create_task(bb_client.get_pr_details(pr_id))
+    try:
+        fetched = await fetch_filtered_diff_async(bb_client, pr_id, config, diffstat)
+    except BaseException:
+        details_task.cancel()
+        raise
+    if fetched is not None:
+        progress['diff_stats'] = fetched[1]
+    pr_details = await details_task
+    progress['pr_details'] = pr_details
+    if fetched is None:
+        return None
+    filtered_diff, diff_stats = fetched
+    
+    language, framework, lang_stats, language_name = detect_language(filtered_diff, diff_stats)
+    if not ReviewerFactory.is_language_supported(language):
+        await bb_client.post_comment(pr_id, unsupported_language_warning(language, lang_stats), key=WARNING_KEY)
+        return None
+    
+    cuts = []
+    full_files, fetched = None, {}
+    if config.get('enable_multi_file_context', True) and context_allowed(bb_client.deadline, 'full file context', cuts):
+        logger.info("Retrieving full file context...")
+        context = MultiFileContext.from_config(bb_client, config, filtered_diff)
+        try:
+            contents = await bb_client.get_files_content(
+                diff_stats.get('changed_files', [])[:context.max_files],
+                context_ref(pr_details)
+            )
+            full_files = context.limit_contents(contents)
+            fetched = context.fetched
+        except DeadlineExceeded as e:
+            logger.warning("Run deadline reached while gathering full file context, continuing without it: %s", e)
+            cuts.append('full file context')
+    
+    # The symbol index is synchronous; it runs in a worker thread and fetches through the event loop
+    symbol_context = None
+    if context_allowed(bb_client.deadline, 'symbol context', cuts):
+        loop = asyncio.get_running_loop()
+        symbol_context = await loop.run_in_executor(
+            None,
+            degrade_on_deadline,
+            'symbol context',
+            cuts,
+            collect_symbol_context,
+            BlockingBitbucketClient(bb_client, loop),
+            filtered_diff,
+            context_ref(pr_details),
+            fetched,
+            config
+        )
+    if bb_client.file_cache is not None:
+        bb_client.file_cache.log_stats()
+    
+    prepared = build_prepared(
+        pr_details, filtered_diff, diff_stats, language, framework, language_name, full_files, config,
+        symbol_context
+    )
+    prepared['deadline_cuts'] = cuts
+    return prepared
+
+
+def unsupported_async_options(config: Config, profile: bool = False) -> List[str]:
+    """Configured features the async pipeline does not implement; runs asking for them fail up front"""
+    unsupported = []
+    if (config.get('cascade', {}) or {}).get('enabled', False):
+        unsupported.append("the model cascade (cascade.enabled)")
+    if profile:
+        unsupported.append("stage profiling (--profile)")
+    return unsupported
+
+
+async def request_review_async(
+    ai_client: AsyncOpenAIClient,
+    prepared: Dict,
+    config: Config,
+    coalescer: Optional[AsyncReviewCoalescer] = None
+) -> Tuple[str, int, int, int]:
+    """Async counterpart of pipeline.request_review; with a coalescer, small reviews may share a request"""
+    if local_only(prepared):
+        return local_rules_review(prepared, config)
+    unsupported = unsupported_async_options(config)
+    if unsupported:
+        raise ValueError(f"Not supported on the async pipeline: {', '.join(unsupported)}")
+    store, fingerprint, version, findings = lookup_reusable_findings(ai_client.model, prepared, config)
+    try:
+        if findings is not None:
+            prepared.pop('partial', None)
+            return REUSED_FINDINGS_NOTE + restore_paths(findings, prepared['diff']), 0, 0, 0
+        
+        logger.info("Requesting AI review (%s)...", prepared['language_name'])
+        result = await (coalescer or ai_client).review_code(
+            prepared['system_prompt'],
+            prepared['user_prompt'],
+            json_output=prepared.get('structured', False)
+        )
+        result = (merge_local_findings(prepared, result[0], config),) + tuple(result[1:])
+        
+        if fingerprint and not prepared.get('partial'):
+            store.put(fingerprint, version, neutralize_paths(result[0], prepared['diff']))
+        return result
+    finally:
+        if store:
+            store.close()
+
+
+async def run_review_async(
+    bb_client: AsyncBitbucketClient,
+    ai_client: AsyncOpenAIClient,
+    pr_id: str,
+    config: Config,
+    coalescer: Optional[AsyncReviewCoalescer] = None,
+    diffstat: Optional[List[Dict]] = None
+) -> None:
+    """Review one pull request end to end on the async clients (diffstat: already fetched, see prepare_review_async)"""
+    progress: Dict = {}
+    try:
+        prepared = await prepare_review_async(bb_client, pr_id, config, progress, diffstat)
+    except DeadlineExceeded as e:
+        logger.warning("Run deadline reached while preparing the review, posting a partial review: %s", e)
+        await bb_client.post_comment(pr_id, deadline_notice(progress, config.get('severity_labels', {})))
+        return
+    if prepared is None:
+        return
+    
+    try:
+        fit_to_deadline(prepared, ai_client.deadline)
+        review_content, input_tokens, output_tokens, cached_tokens = await request_review_async(
+            ai_client, prepared, config, coalescer
+        )
+    except DeadlineExceeded as e:
+        logger.warning("Run deadline reached before the review finished, posting a partial review: %s", e)
+        await bb_client.post_comment(pr_id, deadline_notice(prepared, config.get('severity_labels', {})))
+        return
+    
+    comment = render_review(config, prepared, review_content, input_tokens, output_tokens, cached_tokens)
+    if comment is not None:
+        logger.info("Posting review comment...")
+        await bb_client.post_comment(pr_id, comment)
+    logger.info("✅ AI code review completed successfully (%s, v2.0)", prepared['language_name'])
+
+
+async def estimate_review_cost(bb_client: AsyncBitbucketClient, pr_id: str,
+                               scheduler: ReviewScheduler) -> Tuple[float, Optional[List[Dict]]]:
+    """
+    Estimated cost of reviewing a PR from its diffstat (the scheduler's default when unavailable),
+    and the diffstat so that the review does not fetch it again
+    """
+    try:
+        diffstat = await bb_client.get_pr_diffstat(pr_id)
+        return scheduler.estimate_cost(diffstat), diffstat
+    except Exception as e:
+        logger.warning("Could not estimate the size of PR #%s: %s", pr_id, e)
+        return scheduler.default_cost, None
+
+
+async def run_scheduled_reviews_async(
+    jobs: List[Tuple[AsyncBitbucketClient, str]],
+    ai_client: AsyncOpenAIClient,
+    config: Config,
+    scheduler: Optional[ReviewScheduler] = None
+) -> List[Optional[BaseException]]:
+    """
+    Review (client, PR id) jobs of one or more repositories through a ReviewScheduler; every PR is
+    sized and queued before the first one starts, and small reviews running together may share
+    LLM requests (request_coalescing). Returns the error (or None) per job
+    """
+    scheduler = scheduler or ReviewScheduler.from_config(config)
+    settings = ReviewCoalescer.from_config(config)
+    coalescer = AsyncReviewCoalescer(settings, ai_client) if settings else None
+    estimates = await asyncio.gather(*(estimate_review_cost(bb_client, pr_id, scheduler) for bb_client, pr_id in jobs))
+    
+    scheduler.pause()
+    futures = []
+    for (bb_client, pr_id), (cost, diffstat) in zip(jobs, estimates):
+        group = f"{bb_client.workspace}/{bb_client.repo}"
+        futures.append(scheduler.submit(
+            group,
+            cost,
+            functools.partial(run_review_async, bb_client, ai_client, pr_id, config, coalescer, diffstat),
+            label=f"{group}#{pr_id}"
+        ))
+    scheduler.resume()
+    
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    scheduler.log_stats()
+    if settings:
+        settings.log_stats()
+    if getattr(ai_client, 'resilience', None):
+        ai_client.resilience.log_stats()
+    return [result if isinstance(result, BaseException) else None for result in results]
+
+
+async def run_reviews_async(
+    bb_client: AsyncBitbucketClient,
+    ai_client: AsyncOpenAIClient,
+    pr_ids: List[str],
+    config: Config,
+    concurrency: int = 4
+) -> List[Optional[BaseException]]:
+    """Review several PRs of one repository, at most concurrency at a time and smallest first"""
+    scheduler = ReviewScheduler.from_config(config)
+    scheduler.max_concurrency = max(1, concurrency)
+    return await run_scheduled_reviews_async([(bb_client, pr_id) for pr_id in pr_ids], ai_client, config, scheduler)
+
+
+def run_review_blocking(
+    workspace: str,
+    repo: str,
+    token: str,
+    openai_key: str,
+    pr_id: str,
+    config: Config,
+    deadline: Optional[Deadline] = None
+) -> None:
+    """Synchronous wrapper: build the async clients, run one review and close the pools"""
+    async def run():
+        bb_client = AsyncBitbucketClient.from_config(workspace, repo, token, config, deadline=deadline)
+        ai_client = AsyncOpenAIClient(
+            openai_key,
+            model=config.get('model', 'gpt-3.5-turbo'),
+            temperature=config.get('temperature', 0.2),
+            max_tokens=config.get('max_tokens', 2000),
+            resilience=LLMResilience.from_config(config),
+            deadline=deadline
+        )
+        try:
+            await run_review_async(bb_client, ai_client, pr_id, config)
+        finally:
+            if ai_client.resilience:
+                ai_client.resilience.log_stats()
+            await bb_client.aclose()
+            await ai_client.aclose()
+    
+    asyncio.run(run())
+
+
+def run_review_queue_blocking(
+    targets: List[Tuple[str, str, str]],
+    token: str,
+    openai_key: str,
+    config: Config,
+    deadline: Optional[Deadline] = None
+) -> int:
+    """
+    Synchronous wrapper for a queue of (workspace, repo, PR id) targets: one client per repository,
+    a shared OpenAI client and the configured review_scheduler; returns the number of failed reviews
+    The deadline, if any, covers the whole queue
+    """
+    async def run():
+        clients = {}
+        for workspace, repo, _ in targets:
+            if (workspace, repo) not in clients:
+                clients[(workspace, repo)] = AsyncBitbucketClient.from_config(workspace, repo, token, config, deadline=deadline)
+        ai_client = AsyncOpenAIClient(
+            openai_key,
+            model=config.get('model', 'gpt-3.5-turbo'),
+            temperature=config.get('temperature', 0.2),
+            max_tokens=config.get('max_tokens', 2000),
+            resilience=LLMResilience.from_config(config),
+            deadline=deadline
+        )
+        try:
+            return await run_scheduled_reviews_async(
+                [(clients[(workspace, repo)], pr_id) for workspace, repo, pr_id in targets], ai_client, config
+            )
+        finally:
+            for bb_client in clients.values():
+                await bb_client.aclose()
+            await ai_client.aclose()
+    
+    errors = asyncio.run(run())
+    for (workspace, repo, pr_id), error in zip(targets, errors):
+        if error is not None:
+            logger.error("Review of %s/%s#%s failed: %s", workspace, repo, pr_id, error)
+    return sum(error is not None for error in errors)
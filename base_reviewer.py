@@ -3,9 +3,15 @@ Base Reviewer Class for Multi-Language Code Review
 Provides abstract interface that all language-specific reviewers must implement
 """
 
+import inspect
+import os
 from abc import ABC, abstractmethod
 from typing import Dict, List, Optional
 
+from diff_compaction import has_notes
+from keyword_matcher import KeywordMatcher, load_issue_catalog
+from rule_engine import load_rule_pack
+
 
 class BaseReviewer(ABC):
     """Abstract base class for language-specific reviewers"""
@@ -14,6 +20,7 @@ class BaseReviewer(ABC):
         self.config = config
         self.language = self.get_language()
         self.framework = 'none'
+        self._issue_matcher = None
     
     @abstractmethod
     def get_language(self) -> str:
@@ -45,51 +52,100 @@ class BaseReviewer(ABC):
                 'title': 'Issue Title',
                 'description': 'Description',
                 'url': 'Learning resource URL',
-                'severity': 'critical|important|suggestion'
+                'severity': 'critical|important|suggestion',
+                'keywords': ['phrases', 'matched', 'in the review']
             }
         }
         """
         pass
     
+    def load_issue_catalog(self) -> Dict[str, Dict]:
+        """
+        Load common issues from data files: common_issues.json next to the reviewer module,
+        then any files listed for this language under issue_catalogs in the config
+        """
+        paths = [os.path.join(os.path.dirname(inspect.getfile(type(self))), 'common_issues.json')]
+        paths += (self.config.get('issue_catalogs', {}) or {}).get(self.language, [])
+        
+        catalog = {}
+        for path in paths:
+            if os.path.exists(path):
+                catalog.update(load_issue_catalog(path))
+        return catalog
+    
+    def load_rule_pack(self) -> Dict[str, Dict]:
+        """
+        Load local rules (see rule_engine.LocalRuleEngine): rules.json next to the reviewer module,
+        then any files listed for this language under rule_packs in the config; later files
+        override rules with the same id, and a rule without a pattern disables it
+        """
+        paths = [os.path.join(os.path.dirname(inspect.getfile(type(self))), 'rules.json')]
+        paths += (self.config.get('rule_packs', {}) or {}).get(self.language, [])
+        
+        rules = {}
+        for path in paths:
+            if os.path.exists(path):
+                rules.update(load_rule_pack(path))
+        return rules
+    
     def format_user_prompt(
         self, 
         pr_details: Dict, 
         diff: str, 
         full_files: Optional[Dict[str, str]] = None,
-        framework: Optional[str] = None
+        framework: Optional[str] = None,
+        symbol_context: Optional[str] = None
     ) -> str:
         """
         Format user prompt with PR context
         Can be overridden by subclasses for custom formatting
+        
+        Sections go from most to least stable (instructions, repository, PR, file context, diff)
+        so that consecutive calls share the longest possible prefix for server-side prompt caching.
+        Keep anything that varies per call (timestamps, counters) out of the leading sections.
         """
-        prompt = f"""Review the following pull request changes:
-
-**Repository:** {pr_details.get('source', {}).get('repository', {}).get('full_name', 'N/A')}
-**PR #{pr_details.get('id')}:** {pr_details.get('title', 'N/A')}
-**Author:** {pr_details.get('author', {}).get('display_name', 'N/A')}
-**Language:** {self.get_language().title()}"""
+        language = self.get_language().title()
+        
+        # Static instructions - identical for every call of this reviewer
+        prompt = f"""Review the following pull request changes and provide a structured code review focusing on {language} security and best practices.
 
+**Language:** {language}"""
+        
         if framework and framework != 'none':
             prompt += f"\n**Framework:** {framework.title()}"
         
+        # Repository and PR context - stable across calls for the same PR
         prompt += f"""
-
-**CODE DIFF:**
-```diff
-{diff[:15000]}
-```
+**Repository:** {pr_details.get('source', {}).get('repository', {}).get('full_name', 'N/A')}
+**PR #{pr_details.get('id')}:** {pr_details.get('title', 'N/A')}
+**Author:** {pr_details.get('author', {}).get('display_name', 'N/A')}
 """
         
-        # Add full file context if available
+        # Add file context if available
         if full_files:
-            prompt += "\n\n**FULL FILE CONTEXT (for better understanding):**\n"
+            scoped = (self.config.get('scope_context', {}) or {}).get('enabled', True)
+            if scoped:
+                prompt += "\n**CODE CONTEXT (functions and classes enclosing the changes):**\n"
+            else:
+                prompt += "\n**FULL FILE CONTEXT (for better understanding):**\n"
             for filepath, content in full_files.items():
-                # Truncate large files
-                content_preview = content[:5000] if len(content) > 5000 else content
+                # Scoped context is already cut to its budget by MultiFileContext; whole files are truncated
+                content_preview = content[:5000] if not scoped and len(content) > 5000 else content
                 ext = filepath.split('.')[-1]
                 prompt += f"\n```{ext}\n// File: {filepath}\n{content_preview}\n```\n"
         
-        prompt += f"\nProvide a structured code review focusing on {self.get_language().title()} security and best practices."
+        # Definitions the change uses from files outside the diff
+        if symbol_context:
+            prompt += f"\n**DEFINITIONS REFERENCED BY THE CHANGES (from other files):**\n```\n{symbol_context}\n```\n"
+        
+        # Changed code - the part that varies most, so it goes last
+        notes = " (lines starting with `#` note omitted whitespace-only changes, moved code and renames)" if has_notes(diff) else ""
+        prompt += f"""
+**CODE DIFF{notes}:**
+```diff
+{diff[:15000]}
+```
+"""
         return prompt
     
     def get_severity_icon(self, severity: str) -> str:
@@ -104,22 +160,50 @@ class BaseReviewer(ABC):
     
     def enhance_review_with_resources(self, review_content: str) -> List[Dict]:
         """
-        Analyze review content and suggest relevant learning resources
+        Analyze review content and suggest relevant learning resources, most mentioned first
         """
-        resources = []
         common_issues = self.get_common_issues()
-        review_lower = review_content.lower()
+        if not common_issues:
+            return []
+        if self._issue_matcher is None:
+            self._issue_matcher = KeywordMatcher.from_issue_catalog(common_issues)
+        
+        hits = self._issue_matcher.count_labels(review_content)
+        # Stable sort keeps catalog order between issues with the same hit count
+        ranked = sorted((key for key in common_issues if hits[key]), key=lambda key: -hits[key])
         
-        for issue_key, issue_data in common_issues.items():
-            # Check if issue keywords appear in review
-            keywords = issue_data.get('keywords', [issue_key.replace('_', ' ')])
-            for keyword in keywords:
-                if keyword.lower() in review_lower:
-                    resources.append({
-                        'title': issue_data['title'],
-                        'url': issue_data['url'],
-                        'description': issue_data.get('description', '')
-                    })
-                    break
+        return [
+            {
+                'title': common_issues[key]['title'],
+                'url': common_issues[key]['url'],
+                'description': common_issues[key].get('description', ''),
+                'hits': hits[key]
+            }
+            for key in ranked
+        ]
+    
+    def resources_for_findings(self, findings: List[Dict]) -> List[Dict]:
+        """
+        Learning resources for structured findings: categories naming a catalog issue count
+        as a hit, plus keyword matches on the category and issue text (not the fix)
+        """
+        text = '\n'.join(f"{finding['category'].replace('_', ' ')}: {finding['issue']}" for finding in findings)
+        resources = self.enhance_review_with_resources(text)
+        
+        common_issues = self.get_common_issues()
+        by_title = {resource['title']: resource for resource in resources}
+        for finding in findings:
+            issue_data = common_issues.get(finding['category'])
+            if not issue_data:
+                continue
+            resource = by_title.get(issue_data['title'])
+            if resource is None:
+                resource = by_title[issue_data['title']] = {
+                    'title': issue_data['title'],
+                    'url': issue_data['url'],
+                    'description': issue_data.get('description', ''),
+                    'hits': 0
+                }
+            resource['hits'] += 1
         
-        return resources
+        return sorted(by_title.values(), key=lambda resource: -resource['hits'])
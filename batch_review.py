@@ -0,0 +1,366 @@
+"""
+Offline batch review mode for non-urgent sweeps
+Review requests are submitted as one OpenAI Batch API job (half price, separate rate limits)
+and the results are posted once the batch completes. Both phases checkpoint to a JSON state
+file, so an interrupted submit or collect can simply be run again. With request_coalescing,
+small reviews sharing a system prompt are packed into one batch request each.
+"""
+
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from clients import OpenAIClient
+from coalescing import ReviewCoalescer
+from pipeline import local_only, local_rules_review, merge_local_findings, prepare_review, publish_review
+from reviewer_factory import ReviewerFactory
+from utils import logger
+
+
+# Batch statuses after which no more results will arrive
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchReviewRunner:
+    """Resumable submit/collect driver for Batch API reviews"""
+    
+    def __init__(
+        self,
+        ai_client: OpenAIClient,
+        config: Config,
+        client_factory: Callable[[str, str], object],
+        state_path: str = '.codewise/batch_state.json'
+    ):
+        self.ai_client = ai_client
+        self.config = config
+        # (workspace, repo) -> BitbucketClient; lets one batch span several repositories
+        self.client_factory = client_factory
+        self.state_path = state_path
+        self.coalescer = ReviewCoalescer.from_config(config)
+        self.state = self._load_state()
+    
+    def _load_state(self) -> Dict:
+        """Load the checkpoint of a previous run, or start a fresh one"""
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            logger.info("Resuming batch state from %s", self.state_path)
+            return state
+        return {'batch_id': None, 'input_file_id': None, 'requests': {}}
+    
+    def _save_state(self):
+        """Write the checkpoint atomically so a crash never leaves a truncated file"""
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+    
+    def _artifact_path(self, suffix: str) -> str:
+        return f"{os.path.splitext(self.state_path)[0]}.{suffix}.jsonl"
+    
+    def submit(self, targets: List[Tuple[str, str, str]]) -> Optional[str]:
+        """
+        Prepare prompts for (workspace, repo, pr_id) targets and submit them as one batch
+        Returns the batch id, or None when nothing needed an LLM review
+        """
+        if self.state.get('batch_id'):
+            logger.info("Batch %s already submitted, run collect next", self.state['batch_id'])
+            return self.state['batch_id']
+        
+        requests = self.state['requests']
+        for workspace, repo, pr_id in targets:
+            custom_id = f"{workspace}/{repo}#{pr_id}"
+            if custom_id in requests:
+                # Prepared by an earlier, interrupted run
+                continue
+            
+            logger.info("Preparing %s...", custom_id)
+            bb_client = self.client_factory(workspace, repo)
+            try:
+                prepared = prepare_review(bb_client, pr_id, self.config)
+            except Exception as e:
+                logger.error("Failed to prepare %s: %s", custom_id, e)
+                continue
+            
+            entry = {'workspace': workspace, 'repo': repo, 'pr_id': pr_id}
+            if prepared is None:
+                entry['status'] = 'skipped'
+            else:
+                entry.update({
+                    'status': 'prepared',
+                    'pr_details': prepared['pr_details'],
+                    'diff_stats': prepared['diff_stats'],
+                    'language': prepared['language'],
+                    'language_name': prepared['language_name'],
+                    'structured': prepared['structured']
+                })
+                if local_only(prepared):
+                    # Settled by the local rules, nothing to send to the batch
+                    requests[custom_id] = entry
+                    review_content, input_tokens, output_tokens, cached_tokens = local_rules_review(prepared, self.config)
+                    usage = {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'cached_tokens': cached_tokens}
+                    self._publish_entry(custom_id, entry, review_content, usage, batch=False)
+                    continue
+                entry['local_findings'] = (prepared.get('local_rules') or {}).get('findings', [])
+                entry['request'] = self.ai_client.build_batch_request(
+                    custom_id,
+                    prepared['system_prompt'],
+                    prepared['user_prompt'],
+                    json_output=prepared['structured']
+                )
+            requests[custom_id] = entry
+            self._save_state()
+        
+        pending = [entry for entry in requests.values() if entry['status'] == 'prepared']
+        if not pending:
+            logger.info("No reviews to submit")
+            return None
+        
+        if not self.state.get('input_file_id'):
+            input_path = self._artifact_path('input')
+            with open(input_path, 'w') as f:
+                for request in self._batch_requests(pending):
+                    f.write(json.dumps(request) + '\n')
+            self.state['input_file_id'] = self.ai_client.upload_batch_file(input_path)
+            self._save_state()
+        
+        self.state['batch_id'] = self.ai_client.create_batch(
+            self.state['input_file_id'],
+            completion_window=self.config.get('batch_completion_window', '24h')
+        )
+        for entry in pending:
+            entry['status'] = 'submitted'
+            # The request now lives server-side, keep the checkpoint small; packed reviews keep
+            # theirs (small by definition) in case the shared answer leaves them out
+            if 'pack' not in entry:
+                del entry['request']
+        self._save_state()
+        
+        logger.info("Submitted batch %s with %s reviews in %s requests", self.state['batch_id'], len(pending),
+                    len(pending) - sum(len(pack['members']) - 1 for pack in self.state.get('packs', {}).values()))
+        return self.state['batch_id']
+    
+    def _batch_requests(self, pending: List[Dict]) -> List[Dict]:
+        """Batch input lines for the pending reviews, packing small ones when coalescing is enabled"""
+        if self.coalescer is None:
+            return [entry['request'] for entry in pending]
+        
+        by_id = {}
+        items = []
+        for entry in pending:
+            request = entry['request']
+            custom_id = request['custom_id']
+            by_id[custom_id] = entry
+            messages = request['body']['messages']
+            items.append((custom_id, messages[0]['content'], messages[1]['content'], entry['structured']))
+        
+        requests = []
+        packs = self.state.setdefault('packs', {})
+        for members in self.coalescer.pack(items):
+            if len(members) == 1:
+                requests.append(by_id[members[0]]['request'])
+                continue
+            pack_id = f"pack-{len(packs) + 1}"
+            user_prompts = [by_id[custom_id]['request']['body']['messages'][1]['content'] for custom_id in members]
+            first = by_id[members[0]]
+            request = self.ai_client.build_batch_request(
+                pack_id,
+                first['request']['body']['messages'][0]['content'],
+                self.coalescer.combine(user_prompts, first['structured']),
+                json_output=first['structured']
+            )
+            request['body']['max_tokens'] = self.coalescer.output_tokens(
+                self.ai_client.max_tokens, len(members), request['body']['model']
+            )
+            requests.append(request)
+            packs[pack_id] = {'members': members, 'prompt_sizes': [len(prompt) for prompt in user_prompts]}
+            for custom_id in members:
+                by_id[custom_id]['pack'] = pack_id
+        return requests
+    
+    def collect(self, wait: bool = True, poll_interval: Optional[int] = None) -> int:
+        """
+        Wait for the batch, then format and post every review not posted yet
+        Returns the number of reviews posted by this call
+        """
+        batch_id = self.state.get('batch_id')
+        if not batch_id:
+            logger.warning("No submitted batch to collect")
+            return 0
+        
+        poll_interval = poll_interval or self.config.get('batch_poll_interval', 60)
+        while True:
+            batch = self.ai_client.get_batch(batch_id)
+            if batch.status in TERMINAL_STATUSES:
+                break
+            if not wait:
+                logger.info("Batch %s is %s, collect again later", batch_id, batch.status)
+                return 0
+            logger.info("Batch %s is %s, checking again in %ss", batch_id, batch.status, poll_interval)
+            time.sleep(poll_interval)
+        
+        logger.info("Batch %s finished with status %s", batch_id, batch.status)
+        output_path = self._download(batch.output_file_id, 'output')
+        posted = 0
+        if output_path:
+            with open(output_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        posted += self._publish_result(json.loads(line))
+        
+        # Requests the API rejected are only listed in the error file
+        error_path = self._download(getattr(batch, 'error_file_id', None), 'errors')
+        if error_path:
+            with open(error_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        self._record_error(json.loads(line))
+        
+        # Anything still waiting has no result and never will
+        for custom_id, entry in self.state['requests'].items():
+            if entry['status'] == 'submitted':
+                entry['status'] = 'failed'
+                entry['error'] = f"no result (batch {batch.status})"
+                logger.warning("No batch result for %s", custom_id)
+        self._save_state()
+        
+        if self.coalescer is not None:
+            self.coalescer.log_stats()
+        logger.info("Posted %s reviews from batch %s", posted, batch_id)
+        logger.info("Batch run finished; use a new --batch-state (or remove %s) for the next sweep", self.state_path)
+        return posted
+    
+    def _download(self, file_id: Optional[str], suffix: str) -> Optional[str]:
+        """Keep a batch output or error file next to the state file (once); returns its path, or None"""
+        path = self._artifact_path(suffix)
+        if not os.path.exists(path) and file_id:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(self.ai_client.get_file_text(file_id))
+            os.replace(tmp_path, path)
+        return path if os.path.exists(path) else None
+    
+    def _record_error(self, result: Dict):
+        """Mark the reviews of a failed batch request (every review of a packed one) failed with the API's message"""
+        custom_id = result.get('custom_id')
+        body = (result.get('response') or {}).get('body') or {}
+        error = result.get('error') or (body.get('error') if isinstance(body, dict) else None) or {}
+        message = error.get('message') if isinstance(error, dict) else str(error)
+        message = message or f"status {(result.get('response') or {}).get('status_code')}"
+        
+        pack = self.state.get('packs', {}).get(custom_id)
+        for member in (pack['members'] if pack else [custom_id]):
+            entry = self.state['requests'].get(member)
+            if entry and entry['status'] in ('submitted', 'post_failed'):
+                entry['status'] = 'failed'
+                entry['error'] = f"batch request failed: {message}"
+                logger.error("Batch request for %s failed: %s", member, message)
+    
+    def _publish_result(self, result: Dict) -> int:
+        """Post one batch result (every review of a packed result) through the normal formatter; returns the number posted"""
+        custom_id = result.get('custom_id')
+        pack = self.state.get('packs', {}).get(custom_id)
+        if pack is not None:
+            return self._publish_pack(result, pack)
+        
+        entry = self.state['requests'].get(custom_id)
+        # Posted by an earlier collect, or not ours
+        if not entry or entry['status'] not in ('submitted', 'post_failed'):
+            return 0
+        
+        try:
+            review_content, usage = OpenAIClient.parse_batch_result(result)
+        except ValueError as e:
+            logger.error(str(e))
+            entry['status'] = 'failed'
+            entry['error'] = str(e)
+            self._save_state()
+            return 0
+        return int(self._publish_entry(custom_id, entry, review_content, usage, batch=True))
+    
+    def _publish_pack(self, result: Dict, pack: Dict) -> int:
+        """
+        Split a packed result and post each review; reviews the answer does not cover are
+        requested again on their own (at the regular price). Returns the number posted
+        """
+        members = [(custom_id, self.state['requests'].get(custom_id)) for custom_id in pack['members']]
+        if not any(entry and entry['status'] in ('submitted', 'post_failed') for _, entry in members):
+            return 0
+        
+        coalescer = self.coalescer or ReviewCoalescer()
+        structured = members[0][1].get('structured', False)
+        try:
+            content, usage = OpenAIClient.parse_batch_result(result)
+            answers = coalescer.split(content, len(members), structured)
+        except ValueError as e:
+            logger.error(str(e))
+            answers, usage = {}, {'input_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0}
+        
+        shares = coalescer.distribute(
+            pack['prompt_sizes'], answers, usage['input_tokens'], usage['output_tokens'], usage['cached_tokens']
+        )
+        
+        posted = 0
+        for (custom_id, entry), share in zip(members, shares):
+            if not entry or entry['status'] not in ('submitted', 'post_failed'):
+                continue
+            if share is not None:
+                review_content, input_tokens, output_tokens, cached_tokens = share
+                usage = {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'cached_tokens': cached_tokens}
+                posted += self._publish_entry(custom_id, entry, review_content, usage, batch=True)
+                continue
+            
+            logger.warning("No review for %s in the answer of %s, requesting it separately", custom_id, result.get('custom_id'))
+            messages = entry['request']['body']['messages']
+            try:
+                review_content, input_tokens, output_tokens, cached_tokens = self.ai_client.review_code(
+                    messages[0]['content'], messages[1]['content'], json_output=structured
+                )
+            except Exception as e:
+                logger.error("Separate review of %s failed: %s", custom_id, e)
+                entry['status'] = 'failed'
+                entry['error'] = str(e)
+                self._save_state()
+                continue
+            usage = {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'cached_tokens': cached_tokens}
+            posted += self._publish_entry(custom_id, entry, review_content, usage, batch=False)
+        return posted
+    
+    def _publish_entry(self, custom_id: str, entry: Dict, review_content: str, usage: Dict, batch: bool) -> bool:
+        """Post the review of one state entry; returns True if posted"""
+        prepared = {
+            'pr_details': entry['pr_details'],
+            'diff_stats': entry['diff_stats'],
+            'language_name': entry['language_name'],
+            'structured': entry.get('structured', False),
+            'reviewer': ReviewerFactory.create_reviewer(entry['language'], self.config.config),
+            'local_rules': {'findings': entry.get('local_findings', [])}
+        }
+        review_content = merge_local_findings(prepared, review_content, self.config)
+        try:
+            was_posted = publish_review(
+                self.client_factory(entry['workspace'], entry['repo']),
+                entry['pr_id'],
+                self.config,
+                prepared,
+                review_content,
+                usage['input_tokens'],
+                usage['output_tokens'],
+                cached_tokens=usage['cached_tokens'],
+                batch=batch
+            )
+        except Exception as e:
+            # Retried by the next collect
+            logger.error("Failed to post review for %s: %s", custom_id, e)
+            entry['status'] = 'post_failed'
+            self._save_state()
+            return False
+        
+        entry['status'] = 'posted' if was_posted else 'held_back'
+        entry.pop('request', None)
+        entry.pop('local_findings', None)
+        self._save_state()
+        return was_posted
@@ -0,0 +1,275 @@
+"""
+Two-tier model cascade
+A cheap triage model looks at every file (or hunk) of the PR and flags what needs a deeper look;
+only the flagged units are reviewed by the stronger model. Findings of both tiers are merged
+into one review, and the escalation rate, latency and cost of each tier are reported.
+"""
+
+import fnmatch
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from clients import OpenAIClient
+from config import Config
+from diff_compaction import estimate_tokens
+from findings import SEVERITIES, STRUCTURED_OUTPUT_INSTRUCTIONS, load_json_document, normalize_findings, parse_findings
+from formatters import CommentFormatter
+from rule_engine import reported_lines_note
+from utils import calculate_cost, logger
+
+
+TRIAGE_SYSTEM_PROMPT = """You are a fast first-pass code reviewer for {language} changes.
+Decide whether the change below needs an in-depth review by a senior reviewer: escalate anything
+touching security (authentication, authorization, input handling, SQL, shell, file paths,
+deserialization, secrets), concurrency, money, data migrations, or non-trivial logic you cannot
+fully verify. Trivial, mechanical or cosmetic changes do not need escalation.
+Also report any obvious issues you can already see.
+
+{instructions}
+Add two keys to the object: "escalate": true|false and "reason": "<why, a few words>"."""
+
+TRIAGE_NOTE = "*🔎 Files below were only checked by the triage model ({model}).*"
+
+
+def split_units(diff: str, unit: str = 'file') -> List[Tuple[str, str]]:
+    """Split a unified diff into (path, diff) units: one per file, or one per hunk with its file header"""
+    units = []
+    for block in diff.split('\ndiff --git'):
+        if not block.strip():
+            continue
+        if not block.startswith('diff --git'):
+            block = 'diff --git' + block
+        block = block.rstrip('\n') + '\n'
+        first_line = block.split('\n', 1)[0]
+        path = first_line.rsplit(' b/', 1)[-1] if ' b/' in first_line else first_line
+        
+        hunk_start = block.find('\n@@')
+        if unit != 'hunk' or hunk_start < 0:
+            units.append((path, block))
+            continue
+        
+        header, hunks = block[:hunk_start + 1], block[hunk_start + 1:]
+        for hunk in ('\n' + hunks).split('\n@@')[1:]:
+            units.append((path, header + '@@' + hunk.rstrip('\n') + '\n'))
+    return units
+
+
+class ModelCascade:
+    """Triage every unit with the cheap model, escalate flagged units to the strong model"""
+    
+    def __init__(self, ai_client: OpenAIClient, settings: Dict):
+        self.triage_model = settings.get('triage_model', 'gpt-4o-mini')
+        self.review_model = settings.get('review_model', ai_client.model)
+        self.unit = settings.get('unit', 'file')
+        self.escalate_severities = set(settings.get('escalate_severities', ['critical']))
+        self.min_confidence = settings.get('min_confidence', 0.6)
+        self.always_escalate = settings.get('always_escalate', []) or []
+        self.max_parallel = settings.get('max_parallel', 4)
+        self.report_path = settings.get('report_path')
+        self.triage_client = ai_client.with_model(self.triage_model, settings.get('triage_max_tokens', 800))
+        self.review_client = ai_client.with_model(self.review_model)
+    
+    @property
+    def model_label(self) -> str:
+        return f"{self.triage_model} → {self.review_model}"
+    
+    @staticmethod
+    def from_config(ai_client: OpenAIClient, config: Config) -> Optional['ModelCascade']:
+        settings = config.get('cascade', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        return ModelCascade(ai_client, settings)
+    
+    def _should_escalate(self, path: str, answer: Optional[Dict], findings: List[Dict]) -> Tuple[bool, str]:
+        """Escalation rule: pattern match, unusable triage answer, model request, severity or low confidence"""
+        if any(fnmatch.fnmatch(path, pattern) for pattern in self.always_escalate):
+            return True, "matches always_escalate"
+        if answer is None:
+            return True, "triage answer unusable"
+        if answer.get('escalate') is True or str(answer.get('escalate')).lower() == 'true':
+            return True, str(answer.get('reason') or 'flagged by triage')
+        for finding in findings:
+            if finding['severity'] in self.escalate_severities:
+                return True, f"{finding['severity']} finding"
+            if finding['confidence'] < self.min_confidence:
+                return True, "low-confidence finding"
+        return False, str(answer.get('reason') or '')
+    
+    def _triage_unit(self, system_prompt: str, prepared: Dict, path: str, unit_diff: str) -> Dict:
+        """Triage one unit; each call gets its own client copy so usage is not shared across threads"""
+        client = self.triage_client.with_model(self.triage_model)
+        user_prompt = prepared['reviewer'].format_user_prompt(
+            prepared['pr_details'], unit_diff, None, prepared['framework']
+        )
+        start = time.monotonic()
+        answer, findings = None, []
+        usage = {'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0}
+        try:
+            content, input_tokens, output_tokens, cached_tokens = client.review_code(system_prompt, user_prompt, json_output=True)
+            usage = {'input_tokens': input_tokens, 'cached_tokens': cached_tokens, 'output_tokens': output_tokens}
+            answer = load_json_document(content)
+            findings = normalize_findings(answer)['findings']
+        except Exception as e:
+            logger.warning("Triage of %s failed, escalating: %s", path, e)
+        
+        escalate, reason = self._should_escalate(path, answer, findings)
+        for finding in findings:
+            finding['file'] = finding['file'] or path
+        return {
+            'path': path,
+            'diff': unit_diff,
+            'escalate': escalate,
+            'reason': reason,
+            'findings': findings,
+            'usage': usage,
+            'latency': time.monotonic() - start
+        }
+    
+    def run(self, prepared: Dict) -> Tuple[str, int, int, int, Dict]:
+        """
+        Review a prepared PR through both tiers
+        Returns (content, input_tokens, output_tokens, cached_tokens, report); content is JSON in
+        structured mode and markdown otherwise, like a single-model review
+        """
+        units = split_units(prepared.get('prompt_diff', prepared['diff']), self.unit)
+        triage_prompt = TRIAGE_SYSTEM_PROMPT.format(
+            language=prepared['language_name'],
+            instructions=STRUCTURED_OUTPUT_INSTRUCTIONS
+        )
+        
+        logger.info("Cascade: triaging %s %ss with %s...", len(units), self.unit, self.triage_model)
+        triage_start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_parallel, len(units) or 1))) as executor:
+            results = list(executor.map(
+                lambda item: self._triage_unit(triage_prompt, prepared, item[0], item[1]),
+                units
+            ))
+        triage_latency = time.monotonic() - triage_start
+        
+        escalated = [result for result in results if result['escalate']]
+        kept = [result for result in results if not result['escalate']]
+        for result in escalated:
+            logger.info("Cascade: escalating %s (%s)", result['path'], result['reason'])
+        
+        review_content, review_usage, review_latency = None, {'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0}, 0.0
+        if escalated:
+            if len(escalated) == len(results):
+                user_prompt = prepared['user_prompt']
+            else:
+                escalated_paths = {result['path'] for result in escalated}
+                full_files = {
+                    path: content for path, content in (prepared.get('full_files') or {}).items()
+                    if path in escalated_paths
+                }
+                user_prompt = prepared['reviewer'].format_user_prompt(
+                    prepared['pr_details'],
+                    ''.join(result['diff'] for result in escalated),
+                    full_files or None,
+                    prepared['framework'],
+                    prepared.get('symbol_context')
+                )
+                if prepared.get('local_rules') and not prepared.get('structured'):
+                    user_prompt += reported_lines_note([
+                        finding for finding in prepared['local_rules']['findings'] if finding['file'] in escalated_paths
+                    ])
+            logger.info("Cascade: reviewing %s escalated %ss with %s...", len(escalated), self.unit, self.review_model)
+            review_start = time.monotonic()
+            review_content, input_tokens, output_tokens, cached_tokens = self.review_client.review_code(
+                prepared['system_prompt'],
+                user_prompt,
+                json_output=prepared.get('structured', False)
+            )
+            review_usage = {'input_tokens': input_tokens, 'cached_tokens': cached_tokens, 'output_tokens': output_tokens}
+            review_latency = time.monotonic() - review_start
+        
+        content = self._merge(prepared, review_content, kept)
+        report = self._report(prepared, results, escalated, triage_latency, review_usage, review_latency)
+        
+        input_tokens = report['triage']['input_tokens'] + report['review']['input_tokens']
+        output_tokens = report['triage']['output_tokens'] + report['review']['output_tokens']
+        cached_tokens = report['triage']['cached_tokens'] + report['review']['cached_tokens']
+        return content, input_tokens, output_tokens, cached_tokens, report
+    
+    def _merge(self, prepared: Dict, review_content: Optional[str], kept: List[Dict]) -> str:
+        """Combine the strong model's review with triage findings of units that were not escalated"""
+        triage_findings = [finding for result in kept for finding in result['findings']]
+        triage_findings.sort(key=lambda finding: SEVERITIES.index(finding['severity']))
+        
+        if prepared.get('structured'):
+            document = {'summary': '', 'findings': []}
+            if review_content is not None:
+                try:
+                    document = parse_findings(review_content)
+                except ValueError as e:
+                    logger.warning("Strong-tier findings could not be parsed, merging as markdown: %s", e)
+                    document = None
+            if document is not None:
+                document['findings'] += triage_findings
+                return json.dumps(document)
+        
+        parts = [review_content] if review_content else []
+        if triage_findings or not parts:
+            if parts:
+                parts.append(TRIAGE_NOTE.format(model=self.triage_model))
+            parts.append(CommentFormatter.format_findings({'summary': '', 'findings': triage_findings}))
+        return '\n\n'.join(part.strip() for part in parts) + '\n'
+    
+    def _report(
+        self,
+        prepared: Dict,
+        results: List[Dict],
+        escalated: List[Dict],
+        triage_latency: float,
+        review_usage: Dict,
+        review_latency: float
+    ) -> Dict:
+        """Per-tier tokens, latency and cost, escalation rate and savings against a single strong-model pass"""
+        triage = {'model': self.triage_model, 'calls': len(results), 'latency': triage_latency,
+                  'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0}
+        for result in results:
+            for key in ('input_tokens', 'cached_tokens', 'output_tokens'):
+                triage[key] += result['usage'][key]
+        triage['cost'] = calculate_cost(triage['input_tokens'], triage['output_tokens'], self.triage_model, triage['cached_tokens'])
+        
+        review = {'model': self.review_model, 'calls': 1 if escalated else 0, 'latency': review_latency}
+        review.update(review_usage)
+        review['cost'] = calculate_cost(review['input_tokens'], review['output_tokens'], self.review_model, review['cached_tokens'])
+        
+        if len(escalated) == len(results):
+            # The strong model got the full prompt: that was the single-tier call
+            single_tier_cost = review['cost']
+        else:
+            # Estimate: the full prompt read by the strong model, answered at its configured max_tokens
+            single_tier_cost = calculate_cost(
+                estimate_tokens(prepared['system_prompt']) + estimate_tokens(prepared['user_prompt']),
+                self.review_client.max_tokens,
+                self.review_model
+            )
+        total_cost = triage['cost'] + review['cost']
+        report = {
+            'units': len(results),
+            'escalated': len(escalated),
+            'escalation_rate': len(escalated) / len(results) if results else 0.0,
+            'triage': triage,
+            'review': review,
+            'total_cost': total_cost,
+            'single_tier_cost_estimate': single_tier_cost,
+            'savings': single_tier_cost - total_cost,
+            'model_label': self.model_label
+        }
+        
+        logger.info(
+            "Cascade: escalated %s/%s %ss (%.0f%%); triage %.1fs $%.4f, review %.1fs $%.4f; "
+            "saved ~$%.4f vs ~$%.4f for %s alone",
+            report['escalated'], report['units'], self.unit, report['escalation_rate'] * 100,
+            triage['latency'], triage['cost'], review['latency'], review['cost'],
+            report['savings'], single_tier_cost, self.review_model
+        )
+        if self.report_path:
+            os.makedirs(os.path.dirname(self.report_path) or '.', exist_ok=True)
+            with open(self.report_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(report, timestamp=time.time())) + '\n')
+        return report
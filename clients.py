@@ -2,42 +2,78 @@
 API clients for Bitbucket and OpenAI
 """
 
+import copy
 import time
 import requests
-from typing import Dict, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
 from openai import OpenAI
-from utils import logger, sanitize_log
+from archive import archive_url, read_members
+from comment_posting import CommentPoster
+from deadline import Deadline, DeadlineExceeded
+from file_cache import FileContentCache
+from resilience import LLMResilience
+from utils import logger
 
 
 class BitbucketClient:
     """Bitbucket API client"""
     
-    def __init__(self, workspace: str, repo: str, token: str):
+    def __init__(self, workspace: str, repo: str, token: str, base_url: str = "https://api.bitbucket.org/2.0",
+                 archive_threshold: int = 20, file_cache: Optional[FileContentCache] = None,
+                 deadline: Optional[Deadline] = None, comment_poster: Optional[CommentPoster] = None):
         self.workspace = workspace
         self.repo = repo
         self.token = token
-        self.base_url = "https://api.bitbucket.org/2.0"
+        self.base_url = base_url
+        # get_files_content reads this many files or more from one archive download (0 = never)
+        self.archive_threshold = archive_threshold
+        # Contents read at a commit hash are served from and stored in this cache
+        self.file_cache = file_cache
+        # Run deadline every request timeout and retry is clamped to
+        self.deadline = deadline
+        # Splits long comments into parts and updates earlier ones instead of posting duplicates
+        self.comment_poster = comment_poster or CommentPoster()
         self.headers = {
             "Authorization": f"Bearer {token}",
             "Accept": "application/json"
         }
     
-    def _request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
-        """Make HTTP request with retries"""
-        url = f"{self.base_url}{endpoint}"
-        max_retries = 3
+    @staticmethod
+    def from_config(workspace: str, repo: str, token: str, config, **kwargs) -> 'BitbucketClient':
+        return BitbucketClient(
+            workspace, repo, token,
+            archive_threshold=config.get('archive_threshold', 20),
+            file_cache=FileContentCache.from_config(config),
+            comment_poster=CommentPoster.from_config(config),
+            **kwargs
+        )
+    
+    def _request(self, method: str, endpoint: str, final: bool = False, max_retries: int = 3, **kwargs) -> requests.Response:
+        """
+        Make HTTP request with retries
+        final requests (posting the review) may use the deadline's reserve
+        """
+        url = endpoint if endpoint.startswith('http') else f"{self.base_url}{endpoint}"
         
         for attempt in range(max_retries):
+            timeout = self.deadline.timeout(30, f"{method} {endpoint}", final) if self.deadline else 30
             try:
-                logger.debug(f"API request: {method} {sanitize_log(url)}")
-                response = requests.request(method, url, headers=self.headers, timeout=30, **kwargs)
+                logger.debug("API request: %s %s", method, url)
+                response = requests.request(method, url, headers=self.headers, timeout=timeout, **kwargs)
                 response.raise_for_status()
                 return response
             except requests.exceptions.RequestException as e:
+                status = e.response.status_code if e.response is not None else None
+                # Client errors other than rate limiting (missing files, bad paths) do not go away on retry
+                if status is not None and 400 <= status < 500 and status != 429:
+                    raise
                 if attempt == max_retries - 1:
-                    logger.error(f"Bitbucket API request failed after {max_retries} attempts: {e}")
+                    logger.error("Bitbucket API request failed after %s attempts: %s", max_retries, e)
                     raise
-                logger.warning(f"Retry {attempt + 1}/{max_retries} after error: {e}")
+                if self.deadline and not self.deadline.allows_wait(2 ** attempt, final):
+                    raise DeadlineExceeded(f"Run deadline leaves no time to retry {method} {endpoint}: {e}") from e
+                logger.warning("Retry %s/%s after error: %s", attempt + 1, max_retries, e)
                 time.sleep(2 ** attempt)
     
     def get_pr_details(self, pr_id: str) -> Dict:
@@ -52,65 +88,395 @@ class BitbucketClient:
         response = self._request("GET", endpoint)
         return response.text
     
+    def get_pr_diffstat(self, pr_id: str) -> List[Dict]:
+        """Fetch per-file diffstat entries (paths and line counts), following pagination"""
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/diffstat"
+        params = {'pagelen': 500}
+        entries = []
+        
+        while endpoint:
+            data = self._request("GET", endpoint, params=params).json()
+            entries.extend(data.get('values', []))
+            # The 'next' link already carries the query string
+            endpoint = data.get('next')
+            params = None
+        
+        return entries
+    
+    def get_pr_diff_for_files(self, pr_id: str, filepaths: List[str], max_workers: int = 8) -> str:
+        """Fetch the PR diff for the given files only, one request per file in parallel"""
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/diff"
+        
+        def fetch(filepath: str) -> str:
+            response = self._request("GET", endpoint, params={'path': filepath})
+            return self._extract_file_diff(response.text, filepath)
+        
+        if not filepaths:
+            return ""
+        
+        workers = max(1, min(max_workers, len(filepaths)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            file_diffs = list(executor.map(fetch, filepaths))
+        
+        return ''.join(d if d.endswith('\n') else d + '\n' for d in file_diffs if d)
+    
+    @staticmethod
+    def _extract_file_diff(diff_text: str, filepath: str) -> str:
+        """Keep only the diff block of filepath, in case the server ignored the path filter"""
+        if not diff_text.startswith('diff --git') or diff_text.count('\ndiff --git') == 0:
+            return diff_text
+        
+        block = []
+        in_block = False
+        for line in diff_text.split('\n'):
+            if line.startswith('diff --git'):
+                in_block = line.endswith(f" b/{filepath}")
+            if in_block:
+                block.append(line)
+        return '\n'.join(block)
+    
+    def _cache_for(self, ref: str) -> Optional[FileContentCache]:
+        """The file cache when contents at ref are immutable (a commit hash)"""
+        if self.file_cache is not None and FileContentCache.cacheable(ref):
+            return self.file_cache
+        return None
+    
     def get_file_content(self, filepath: str, branch: str) -> str:
-        """Fetch full file content from a specific branch"""
+        """Fetch full file content from a specific branch or commit"""
+        cache = self._cache_for(branch)
+        if cache is not None:
+            content = cache.get(branch, filepath)
+            if content is not None:
+                return content
+        
+        content = self._fetch_file_content(filepath, branch)
+        if cache is not None and content:
+            cache.put(branch, filepath, content)
+        return content
+    
+    def _fetch_file_content(self, filepath: str, branch: str) -> str:
         endpoint = f"/repositories/{self.workspace}/{self.repo}/src/{branch}/{filepath}"
         try:
             response = self._request("GET", endpoint)
             return response.text
         except Exception as e:
-            logger.warning(f"Failed to fetch {filepath}: {e}")
+            logger.warning("Failed to fetch %s: %s", filepath, e)
             return ""
     
-    def post_comment(self, pr_id: str, content: str) -> Dict:
-        """Post comment on PR"""
+    def get_files_content(self, filepaths: List[str], branch: str, max_workers: int = 8) -> Dict[str, str]:
+        """
+        Fetch several files: cached ones from file_cache, the rest from the branch archive
+        above archive_threshold files, else in parallel per file
+        """
+        cache = self._cache_for(branch)
+        cached = cache.get_many(branch, filepaths) if cache is not None else {}
+        missing = [filepath for filepath in filepaths if filepath not in cached]
+        if not missing:
+            return cached
+        
+        contents = None
+        if self.archive_threshold and len(missing) >= self.archive_threshold:
+            try:
+                contents = self.get_archive_contents(missing, branch)
+                logger.info("Read %s of %s files from the archive of %s", len(contents), len(missing), branch)
+            except Exception as e:
+                logger.warning("Archive retrieval failed, fetching %s files one by one: %s", len(missing), e)
+        
+        if contents is None:
+            workers = max(1, min(max_workers, len(missing)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                fetched = list(executor.map(lambda filepath: self._fetch_file_content(filepath, branch), missing))
+            contents = {filepath: content for filepath, content in zip(missing, fetched) if content}
+        
+        if cache is not None:
+            for filepath, content in contents.items():
+                cache.put(branch, filepath, content)
+        contents.update(cached)
+        return {filepath: contents[filepath] for filepath in filepaths if filepath in contents}
+    
+    def get_archive_contents(self, filepaths: List[str], branch: str) -> Dict[str, str]:
+        """Download the branch archive once and stream-extract only the given files"""
+        url = archive_url(self.base_url, self.workspace, self.repo, branch)
+        logger.debug("Archive request: GET %s", url)
+        headers = {**self.headers, "Accept": "application/x-gzip, */*"}
+        timeout = self.deadline.timeout(30, "archive download") if self.deadline else 30
+        with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            # Undo transfer compression only; the tar.gz itself is decompressed by tarfile
+            response.raw.decode_content = True
+            return read_members(response.raw, filepaths)
+    
+    def list_directory(self, dirpath: str, branch: str) -> Dict[str, Optional[str]]:
+        """Files directly in a directory at a branch, mapped to their blob hash (not provided by Bitbucket)"""
+        directory = f"{dirpath.strip('/')}/" if dirpath.strip('/') else ''
+        url = f"/repositories/{self.workspace}/{self.repo}/src/{branch}/{directory}?pagelen=100"
+        files = {}
+        while url:
+            data = self._request("GET", url).json()
+            files.update({entry['path']: None for entry in data.get('values', []) if entry.get('type') == 'commit_file'})
+            url = data.get('next')
+        return files
+    
+    def list_comments(self, pr_id: str) -> List[Dict]:
+        """All comments on a PR, following pagination"""
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/comments"
+        params = {'pagelen': 100}
+        comments = []
+        while endpoint:
+            data = self._request("GET", endpoint, final=True, params=params).json()
+            comments.extend(data.get('values', []))
+            # The next link already carries the query parameters
+            endpoint = data.get('next')
+            params = None
+        return comments
+    
+    def create_comment(self, pr_id: str, content: str) -> Dict:
+        """POST one comment; not retried here, CommentPoster checks whether a failed POST landed first"""
         endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/comments"
-        data = {"content": {"raw": content}}
-        response = self._request("POST", endpoint, json=data)
+        response = self._request("POST", endpoint, final=True, max_retries=1, json={"content": {"raw": content}})
+        return response.json()
+    
+    def update_comment(self, pr_id: str, comment_id: int, content: str) -> Dict:
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/comments/{comment_id}"
+        response = self._request("PUT", endpoint, final=True, json={"content": {"raw": content}})
         return response.json()
+    
+    def delete_comment(self, pr_id: str, comment_id: int):
+        endpoint = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/comments/{comment_id}"
+        try:
+            self._request("DELETE", endpoint, final=True)
+        except requests.exceptions.HTTPError as e:
+            # Already gone (a retried DELETE, or removed by hand)
+            if e.response is None or e.response.status_code != 404:
+                raise
+    
+    def post_comment(self, pr_id: str, content: str, key: Optional[str] = None) -> Dict:
+        """
+        Post comment on PR, split into parts when it is too long; the comments an earlier run
+        posted under the same key are updated instead of posting new ones
+        """
+        return self.comment_poster.publish(self, pr_id, content, key)
 
 
 class OpenAIClient:
     """OpenAI API client"""
     
-    def __init__(self, api_key: str, model: str = "gpt-3.5-turbo", temperature: float = 0.2, max_tokens: int = 2000):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-3.5-turbo",
+        temperature: float = 0.2,
+        max_tokens: int = 2000,
+        base_url: Optional[str] = None,
+        resilience: Optional[LLMResilience] = None,
+        deadline: Optional[Deadline] = None
+    ):
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
+        # Optional hedging / circuit breaking (see resilience.py)
+        self.resilience = resilience
+        # Run deadline; calls are clamped to it and the SDK's own retries are turned off under it
+        self.deadline = deadline
+        # Usage of the most recent call and running totals, including prompt-cache hits
+        self.last_usage = {'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0}
+        self.total_usage = {'calls': 0, 'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0}
+    
+    def with_model(self, model: str, max_tokens: Optional[int] = None) -> 'OpenAIClient':
+        """
+        Client for another model sharing this one's connection pool and resilience policy; the
+        policy keeps breaker and latency state per model, so the two do not affect each other
+        """
+        clone = copy.copy(self)
+        clone.model = model
+        clone.max_tokens = max_tokens or self.max_tokens
+        clone.last_usage = {'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0}
+        clone.total_usage = {'calls': 0, 'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0}
+        return clone
     
-    def review_code(self, system_prompt: str, user_prompt: str) -> Tuple[str, int, int]:
-        """Send code for AI review, returns (response, input_tokens, output_tokens)"""
+    def _record_usage(self, usage) -> Dict:
+        """Read token counts (including cached prompt tokens) from a response's usage block"""
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+        
+        self.last_usage = {
+            'input_tokens': usage.prompt_tokens,
+            'cached_tokens': cached_tokens,
+            'output_tokens': usage.completion_tokens
+        }
+        self.total_usage['calls'] += 1
+        for key, value in self.last_usage.items():
+            self.total_usage[key] += value
+        return self.last_usage
+    
+    def _create_completion(self, model: str, system_prompt: str, user_prompt: str, json_output: bool = False):
+        """One chat completion call"""
+        kwargs = {}
+        client = self.client
+        if self.resilience and self.resilience.request_timeout:
+            kwargs['timeout'] = self.resilience.request_timeout
+        if self.deadline:
+            kwargs['timeout'] = self.deadline.timeout(kwargs.get('timeout'), "the LLM call")
+            client = client.with_options(max_retries=0)
+        if json_output:
+            kwargs['response_format'] = {"type": "json_object"}
+        return client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            **kwargs
+        )
+    
+    def _hedged_completion(self, model: str, system_prompt: str, user_prompt: str, json_output: bool = False):
+        """
+        Call the model; if no response arrives within the hedge delay, send a duplicate
+        request and return whichever succeeds first (the slower one is abandoned)
+        """
+        resilience = self.resilience
+        delay = resilience.hedge_delay(model) if resilience else None
+        
+        def call():
+            start = time.monotonic()
+            response = self._create_completion(model, system_prompt, user_prompt, json_output)
+            if resilience:
+                resilience.record_latency(model, time.monotonic() - start)
+            return response
+        
+        if delay is None:
+            return call()
+        
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            primary = executor.submit(call)
+            futures = {primary}
+            done, _ = wait(futures, timeout=delay)
+            if not done:
+                logger.info("No response after %.1fs, sending hedged request", delay)
+                resilience.count('hedged')
+                futures.add(executor.submit(call))
+            
+            error = None
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is not primary:
+                            resilience.count('hedge_wins')
+                        return future.result()
+                    error = error or future.exception()
+            raise error
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def review_code(self, system_prompt: str, user_prompt: str, json_output: bool = False) -> Tuple[str, int, int, int]:
+        """
+        Send code for AI review, returns (response, input_tokens, output_tokens, cached_tokens),
+        the same contract as AsyncOpenAIClient.review_code
+        json_output requests a JSON object response (structured findings mode)
+        """
         max_retries = 3
         
         for attempt in range(max_retries):
+            model = self.resilience.select_model(self.model) if self.resilience else self.model
             try:
-                logger.debug(f"Calling OpenAI API with model {self.model}")
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=self.temperature,
-                    max_tokens=self.max_tokens
-                )
+                logger.debug("Calling OpenAI API with model %s", model)
+                response = self._hedged_completion(model, system_prompt, user_prompt, json_output)
+                if self.resilience:
+                    self.resilience.record_result(model, self.model, success=True)
                 
                 content = response.choices[0].message.content
-                input_tokens = response.usage.prompt_tokens
-                output_tokens = response.usage.completion_tokens
+                usage = self._record_usage(response.usage)
+                input_tokens = usage['input_tokens']
+                output_tokens = usage['output_tokens']
                 
-                logger.info(f"OpenAI API success: {input_tokens} input tokens, {output_tokens} output tokens")
-                return content, input_tokens, output_tokens
+                logger.info(
+                    "OpenAI API success (%s): %s input tokens (%s cached), %s output tokens",
+                    model, input_tokens, usage['cached_tokens'], output_tokens
+                )
+                return content, input_tokens, output_tokens, usage['cached_tokens']
                 
+            except DeadlineExceeded:
+                # Not the model's fault: no failure is recorded, but a half-open probe must not stay in flight
+                if self.resilience:
+                    self.resilience.release(model, self.model)
+                raise
             except Exception as e:
+                if self.resilience:
+                    self.resilience.record_result(model, self.model, success=False)
+                if self.deadline and attempt < max_retries - 1 and not self.deadline.allows_wait(2 ** (attempt + 1)):
+                    raise DeadlineExceeded(f"Run deadline leaves no time to retry the LLM call: {e}") from e
                 if "rate_limit" in str(e).lower() and attempt < max_retries - 1:
                     wait_time = 2 ** (attempt + 1)
-                    logger.warning(f"Rate limit hit, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
+                    logger.warning("Rate limit hit, waiting %ss before retry %s/%s", wait_time, attempt + 1, max_retries)
                     time.sleep(wait_time)
                 elif attempt == max_retries - 1:
-                    logger.error(f"OpenAI API failed after {max_retries} attempts: {e}")
+                    logger.error("OpenAI API failed after %s attempts: %s", max_retries, e)
                     raise
                 else:
-                    logger.warning(f"OpenAI API error, retry {attempt + 1}/{max_retries}: {e}")
+                    logger.warning("OpenAI API error, retry %s/%s: %s", attempt + 1, max_retries, e)
                     time.sleep(2 ** attempt)
+    
+    def build_batch_request(self, custom_id: str, system_prompt: str, user_prompt: str, json_output: bool = False) -> Dict:
+        """Build one JSONL line of a Batch API job, equivalent to a review_code call"""
+        request = {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens
+            }
+        }
+        if json_output:
+            request["body"]["response_format"] = {"type": "json_object"}
+        return request
+    
+    def upload_batch_file(self, jsonl_path: str) -> str:
+        """Upload a JSONL batch input file, returns the file id"""
+        with open(jsonl_path, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        logger.info("Uploaded batch input %s as %s", jsonl_path, uploaded.id)
+        return uploaded.id
+    
+    def create_batch(self, input_file_id: str, completion_window: str = "24h") -> str:
+        """Create a chat completions batch job, returns the batch id"""
+        batch = self.client.batches.create(
+            input_file_id=input_file_id,
+            endpoint="/v1/chat/completions",
+            completion_window=completion_window
+        )
+        logger.info("Created batch %s (%s)", batch.id, batch.status)
+        return batch.id
+    
+    def get_batch(self, batch_id: str):
+        """Retrieve batch job status"""
+        return self.client.batches.retrieve(batch_id)
+    
+    def get_file_text(self, file_id: str) -> str:
+        """Download a batch output or error file"""
+        return self.client.files.content(file_id).text
+    
+    @staticmethod
+    def parse_batch_result(result: Dict) -> Tuple[str, Dict]:
+        """Extract (content, usage) from one line of a batch output file"""
+        response = result.get('response') or {}
+        if result.get('error') or response.get('status_code') != 200:
+            raise ValueError(f"Batch request {result.get('custom_id')} failed: {result.get('error') or response}")
+        
+        body = response['body']
+        usage = body.get('usage', {})
+        return body['choices'][0]['message']['content'], {
+            'input_tokens': usage.get('prompt_tokens', 0),
+            'cached_tokens': (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0) or 0,
+            'output_tokens': usage.get('completion_tokens', 0)
+        }
@@ -0,0 +1,273 @@
+"""
+Request coalescing of small reviews
+Reviews of small PRs pay the full system prompt and a request round trip each. Prepared reviews
+with the same system prompt (same reviewer, framework and output format) whose prompts are small
+are packed into one request up to a token budget: every unit is delimited by a numbered marker,
+the model answers per unit under matching markers, and the answer is split back out. A unit the
+answer does not cover is reviewed on its own, so coalescing never loses a review.
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+from diff_compaction import estimate_tokens
+from findings import FENCE_PATTERN
+from utils import logger, max_output_tokens
+
+
+UNIT_MARKER = "===== UNIT {number} ====="
+REVIEW_MARKER = "===== REVIEW {number} ====="
+REVIEW_HEADER = re.compile(r'^=+ *REVIEW +(\d+) *=+[ \t]*$', re.MULTILINE)
+
+MARKDOWN_INSTRUCTIONS = """The request below contains {count} independent changes, each starting with a line "{unit}".
+Review every unit on its own, exactly as if it were the only change you were given, and never mix
+findings between units. Answer all {count} units in order, starting the review of each one with
+the line "{review}" (with the unit's number) and nothing else on that line."""
+
+JSON_INSTRUCTIONS = """The request below contains {count} independent changes, each starting with a line "{unit}".
+Review every unit on its own, exactly as if it were the only change you were given, and never mix
+findings between units. Respond with a single JSON object {{"reviews": {{"1": <review>, "2": <review>, ...}}}}
+with one entry per unit number, where each <review> is the JSON object described in your instructions."""
+
+
+def split_usage(total: int, weights: List[int]) -> List[int]:
+    """Share a token count between units in proportion to weights; the shares add up to total"""
+    weight_sum = sum(weights)
+    if not weight_sum:
+        weights, weight_sum = [1] * len(weights), len(weights)
+    shares = [total * weight // weight_sum for weight in weights]
+    if shares:
+        shares[-1] += total - sum(shares)
+    return shares
+
+
+class ReviewCoalescer:
+    """Packs small prepared reviews into shared requests and splits the answers back per review"""
+    
+    def __init__(self, max_prompt_tokens: int = 8000, max_unit_tokens: int = 2000, max_units: int = 8,
+                 max_output_tokens: int = 8000, linger: float = 0.5):
+        # Budget for the user prompts of one packed request
+        self.max_prompt_tokens = max_prompt_tokens
+        # Reviews with larger prompts are always sent on their own
+        self.max_unit_tokens = max_unit_tokens
+        self.max_units = max(1, max_units)
+        # Answer budget of a packed request (max_tokens per unit, up to this)
+        self.max_output_tokens = max_output_tokens
+        # Async queue: seconds a small review waits for others to share its request
+        self.linger = linger
+        self.counts = {'units': 0, 'requests': 0, 'fallbacks': 0}
+    
+    @staticmethod
+    def from_config(config) -> Optional['ReviewCoalescer']:
+        settings = config.get('request_coalescing', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        model = config.get('model', 'gpt-3.5-turbo')
+        if settings.get('max_output_tokens', 8000) > max_output_tokens(model):
+            logger.warning(
+                "request_coalescing.max_output_tokens (%s) is above what %s accepts; shared requests ask for at most %s",
+                settings.get('max_output_tokens', 8000), model, max_output_tokens(model)
+            )
+        return ReviewCoalescer(
+            max_prompt_tokens=settings.get('max_prompt_tokens', 8000),
+            max_unit_tokens=settings.get('max_unit_tokens', 2000),
+            max_units=settings.get('max_units', 8),
+            max_output_tokens=settings.get('max_output_tokens', 8000),
+            linger=settings.get('linger_seconds', 0.5)
+        )
+    
+    @staticmethod
+    def key(system_prompt: str, structured: bool) -> str:
+        """Reviews can share a request when they share the system prompt and output format"""
+        return hashlib.sha256(f"{int(structured)}\0{system_prompt}".encode('utf-8')).hexdigest()[:16]
+    
+    def coalescible(self, user_prompt: str) -> bool:
+        return estimate_tokens(user_prompt) <= self.max_unit_tokens
+    
+    def pack(self, items: List[Tuple[str, str, str, bool]]) -> List[List[str]]:
+        """
+        Group (id, system_prompt, user_prompt, structured) items into requests, in input order
+        Returns lists of ids; a list with one id is a request on its own
+        """
+        packs: List[List[str]] = []
+        open_packs: Dict[str, Tuple[List[str], int]] = {}
+        for item_id, system_prompt, user_prompt, structured in items:
+            tokens = estimate_tokens(user_prompt)
+            if tokens > self.max_unit_tokens:
+                packs.append([item_id])
+                continue
+            key = self.key(system_prompt, structured)
+            current = open_packs.get(key)
+            if current is None or len(current[0]) >= self.max_units or current[1] + tokens > self.max_prompt_tokens:
+                current = ([], 0)
+                packs.append(current[0])
+            current[0].append(item_id)
+            open_packs[key] = (current[0], current[1] + tokens)
+        return packs
+    
+    def output_tokens(self, max_tokens: int, count: int, model: str) -> int:
+        """Answer budget of a request packing count reviews of max_tokens each, within the model's output limit"""
+        return min(max(max_tokens, min(max_tokens * count, self.max_output_tokens)), max_output_tokens(model))
+    
+    @staticmethod
+    def combine(user_prompts: List[str], structured: bool) -> str:
+        """User prompt of a packed request"""
+        instructions = JSON_INSTRUCTIONS if structured else MARKDOWN_INSTRUCTIONS
+        parts = [instructions.format(
+            count=len(user_prompts),
+            unit=UNIT_MARKER.format(number='<n>'),
+            review=REVIEW_MARKER.format(number='<n>')
+        )]
+        for number, user_prompt in enumerate(user_prompts, 1):
+            parts.append(f"{UNIT_MARKER.format(number=number)}\n{user_prompt.strip()}")
+        return '\n\n'.join(parts) + '\n'
+    
+    @staticmethod
+    def split(content: str, count: int, structured: bool) -> Dict[int, str]:
+        """Per-unit answers of a packed request by unit number (1-based); units not answered are left out"""
+        if structured:
+            text = content.strip()
+            fenced = FENCE_PATTERN.match(text)
+            try:
+                document = json.loads(fenced.group(1) if fenced else text)
+            except json.JSONDecodeError as e:
+                logger.warning("Packed review answer is not valid JSON: %s", e)
+                return {}
+            reviews = document.get('reviews') if isinstance(document, dict) else None
+            if isinstance(reviews, list):
+                reviews = {str(number): review for number, review in enumerate(reviews, 1)}
+            if not isinstance(reviews, dict):
+                return {}
+            return {
+                int(number): json.dumps(review) for number, review in reviews.items()
+                if str(number).isdigit() and 1 <= int(number) <= count and isinstance(review, dict)
+            }
+        
+        answers = {}
+        matches = list(REVIEW_HEADER.finditer(content))
+        for index, match in enumerate(matches):
+            number = int(match.group(1))
+            end = matches[index + 1].start() if index + 1 < len(matches) else len(content)
+            text = content[match.end():end].strip()
+            if 1 <= number <= count and text and number not in answers:
+                answers[number] = text
+        return answers
+    
+    def distribute(self, prompt_sizes: List[int], answers: Dict[int, str],
+                   input_tokens: int, output_tokens: int, cached_tokens: int) -> List[Optional[Tuple[str, int, int, int]]]:
+        """
+        Per-unit (content, input_tokens, output_tokens, cached_tokens) of a packed request, None
+        for units without an answer; usage is shared by user prompt size and answer size
+        """
+        count = len(prompt_sizes)
+        self.counts['units'] += count
+        self.counts['requests'] += 1
+        self.counts['fallbacks'] += count - len(answers)
+        answer_sizes = [len(answers.get(number, '')) for number in range(1, count + 1)]
+        inputs = split_usage(input_tokens, prompt_sizes)
+        cached = split_usage(cached_tokens, prompt_sizes)
+        outputs = split_usage(output_tokens, answer_sizes)
+        results = []
+        for number in range(1, count + 1):
+            if number in answers:
+                index = number - 1
+                results.append((answers[number], inputs[index], outputs[index], cached[index]))
+            else:
+                results.append(None)
+        return results
+    
+    def log_stats(self):
+        if self.counts['requests']:
+            logger.info(
+                "Request coalescing: %s reviews in %s shared requests, %s reviewed separately after a missing answer",
+                self.counts['units'], self.counts['requests'], self.counts['fallbacks']
+            )
+
+
+class AsyncReviewCoalescer:
+    """
+    Coalescing for concurrent async reviews: a small review waits up to linger seconds for others
+    with the same system prompt, then the group is sent as one request
+    """
+    
+    def __init__(self, coalescer: ReviewCoalescer, ai_client):
+        self.coalescer = coalescer
+        self.ai_client = ai_client
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks = set()
+    
+    async def review_code(self, system_prompt: str, user_prompt: str, json_output: bool = False) -> Tuple[str, int, int, int]:
+        """Same contract as AsyncOpenAIClient.review_code"""
+        if not self.coalescer.coalescible(user_prompt):
+            return await self.ai_client.review_code(system_prompt, user_prompt, json_output=json_output)
+        
+        key = self.coalescer.key(system_prompt, json_output)
+        pending = self._pending.setdefault(key, [])
+        tokens = sum(estimate_tokens(prompt) for prompt, _ in pending)
+        if pending and tokens + estimate_tokens(user_prompt) > self.coalescer.max_prompt_tokens:
+            self._flush(key, system_prompt, json_output)
+            pending = self._pending.setdefault(key, [])
+        
+        future = asyncio.get_running_loop().create_future()
+        pending.append((user_prompt, future))
+        if len(pending) >= self.coalescer.max_units:
+            self._flush(key, system_prompt, json_output)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                self.coalescer.linger, self._flush, key, system_prompt, json_output
+            )
+        return await future
+    
+    def _flush(self, key: str, system_prompt: str, json_output: bool):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(key, [])
+        if pending:
+            task = asyncio.ensure_future(self._send(system_prompt, json_output, pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _send(self, system_prompt: str, json_output: bool, pending: List[Tuple[str, asyncio.Future]]):
+        user_prompts = [user_prompt for user_prompt, _ in pending]
+        if len(pending) == 1:
+            results: List[Optional[Tuple]] = [None]
+        else:
+            logger.info("Sending %s small reviews in one request", len(pending))
+            client = copy.copy(self.ai_client)
+            client.max_tokens = self.coalescer.output_tokens(self.ai_client.max_tokens, len(pending), self.ai_client.model)
+            try:
+                content, input_tokens, output_tokens, cached_tokens = await client.review_code(
+                    system_prompt, self.coalescer.combine(user_prompts, json_output), json_output=json_output
+                )
+                answers = self.coalescer.split(content, len(pending), json_output)
+                results = self.coalescer.distribute(
+                    [len(prompt) for prompt in user_prompts], answers, input_tokens, output_tokens, cached_tokens
+                )
+            except Exception as e:
+                logger.warning("Shared review request failed, reviewing separately: %s", e)
+                results = [None] * len(pending)
+        
+        await asyncio.gather(*(
+            self._resolve(future, result, system_prompt, user_prompt, json_output)
+            for (user_prompt, future), result in zip(pending, results)
+        ))
+    
+    async def _resolve(self, future: asyncio.Future, result: Optional[Tuple], system_prompt: str,
+                       user_prompt: str, json_output: bool):
+        if future.done():
+            return
+        try:
+            if result is None:
+                result = await self.ai_client.review_code(system_prompt, user_prompt, json_output=json_output)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
@@ -0,0 +1,228 @@
+"""
+Chunked, idempotent review comments
+A rendered review longer than max_chars is split at section boundaries into ordered parts
+(CommentFormatter.split). Every part ends with an invisible marker naming the comment key and
+part number, so a retried POST or a re-run finds the comments posted before and updates them in
+place, deleting parts left over from a longer earlier review, instead of adding duplicates.
+Parts are sent concurrently; comments are shown in id order, so parts that were created out of
+order are moved back into place by updating their content afterwards.
+"""
+
+import asyncio
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from deadline import DeadlineExceeded
+from formatters import CommentFormatter
+from utils import logger
+
+
+# Link reference definition: valid markdown that renders as nothing
+MARKER = "[//]: # (codewise:{key}:{part})"
+MARKER_PATTERN = re.compile(r'^\[//\]: # \(codewise:([\w.-]+):(\d+)\)\s*$', re.MULTILINE)
+# Room kept in every part for the marker
+MARKER_ROOM = 100
+# Skip warnings are kept apart from the review, so neither replaces the other
+WARNING_KEY = 'warning'
+
+
+def comment_marker(raw: str) -> Optional[Tuple[str, int]]:
+    """(key, part) of a comment posted by publish, or None"""
+    matches = MARKER_PATTERN.findall(raw or '')
+    if not matches:
+        return None
+    key, part = matches[-1]
+    return key, int(part)
+
+
+def retryable(error: Exception) -> bool:
+    """Client errors other than rate limiting will not succeed on retry"""
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return not isinstance(error, DeadlineExceeded) and (status is None or status == 429 or status >= 500)
+
+
+class CommentPoster:
+    """Splits a comment into marked parts and works out which to create, update and delete"""
+    
+    def __init__(self, max_chars: int = 30000, update_existing: bool = True, key: str = 'review',
+                 max_workers: int = 4, max_attempts: int = 3):
+        self.max_chars = max(max_chars, MARKER_ROOM * 5)
+        # Look up earlier parts by marker (one extra GET per comment); off = always post new comments
+        self.update_existing = update_existing
+        self.key = key
+        self.max_workers = max(1, max_workers)
+        self.max_attempts = max(1, max_attempts)
+    
+    @staticmethod
+    def from_config(config) -> 'CommentPoster':
+        settings = config.get('comment_posting', {}) or {}
+        return CommentPoster(
+            max_chars=settings.get('max_chars', 30000),
+            update_existing=settings.get('update_existing', True),
+            key=settings.get('key', 'review'),
+            max_workers=settings.get('max_workers', 4)
+        )
+    
+    def bodies(self, content: str, key: str) -> List[str]:
+        """Marked parts of a comment, in order"""
+        parts = CommentFormatter.split(content, self.max_chars - MARKER_ROOM)
+        return [f"{part}\n\n{MARKER.format(key=key, part=number)}" for number, part in enumerate(parts, 1)]
+    
+    @staticmethod
+    def existing(comments: List[Dict], key: str) -> Dict[int, List[Dict]]:
+        """Comments carrying a marker of key by part number, oldest first"""
+        parts: Dict[int, List[Dict]] = {}
+        for comment in sorted(comments, key=lambda comment: comment.get('id', 0)):
+            if comment.get('deleted') or comment.get('parent') or comment.get('inline'):
+                continue
+            marker = comment_marker((comment.get('content') or {}).get('raw', ''))
+            if marker and marker[0] == key:
+                parts.setdefault(marker[1], []).append(comment)
+        return parts
+    
+    @staticmethod
+    def plan(bodies: List[str], existing: Dict[int, List[Dict]]) -> Dict:
+        """
+        {'update': [(part, comment_id)], 'create': [part], 'keep': {part: comment_id}, 'delete': [comment_id]}
+        The oldest comment of a part is reused (updated unless its content is already right); extra
+        copies and parts beyond the new count are deleted
+        """
+        plan = {'update': [], 'create': [], 'keep': {}, 'delete': []}
+        for part, body in enumerate(bodies, 1):
+            comments = existing.get(part)
+            if not comments:
+                plan['create'].append(part)
+                continue
+            if (comments[0].get('content') or {}).get('raw') == body:
+                plan['keep'][part] = comments[0]['id']
+            else:
+                plan['update'].append((part, comments[0]['id']))
+            plan['delete'] += [comment['id'] for comment in comments[1:]]
+        plan['delete'] += [
+            comment['id'] for part, comments in existing.items() if part > len(bodies) for comment in comments
+        ]
+        return plan
+    
+    @staticmethod
+    def reorder(comment_ids: Dict[int, int]) -> List[Tuple[int, int]]:
+        """
+        (comment_id, part) pairs to rewrite so parts read in comment id order: the i-th smallest id
+        gets part i; comments already holding the right part are left alone
+        """
+        ordered = sorted(comment_ids.values())
+        return [
+            (comment_id, part) for part, comment_id in zip(sorted(comment_ids), ordered)
+            if comment_ids[part] != comment_id
+        ]
+    
+    def log_result(self, bodies: List[str], plan: Dict, moved: int):
+        logger.info(
+            "Review comment posted in %s part(s): %s new, %s updated, %s unchanged, %s removed%s",
+            len(bodies), len(plan['create']), len(plan['update']), len(plan['keep']), len(plan['delete']),
+            f", {moved} reordered" if moved else ""
+        )
+    
+    def _create(self, client, pr_id: str, body: str, key: str, part: int) -> Dict:
+        """POST one part; after a failed attempt the part may exist anyway, so look for it before retrying"""
+        for attempt in range(self.max_attempts):
+            try:
+                return client.create_comment(pr_id, body)
+            except Exception as e:
+                if attempt == self.max_attempts - 1 or not retryable(e):
+                    raise
+                deadline = getattr(client, 'deadline', None)
+                if deadline and not deadline.allows_wait(2 ** attempt, final=True):
+                    raise DeadlineExceeded(f"Run deadline leaves no time to retry posting part {part}: {e}") from e
+                logger.warning("Posting comment part %s failed, checking before retrying: %s", part, e)
+                found = self.existing(client.list_comments(pr_id), key).get(part)
+                if found:
+                    return found[0]
+                time.sleep(2 ** attempt)
+    
+    def publish(self, client, pr_id: str, content: str, key: Optional[str] = None) -> Dict:
+        """
+        Post content on a PR through client (list_comments / create_comment / update_comment /
+        delete_comment), updating the comments of an earlier publish with the same key
+        Returns the first part's comment
+        """
+        key = key or self.key
+        bodies = self.bodies(content, key)
+        existing = self.existing(client.list_comments(pr_id), key) if self.update_existing else {}
+        plan = self.plan(bodies, existing)
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            created = {
+                part: executor.submit(self._create, client, pr_id, bodies[part - 1], key, part)
+                for part in plan['create']
+            }
+            updated = {
+                part: executor.submit(client.update_comment, pr_id, comment_id, bodies[part - 1])
+                for part, comment_id in plan['update']
+            }
+            deleted = [executor.submit(client.delete_comment, pr_id, comment_id) for comment_id in plan['delete']]
+            results = {part: future.result() for part, future in list(created.items()) + list(updated.items())}
+            for future in deleted:
+                future.result()
+            
+            comment_ids = dict(plan['keep'])
+            comment_ids.update({part: result['id'] for part, result in results.items()})
+            moves = self.reorder(comment_ids)
+            moved = list(executor.map(
+                lambda move: client.update_comment(pr_id, move[0], bodies[move[1] - 1]), moves
+            ))
+        
+        self.log_result(bodies, plan, len(moved))
+        for (comment_id, part), result in zip(moves, moved):
+            results[part] = result
+        return results.get(1) or {'id': comment_ids.get(1)}
+    
+    async def _create_async(self, client, pr_id: str, body: str, key: str, part: int) -> Dict:
+        for attempt in range(self.max_attempts):
+            try:
+                return await client.create_comment(pr_id, body)
+            except Exception as e:
+                if attempt == self.max_attempts - 1 or not retryable(e):
+                    raise
+                deadline = getattr(client, 'deadline', None)
+                if deadline and not deadline.allows_wait(2 ** attempt, final=True):
+                    raise DeadlineExceeded(f"Run deadline leaves no time to retry posting part {part}: {e}") from e
+                logger.warning("Posting comment part %s failed, checking before retrying: %s", part, e)
+                found = self.existing(await client.list_comments(pr_id), key).get(part)
+                if found:
+                    return found[0]
+                await asyncio.sleep(2 ** attempt)
+    
+    async def publish_async(self, client, pr_id: str, content: str, key: Optional[str] = None) -> Dict:
+        """Async counterpart of publish for AsyncBitbucketClient"""
+        key = key or self.key
+        bodies = self.bodies(content, key)
+        existing = self.existing(await client.list_comments(pr_id), key) if self.update_existing else {}
+        plan = self.plan(bodies, existing)
+        
+        slots = asyncio.Semaphore(self.max_workers)
+        
+        async def bounded(call):
+            async with slots:
+                return await call
+        
+        parts = plan['create'] + [part for part, _ in plan['update']]
+        results = await asyncio.gather(
+            *(bounded(self._create_async(client, pr_id, bodies[part - 1], key, part)) for part in plan['create']),
+            *(bounded(client.update_comment(pr_id, comment_id, bodies[part - 1])) for part, comment_id in plan['update']),
+            *(bounded(client.delete_comment(pr_id, comment_id)) for comment_id in plan['delete'])
+        )
+        results = dict(zip(parts, results))
+        
+        comment_ids = dict(plan['keep'])
+        comment_ids.update({part: result['id'] for part, result in results.items()})
+        moves = self.reorder(comment_ids)
+        moved = await asyncio.gather(*(
+            bounded(client.update_comment(pr_id, comment_id, bodies[part - 1])) for comment_id, part in moves
+        ))
+        
+        self.log_result(bodies, plan, len(moved))
+        for (comment_id, part), result in zip(moves, moved):
+            results[part] = result
+        return results.get(1) or {'id': comment_ids.get(1)}
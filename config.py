@@ -20,7 +20,7 @@ class Config:
             with open(self.config_path, 'r') as f:
                 return yaml.safe_load(f)
         except FileNotFoundError:
-            logger.warning(f"Config file {self.config_path} not found, using defaults")
+            logger.warning("Config file %s not found, using defaults", self.config_path)
             return self._default_config()
     
     def _default_config(self) -> Dict:
@@ -34,7 +34,9 @@ class Config:
             'exclude_patterns': ['vendor/**', 'node_modules/**', 'storage/**', '*.lock'],
             'skip_large_prs': True,
             'post_warning_on_skip': True,
-            'enable_cost_tracking': True
+            'enable_cost_tracking': True,
+            'use_diffstat': True,
+            'diff_fetch_workers': 8
         }
     
     def get(self, key: str, default=None):
@@ -0,0 +1,66 @@
+"""
+End-to-end deadline of a review run
+One Deadline is created when the run starts and handed to the clients, which clamp every request
+timeout and retry wait to it. Stages read it from the clients and cut their scope when time is
+short: optional context is skipped, and only the highest-ranked hunks are sent to the LLM. A few
+seconds are held in reserve so a partial review can still be posted once the deadline arrives.
+"""
+
+import time
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised instead of starting (or waiting on) a call that cannot finish before the run deadline"""
+
+
+class Deadline:
+    """Monotonic run deadline with a reserve kept back for posting the (partial) review"""
+    
+    def __init__(self, seconds: float, post_reserve: float = 15.0, context_min_seconds: float = 90.0,
+                 llm_seconds: float = 60.0):
+        self.expires = time.monotonic() + seconds
+        # The last post_reserve seconds are only used by final calls (posting the comment)
+        self.post_reserve = min(post_reserve, seconds / 2)
+        # Optional context is only gathered with at least this much time left
+        self.context_min_seconds = context_min_seconds
+        # Expected duration of a full LLM review; with less time left only top-ranked hunks are reviewed
+        self.llm_seconds = llm_seconds
+    
+    @staticmethod
+    def from_config(config, seconds: Optional[float] = None) -> Optional['Deadline']:
+        """Deadline of a run starting now, or None when no deadline is configured (seconds overrides the config)"""
+        settings = config.get('deadline', {}) or {}
+        seconds = seconds or settings.get('seconds', 0)
+        if not seconds:
+            return None
+        return Deadline(
+            float(seconds),
+            post_reserve=settings.get('post_reserve_seconds', 15),
+            context_min_seconds=settings.get('context_min_seconds', 90),
+            llm_seconds=settings.get('llm_seconds', 60)
+        )
+    
+    def remaining(self, final: bool = False) -> float:
+        """Seconds left for work; final calls may also use the post reserve"""
+        left = self.expires - time.monotonic()
+        return left if final else left - self.post_reserve
+    
+    def timeout(self, default: Optional[float], what: str = 'request', final: bool = False) -> float:
+        """Timeout for one call: default clamped to the time left; raises DeadlineExceeded when none is left"""
+        left = self.remaining(final)
+        if left <= 0:
+            raise DeadlineExceeded(f"Run deadline reached before {what}")
+        return min(default, left) if default else left
+    
+    def allows_wait(self, seconds: float, final: bool = False) -> bool:
+        """Whether a retry backoff of seconds still leaves time for the retry itself"""
+        return self.remaining(final) > seconds + 1
+    
+    def allows_context(self) -> bool:
+        return self.remaining() >= self.context_min_seconds
+    
+    def review_fraction(self) -> float:
+        """Share of the diff the LLM can review in the time left (1.0 = all of it)"""
+        return max(0.0, min(1.0, self.remaining() / self.llm_seconds)) if self.llm_seconds else 1.0
+
@@ -0,0 +1,361 @@
+"""
+Cross-repository dedupe store for repeated changes
+The same mechanical change (config bump, shared library upgrade) pushed to many repositories
+produces the same normalized hunks. Findings produced for one of them are reused for the rest.
+Normalization only renames local names: called functions, attributes, modules and imports are
+kept, so `pickle.loads(blob)` and `yaml.loads(blob)` never share a fingerprint. Fingerprints
+ignore where the hunks are, so file paths in stored reviews are replaced by placeholders keyed by
+the file's own fingerprint, and line numbers by their offset from the start of their hunk; both
+are mapped back onto the files and hunk positions of the diff the review is reused for.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from filters import HUNK_START
+from utils import logger
+
+
+# Keywords are kept when normalizing so that `if x` and `for x` still differ
+KEYWORDS = {
+    # Python
+    'and', 'as', 'assert', 'async', 'await', 'break', 'class', 'continue', 'def', 'del', 'elif',
+    'else', 'except', 'finally', 'for', 'from', 'global', 'if', 'import', 'in', 'is', 'lambda',
+    'None', 'nonlocal', 'not', 'or', 'pass', 'raise', 'return', 'True', 'False', 'try', 'while',
+    'with', 'yield',
+    # JavaScript / PHP
+    'case', 'catch', 'const', 'default', 'do', 'echo', 'export', 'extends', 'function', 'let',
+    'namespace', 'new', 'null', 'private', 'protected', 'public', 'require', 'static', 'switch',
+    'this', 'throw', 'typeof', 'use', 'var', 'void', 'true', 'false', 'undefined'
+}
+
+TOKEN_PATTERN = re.compile(
+    r'"(?:\\.|[^"\\])*"'          # double-quoted string
+    r"|'(?:\\.|[^'\\])*'"         # single-quoted string
+    r'|\$?[A-Za-z_][A-Za-z0-9_]*'  # identifier (PHP variables included)
+    r'|\d[\w.]*'                  # number / version
+    r'|\S'                        # any other symbol
+)
+
+
+# Lines whose names are all kept (what is imported matters, not how it is bound)
+IMPORT_WORDS = {'import', 'from', 'use', 'require', 'require_once', 'include', 'include_once'}
+
+PATH_PLACEHOLDER = "<<file:{fingerprint}>>"
+PATH_PLACEHOLDER_PATTERN = re.compile(r'<<file:([0-9a-f]{16})>>')
+# Line of a file in a stored review: file fingerprint, hunk key and offset from the hunk's new start
+LINE_PLACEHOLDER = "<<line:{fingerprint}:{hunk}:{offset}>>"
+LINE_PLACEHOLDER_PATTERN = re.compile(r'<<line:([0-9a-f]{16}):([0-9a-f]{16}\.\d+):(-?\d+)>>')
+# Line numbers cited after a (neutralized) path: "`path` line 5", "path:5", "path (lines 5-7)"
+LINE_REFERENCE = re.compile(
+    r'(<<file:([0-9a-f]{16})>>`?(?::|\s*[(,]?\s*(?:on\s+)?(?:lines?|L)\s*))(\d+)(?:(\s*(?:-|–|to|and)\s*)(\d+))?'
+)
+# ... and the "file"/"line" pair of a structured finding, in either order
+JSON_LINE_AFTER = re.compile(r'("file"\s*:\s*"<<file:([0-9a-f]{16})>>"\s*,\s*"line"\s*:\s*)(\d+)')
+JSON_LINE_BEFORE = re.compile(r'("line"\s*:\s*)(\d+)(\s*,\s*"file"\s*:\s*"<<file:([0-9a-f]{16})>>")')
+
+
+def parse_file_hunks(diff: str) -> Dict[str, List[Tuple[int, List[str]]]]:
+    """Split a unified diff into (new start line, added/removed lines) hunks per file path"""
+    files: Dict[str, List[Tuple[int, List[str]]]] = {}
+    hunks = None
+    current = None
+    for line in diff.split('\n'):
+        if line.startswith('@@'):
+            if hunks is not None:
+                match = HUNK_START.match(line)
+                current = []
+                hunks.append((int(match.group(2)) if match else 0, current))
+        elif line.startswith('diff --git'):
+            path = line.split(' b/', 1)[-1] if ' b/' in line else line[len('diff --git '):]
+            hunks = files.setdefault(path, [])
+            current = None
+        elif current is not None and line[:1] in ('+', '-') and not line.startswith(('+++', '---')):
+            current.append(line)
+    return {path: [(start, hunk) for start, hunk in hunks if hunk] for path, hunks in files.items()}
+
+
+def split_file_hunks(diff: str) -> Dict[str, List[List[str]]]:
+    """Split a unified diff into hunks per file path, keeping only added/removed lines"""
+    return {path: [hunk for _, hunk in hunks] for path, hunks in parse_file_hunks(diff).items()}
+
+
+def split_hunks(diff: str) -> List[List[str]]:
+    """Split a unified diff into hunks, keeping only added/removed lines (no headers, no paths)"""
+    return [hunk for hunks in split_file_hunks(diff).values() for hunk in hunks]
+
+
+def is_name(token: str) -> bool:
+    return (token[0].isalpha() or token[0] in '_$') and token not in KEYWORDS
+
+
+def kept_name(tokens: List[str], index: int) -> bool:
+    """Names that change what the code does when swapped: callees, attributes, modules, decorators"""
+    if tokens[index].startswith('$'):
+        # PHP variables are always local names
+        return False
+    before = tokens[index - 1] if index else ''
+    before_two = ''.join(tokens[index - 2:index]) if index > 1 else ''
+    after = tokens[index + 1] if index + 1 < len(tokens) else ''
+    after_two = ''.join(tokens[index + 1:index + 3])
+    return (
+        before in ('.', '@') or before_two in ('->', '::') or tokens[index - 1:index] == ['new']
+        or after in ('(', '.') or after_two in ('->', '::')
+    )
+
+
+def normalize_hunk(lines: List[str]) -> str:
+    """
+    Normalize a hunk: whitespace dropped; keywords, literals and the names kept_name selects are
+    kept, other names (local variables) are renamed v1, v2, ... in order of first appearance
+    """
+    normalized = []
+    renames: Dict[str, str] = {}
+    for line in lines:
+        tokens = TOKEN_PATTERN.findall(line[1:])
+        keep_all = bool(tokens) and tokens[0] in IMPORT_WORDS
+        for index, token in enumerate(tokens):
+            if keep_all or not is_name(token) or kept_name(tokens, index):
+                continue
+            if token not in renames:
+                renames[token] = f"v{len(renames) + 1}"
+            tokens[index] = renames[token]
+        if tokens:
+            normalized.append(line[0] + ' '.join(tokens))
+    return '\n'.join(normalized)
+
+
+def fingerprint_hunk(lines: List[str]) -> str:
+    return hashlib.sha256(normalize_hunk(lines).encode('utf-8')).hexdigest()
+
+
+def fingerprint_hunks(hunks: List[List[str]]) -> Optional[str]:
+    """Order-independent fingerprint of a list of hunks, or None when there are none"""
+    hunk_fingerprints = sorted(fingerprint_hunk(hunk) for hunk in hunks)
+    if not hunk_fingerprints:
+        return None
+    return hashlib.sha256('\n'.join(hunk_fingerprints).encode('utf-8')).hexdigest()
+
+
+def fingerprint_diff(diff: str) -> Optional[str]:
+    """Order-independent fingerprint of all hunks in a diff, or None for an empty diff"""
+    return fingerprint_hunks(split_hunks(diff))
+
+
+def file_fingerprints(diff: str) -> Dict[str, str]:
+    """Path -> short fingerprint of the file's hunks"""
+    fingerprints = {}
+    for path, hunks in split_file_hunks(diff).items():
+        fingerprint = fingerprint_hunks(hunks)
+        if fingerprint:
+            fingerprints[path] = fingerprint[:16]
+    return fingerprints
+
+
+def hunk_starts(diff: str) -> Dict[str, List[Tuple[int, str]]]:
+    """
+    File fingerprint -> (new start line, hunk key) of the file's hunks, in order; the key (hunk
+    fingerprint and occurrence) is the same wherever in the file the hunk is
+    """
+    fingerprints = file_fingerprints(diff)
+    starts = {}
+    for path, hunks in parse_file_hunks(diff).items():
+        if path not in fingerprints:
+            continue
+        seen = Counter()
+        keyed = []
+        for start, lines in hunks:
+            fingerprint = fingerprint_hunk(lines)[:16]
+            keyed.append((start, f"{fingerprint}.{seen[fingerprint]}"))
+            seen[fingerprint] += 1
+        starts[fingerprints[path]] = keyed
+    return starts
+
+
+def _line_placeholder(fingerprint: str, line: str, starts: Dict[str, List[Tuple[int, str]]]) -> str:
+    """Placeholder for a line of a file: offset from the last hunk starting at or before it"""
+    hunks = starts.get(fingerprint)
+    if not hunks:
+        return line
+    number = int(line)
+    start, key = hunks[0]
+    for hunk_start, hunk_key in hunks:
+        if hunk_start <= number:
+            start, key = hunk_start, hunk_key
+    return LINE_PLACEHOLDER.format(fingerprint=fingerprint, hunk=key, offset=number - start)
+
+
+def neutralize_paths(content: str, diff: str) -> str:
+    """Replace the diff's file paths and the line numbers cited for them in a review with placeholders, before it is stored"""
+    fingerprints = file_fingerprints(diff)
+    for path in sorted(fingerprints, key=len, reverse=True):
+        content = content.replace(path, PATH_PLACEHOLDER.format(fingerprint=fingerprints[path]))
+    
+    starts = hunk_starts(diff)
+    
+    def reference(match) -> str:
+        text = match.group(1) + _line_placeholder(match.group(2), match.group(3), starts)
+        if match.group(5):
+            text += match.group(4) + _line_placeholder(match.group(2), match.group(5), starts)
+        return text
+    
+    content = LINE_REFERENCE.sub(reference, content)
+    content = JSON_LINE_AFTER.sub(lambda match: match.group(1) + _line_placeholder(match.group(2), match.group(3), starts), content)
+    return JSON_LINE_BEFORE.sub(
+        lambda match: match.group(1) + _line_placeholder(match.group(4), match.group(2), starts) + match.group(3), content
+    )
+
+
+def restore_paths(content: str, diff: str) -> str:
+    """
+    Map the placeholders of a stored review to the files and hunk positions of the diff it is
+    reused for; a file with no counterpart here is left unnamed rather than citing another
+    repository's path, and a line that cannot be placed is left out (null in structured findings)
+    """
+    paths = {fingerprint: path for path, fingerprint in file_fingerprints(diff).items()}
+    starts = {fingerprint: {key: start for start, key in hunks} for fingerprint, hunks in hunk_starts(diff).items()}
+    
+    def line(match) -> Optional[str]:
+        start = starts.get(match.group(1), {}).get(match.group(2))
+        number = start + int(match.group(3)) if start is not None else 0
+        return str(number) if number > 0 else None
+    
+    def structured_line(match) -> str:
+        return match.group(1) + (line(LINE_PLACEHOLDER_PATTERN.match(match.group(2))) or 'null')
+    
+    content = re.sub(r'("line"\s*:\s*)(<<line:[^>]+>>)', structured_line, content)
+    content = LINE_PLACEHOLDER_PATTERN.sub(lambda match: line(match) or '?', content)
+    return PATH_PLACEHOLDER_PATTERN.sub(lambda match: paths.get(match.group(1), 'another changed file'), content)
+
+
+class DedupeStore:
+    """Bounded SQLite store of findings keyed by diff fingerprint and prompt/model version"""
+    
+    def __init__(self, path: str, max_entries: int = 5000, ttl_seconds: int = 30 * 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS findings ("
+            " fingerprint TEXT NOT NULL, version TEXT NOT NULL, findings TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (fingerprint, version))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS findings_last_used ON findings (last_used)")
+        # Lifetime hit/miss counters, so the hit rate is meaningful across single-PR runs
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.commit()
+    
+    def _count(self, name: str):
+        self._conn.execute(
+            "INSERT INTO counters VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+    
+    @staticmethod
+    def version_key(model: str, system_prompt: str, prompt_version: str = '1') -> str:
+        """Findings are only reused for the same model, system prompt and prompt version"""
+        material = f"{prompt_version}\n{model}\n{system_prompt}"
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()[:16]
+    
+    def get(self, fingerprint: str, version: str) -> Optional[str]:
+        """Return stored findings and refresh their LRU position, or None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT findings, created_at FROM findings WHERE fingerprint = ? AND version = ?",
+                (fingerprint, version)
+            ).fetchone()
+            
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                self._count('misses')
+                self._conn.commit()
+                return None
+            
+            self._count('hits')
+            self._conn.execute(
+                "UPDATE findings SET last_used = ? WHERE fingerprint = ? AND version = ?",
+                (now, fingerprint, version)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+    
+    def put(self, fingerprint: str, version: str, findings: str):
+        """Store findings, then evict expired and least recently used entries"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO findings VALUES (?, ?, ?, ?, ?)",
+                (fingerprint, version, findings, now, now)
+            )
+            self._conn.execute("DELETE FROM findings WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM findings WHERE rowid IN ("
+                " SELECT rowid FROM findings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+    
+    def invalidate(self, version: Optional[str] = None):
+        """Drop all entries, or only those of one prompt/model version"""
+        with self._lock:
+            if version is None:
+                self._conn.execute("DELETE FROM findings")
+            else:
+                self._conn.execute("DELETE FROM findings WHERE version = ?", (version,))
+            self._conn.commit()
+    
+    def stats(self) -> Dict:
+        """Hit/miss counts of this process and over the lifetime of the store"""
+        with self._lock:
+            totals = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+            entries = self._conn.execute("SELECT COUNT(*) FROM findings").fetchone()[0]
+        
+        lookups = self.hits + self.misses
+        total_hits = totals.get('hits', 0)
+        total_lookups = total_hits + totals.get('misses', 0)
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'total_hits': total_hits,
+            'total_lookups': total_lookups,
+            'total_hit_rate': total_hits / total_lookups if total_lookups else 0.0,
+            'entries': entries
+        }
+    
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            "Dedupe store: %s hits, %s misses this run; lifetime hit rate %.0f%% over %s lookups, %s entries",
+            stats['hits'], stats['misses'], stats['total_hit_rate'] * 100, stats['total_lookups'], stats['entries']
+        )
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    @staticmethod
+    def from_config(config) -> Optional['DedupeStore']:
+        """Open the store configured under dedupe_store, or None when disabled"""
+        settings = config.get('dedupe_store', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        return DedupeStore(
+            settings.get('path', '.codewise/dedupe.sqlite3'),
+            max_entries=settings.get('max_entries', 5000),
+            ttl_seconds=int(settings.get('ttl_days', 30) * 86400)
+        )
@@ -0,0 +1,350 @@
+"""
+Token-minimizing diff compaction
+Runs between DiffFilter.filter_diff and the prompt. Whitespace-only changes are dropped (never
+indentation changes in indentation-sensitive files such as Python or YAML), code moved between
+(or within) files and pure renames become one-line notes, unchanged context is
+trimmed to a radius around the remaining changes and per-file git headers are cut down to the
+`diff --git` line. Every kept hunk gets a recomputed `@@` header, so line numbers in the new
+file stay exact.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from utils import logger
+
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$')
+# Notes about omitted changes; no line of a unified diff starts like this
+NOTE_PREFIX = '# '
+# Rough size of a token for the savings report
+CHARS_PER_TOKEN = 4
+# Leading whitespace is syntax in these files: re-indenting a line can change what it does
+INDENTATION_SENSITIVE = {'.py', '.pyi', '.pyw', '.yaml', '.yml', '.coffee', '.sass', '.haml', '.pug', '.nim'}
+INDENTATION_SENSITIVE_NAMES = {'Makefile', 'GNUmakefile'}
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def indentation_sensitive(path: str) -> bool:
+    name = os.path.basename(path)
+    return name in INDENTATION_SENSITIVE_NAMES or os.path.splitext(name)[1].lower() in INDENTATION_SENSITIVE
+
+
+def comparable(text: str, keep_indentation: bool) -> str:
+    """Line text with the whitespace that cannot change behaviour removed"""
+    if keep_indentation:
+        indentation = text[:len(text) - len(text.lstrip())]
+        return indentation + re.sub(r'\s+', '', text) if text.strip() else ''
+    return re.sub(r'\s+', '', text)
+
+
+def has_notes(diff: str) -> bool:
+    return diff.startswith(NOTE_PREFIX) or f"\n{NOTE_PREFIX}" in diff
+
+
+class _Line:
+    """One hunk line with its position in the old and new file (the next position for lines absent there)"""
+    
+    __slots__ = ('tag', 'text', 'old_no', 'new_no', 'keep', 'note')
+    
+    def __init__(self, tag: str, text: str, old_no: int, new_no: int):
+        self.tag = tag
+        self.text = text
+        self.old_no = old_no
+        self.new_no = new_no
+        self.keep = False
+        # Note emitted in place of this line and the dropped lines after it
+        self.note: Optional[str] = None
+
+
+class _FileDiff:
+    def __init__(self, header: List[str]):
+        self.header = header
+        self.hunks: List[Tuple[str, List[_Line]]] = []
+        match = re.match(r'^diff --git a/(.*) b/(.*)$', header[0])
+        self.old_path, self.path = match.groups() if match else (header[0], header[0])
+    
+    def header_value(self, prefix: str) -> Optional[str]:
+        for line in self.header:
+            if line.startswith(prefix):
+                return line[len(prefix):].strip()
+        return None
+
+
+def parse_diff(diff: str) -> Tuple[List[str], List[_FileDiff]]:
+    """Lines before the first file, and every file with its hunks parsed into numbered lines"""
+    preamble, files = [], []
+    current, lines, old_no, new_no = None, None, 0, 0
+    for line in diff.split('\n'):
+        if line.startswith('diff --git'):
+            current, lines = _FileDiff([line]), None
+            files.append(current)
+            continue
+        if current is None:
+            preamble.append(line)
+            continue
+        match = HUNK_HEADER.match(line)
+        if match:
+            old_no, new_no = int(match.group(1)), int(match.group(3))
+            # Empty ranges (-0,0) point at the line before
+            old_no += match.group(2) == '0'
+            new_no += match.group(4) == '0'
+            lines = []
+            current.hunks.append((match.group(5), lines))
+        elif lines is None:
+            current.header.append(line)
+        elif line.startswith('+'):
+            lines.append(_Line('+', line[1:], old_no, new_no))
+            new_no += 1
+        elif line.startswith('-'):
+            lines.append(_Line('-', line[1:], old_no, new_no))
+            old_no += 1
+        elif line.startswith('\\'):
+            lines.append(_Line('\\', line, old_no, new_no))
+        elif line.startswith(' ') or line == '':
+            lines.append(_Line(' ', line[1:], old_no, new_no))
+            old_no += 1
+            new_no += 1
+    # split('\n') leaves an empty "context line" for the final newline of each file
+    for file_diff in files:
+        for _, lines in file_diff.hunks:
+            while lines and lines[-1].tag == ' ' and lines[-1].text == '':
+                lines.pop()
+    return preamble, files
+
+
+def change_regions(lines: List[_Line]) -> List[List[int]]:
+    """Indexes of every run of consecutive added/removed lines in a hunk"""
+    regions, current = [], []
+    for index, line in enumerate(lines):
+        if line.tag in '+-':
+            current.append(index)
+        elif line.tag != '\\' and current:
+            regions.append(current)
+            current = []
+    if current:
+        regions.append(current)
+    return regions
+
+
+def _line_range(numbers: List[int]) -> str:
+    return f"{numbers[0]}" if len(numbers) == 1 else f"{numbers[0]}-{numbers[-1]}"
+
+
+def _find(block: List[str], sequence: List[str]) -> int:
+    """Start of block inside sequence, or -1"""
+    size = len(block)
+    for start in range(len(sequence) - size + 1):
+        if sequence[start] == block[0] and sequence[start:start + size] == block:
+            return start
+    return -1
+
+
+class DiffCompactor:
+    """Rewrites a unified diff into fewer tokens without changing the line numbers it reports"""
+    
+    def __init__(self, context_lines: int = 3, drop_whitespace_only: bool = True, detect_moves: bool = True,
+                 min_move_lines: int = 3, min_move_chars: int = 60, shorten_headers: bool = True):
+        self.context_lines = context_lines
+        self.drop_whitespace_only = drop_whitespace_only
+        self.detect_moves = detect_moves
+        self.min_move_lines = min_move_lines
+        # Short blocks (closing braces, blank lines, `return;`) repeat everywhere and are not moves
+        self.min_move_chars = min_move_chars
+        self.shorten_headers = shorten_headers
+    
+    @staticmethod
+    def from_config(config) -> Optional['DiffCompactor']:
+        settings = config.get('diff_compaction', {}) or {}
+        if not settings.get('enabled', True):
+            return None
+        return DiffCompactor(
+            context_lines=settings.get('context_lines', 3),
+            drop_whitespace_only=settings.get('drop_whitespace_only', True),
+            detect_moves=settings.get('detect_moves', True),
+            min_move_lines=settings.get('min_move_lines', 3),
+            min_move_chars=settings.get('min_move_chars', 60),
+            shorten_headers=settings.get('shorten_headers', True)
+        )
+    
+    def compact(self, diff: str) -> Tuple[str, Dict]:
+        """Compacted diff and a report (characters, estimated tokens, what was collapsed)"""
+        preamble, files = parse_diff(diff)
+        stats = {'whitespace_only': 0, 'moved_blocks': 0, 'renames': 0}
+        
+        for file_diff in files:
+            for _, lines in file_diff.hunks:
+                for region in change_regions(lines):
+                    if self.drop_whitespace_only and self._whitespace_only(lines, region, file_diff.path):
+                        stats['whitespace_only'] += 1
+                        numbers = [lines[i].new_no for i in region if lines[i].tag == '+']
+                        where = f"new lines {_line_range(numbers)}" if numbers else f"old lines {_line_range([lines[i].old_no for i in region])}"
+                        lines[region[0]].note = f"{NOTE_PREFIX}whitespace-only change omitted ({where})"
+                    else:
+                        for index in region:
+                            lines[index].keep = True
+        if self.detect_moves:
+            stats['moved_blocks'] = self._collapse_moves(files)
+        for file_diff in files:
+            for _, lines in file_diff.hunks:
+                self._keep_context(lines)
+        
+        output = list(preamble)
+        for file_diff in files:
+            file_lines, renamed = self._render_file(file_diff)
+            stats['renames'] += renamed
+            output.extend(file_lines)
+        compacted = '\n'.join(output)
+        if diff.endswith('\n') and not compacted.endswith('\n'):
+            compacted += '\n'
+        
+        stats.update({
+            'original_chars': len(diff),
+            'compacted_chars': len(compacted),
+            'original_tokens': estimate_tokens(diff),
+            'compacted_tokens': estimate_tokens(compacted)
+        })
+        stats['tokens_saved'] = stats['original_tokens'] - stats['compacted_tokens']
+        return compacted, stats
+    
+    @staticmethod
+    def log_stats(stats: Dict):
+        saved = stats['tokens_saved']
+        share = 100 * saved / stats['original_tokens'] if stats['original_tokens'] else 0.0
+        logger.info(
+            "Diff compaction: ~%s -> ~%s tokens (%s saved, %.0f%%); %s whitespace-only changes, %s moved blocks, %s renames",
+            stats['original_tokens'], stats['compacted_tokens'], saved, share,
+            stats['whitespace_only'], stats['moved_blocks'], stats['renames']
+        )
+    
+    @staticmethod
+    def _whitespace_only(lines: List[_Line], region: List[int], path: str) -> bool:
+        """
+        Whether a change only touches whitespace inside lines, trailing whitespace or blank lines;
+        in indentation-sensitive files every line must also keep its indentation
+        """
+        keep_indentation = indentation_sensitive(path)
+        removed = [comparable(lines[i].text, keep_indentation) for i in region if lines[i].tag == '-']
+        added = [comparable(lines[i].text, keep_indentation) for i in region if lines[i].tag == '+']
+        return [text for text in removed if text] == [text for text in added if text]
+    
+    def _collapse_moves(self, files: List[_FileDiff]) -> int:
+        """Replace blocks removed in one place and added unchanged (up to indentation, where it is not syntax) in another by notes"""
+        removed, added = [], []
+        for file_diff in files:
+            for _, lines in file_diff.hunks:
+                for region in change_regions(lines):
+                    for tag, blocks in (('-', removed), ('+', added)):
+                        indexes = [i for i in region if lines[i].tag == tag and lines[i].keep]
+                        if indexes:
+                            # Indentation is part of a moved block where it is syntax
+                            texts = [
+                                lines[i].text.rstrip() if indentation_sensitive(file_diff.path) else lines[i].text.strip()
+                                for i in indexes
+                            ]
+                            blocks.append((file_diff, lines, indexes, texts))
+        
+        moved = 0
+        # A whole removed block found inside an added one, or a whole added block inside a removed one
+        for blocks, others in ((removed, added), (added, removed)):
+            for file_diff, lines, indexes, texts in blocks:
+                if len(texts) < self.min_move_lines or sum(len(text) for text in texts) < self.min_move_chars:
+                    continue
+                if not all(lines[i].keep for i in indexes):
+                    continue
+                for other_file, other_lines, other_indexes, other_texts in others:
+                    start = _find(texts, other_texts)
+                    if start < 0:
+                        continue
+                    matched = other_indexes[start:start + len(texts)]
+                    if not all(other_lines[i].keep for i in matched):
+                        continue
+                    self._mark_moved(file_diff, lines, indexes, other_file, other_lines, matched)
+                    moved += 1
+                    break
+        return moved
+    
+    @staticmethod
+    def _mark_moved(file_diff: _FileDiff, lines: List[_Line], indexes: List[int],
+                    other_file: _FileDiff, other_lines: List[_Line], other_indexes: List[int]):
+        if lines[indexes[0]].tag == '+':
+            file_diff, lines, indexes, other_file, other_lines, other_indexes = (
+                other_file, other_lines, other_indexes, file_diff, lines, indexes
+            )
+        old_range = _line_range([lines[i].old_no for i in indexes])
+        new_range = _line_range([other_lines[i].new_no for i in other_indexes])
+        source = '' if other_file is file_diff else f" of {file_diff.old_path}"
+        target = '' if other_file is file_diff else f" of {other_file.path}"
+        lines[indexes[0]].note = f"{NOTE_PREFIX}old lines {old_range} moved unchanged to new lines {new_range}{target}"
+        other_lines[other_indexes[0]].note = (
+            f"{NOTE_PREFIX}new lines {new_range} moved here unchanged from old lines {old_range}{source}"
+        )
+        for i in indexes:
+            lines[i].keep = False
+        for i in other_indexes:
+            other_lines[i].keep = False
+    
+    def _keep_context(self, lines: List[_Line]):
+        """Keep up to context_lines unchanged lines on each side of every kept change"""
+        for index, line in enumerate(lines):
+            if line.tag not in '+-' or not line.keep:
+                continue
+            for step in (-1, 1):
+                position, kept = index + step, 0
+                while 0 <= position < len(lines) and kept < self.context_lines:
+                    neighbour = lines[position]
+                    if neighbour.tag in '+-':
+                        break
+                    if neighbour.tag == ' ':
+                        neighbour.keep = True
+                        kept += 1
+                    position += step
+        for index, line in enumerate(lines):
+            if line.tag == '\\':
+                line.keep = index > 0 and lines[index - 1].keep
+    
+    def _render_file(self, file_diff: _FileDiff) -> Tuple[List[str], int]:
+        """Output lines of one file and whether it is a rename"""
+        body = []
+        for section, lines in file_diff.hunks:
+            run: List[_Line] = []
+            for line in lines + [None]:
+                if line is not None and line.keep:
+                    run.append(line)
+                    continue
+                if run:
+                    body.extend(self._render_hunk(section, run))
+                    run = []
+                if line is not None and line.note:
+                    body.append(line.note)
+        
+        renamed_from = file_diff.header_value('rename from ')
+        if not self.shorten_headers:
+            return file_diff.header + body, int(renamed_from is not None)
+        
+        notes = []
+        if file_diff.header_value('new file mode') is not None:
+            notes.append(f"{NOTE_PREFIX}new file")
+        elif file_diff.header_value('deleted file mode') is not None:
+            notes.append(f"{NOTE_PREFIX}deleted file")
+        if renamed_from is not None:
+            notes.append(f"{NOTE_PREFIX}renamed from {renamed_from}" + ('' if file_diff.hunks else ', content unchanged'))
+        old_mode, new_mode = file_diff.header_value('old mode '), file_diff.header_value('new mode ')
+        if old_mode and new_mode:
+            notes.append(f"{NOTE_PREFIX}mode {old_mode} -> {new_mode}")
+        if any(line.startswith(('Binary files', 'GIT binary patch')) for line in file_diff.header):
+            notes.append(f"{NOTE_PREFIX}binary file changed")
+        return [file_diff.header[0]] + notes + body, int(renamed_from is not None)
+    
+    @staticmethod
+    def _render_hunk(section: str, run: List[_Line]) -> List[str]:
+        old_count = sum(line.tag in ' -' for line in run)
+        new_count = sum(line.tag in ' +' for line in run)
+        # Empty ranges point at the line before, like git
+        old_start = run[0].old_no - (old_count == 0)
+        new_start = run[0].new_no - (new_count == 0)
+        header = f"@@ -{old_start},{old_count} +{new_start},{new_count} @@{section}"
+        return [header] + [line.text if line.tag == '\\' else line.tag + line.text for line in run]
@@ -9,41 +9,84 @@ Enhanced features for AI Code Review Bot
 import os
 import re
 from typing import Dict, List, Optional
+from scope_context import ScopeExtractor
 from utils import logger
 
 
 class MultiFileContext:
-    """Retrieve full file contents for better context"""
+    """Retrieve file contents for better context, cut to the scopes enclosing the changes when possible"""
     
-    def __init__(self, bb_client, max_files: int = 5, max_file_size: int = 10000):
+    def __init__(self, bb_client, max_files: int = 5, max_file_size: int = 10000,
+                 scope_extractor: Optional[ScopeExtractor] = None):
         self.bb_client = bb_client
         self.max_files = max_files
         self.max_file_size = max_file_size
+        self.scope_extractor = scope_extractor
+        # Untrimmed contents of every file retrieved, for later stages (symbol context)
+        self.fetched: Dict[str, str] = {}
+    
+    @staticmethod
+    def from_config(bb_client, config, diff: str) -> 'MultiFileContext':
+        return MultiFileContext(
+            bb_client,
+            max_files=config.get('context_max_files', 5),
+            scope_extractor=ScopeExtractor.from_config(config, diff)
+        )
     
     def get_full_files(self, changed_files: List[str], branch: str) -> Dict[str, str]:
         """Fetch full content of changed files"""
         full_files = {}
         
+        # Clients that can read many files in one go (LocalGitClient, Bitbucket archives) skip the per-file loop
+        if hasattr(self.bb_client, 'get_files_content'):
+            try:
+                contents = self.bb_client.get_files_content(changed_files[:self.max_files], branch)
+            except Exception as e:
+                logger.warning("Bulk file retrieval failed: %s", e)
+                contents = {}
+            return self.limit_contents(contents)
+        
         for i, filepath in enumerate(changed_files[:self.max_files]):
             if i >= self.max_files:
-                logger.info(f"Reached max files limit ({self.max_files}) for context retrieval")
+                logger.info("Reached max files limit (%s) for context retrieval", self.max_files)
                 break
             
             try:
-                logger.debug(f"Fetching full content of {filepath}")
+                logger.debug("Fetching full content of %s", filepath)
                 content = self.bb_client.get_file_content(filepath, branch)
-                
-                if content and len(content) <= self.max_file_size:
-                    full_files[filepath] = content
-                    logger.info(f"Retrieved {filepath} ({len(content)} chars)")
-                elif len(content) > self.max_file_size:
-                    # Truncate large files
-                    full_files[filepath] = content[:self.max_file_size] + "\n\n// ... (truncated)"
-                    logger.info(f"Retrieved {filepath} (truncated from {len(content)} to {self.max_file_size} chars)")
+                if content:
+                    self.fetched[filepath] = content
+                    full_files[filepath] = self._limit_size(filepath, content)
             except Exception as e:
-                logger.warning(f"Failed to retrieve {filepath}: {e}")
+                logger.warning("Failed to retrieve %s: %s", filepath, e)
         
         return full_files
+    
+    def limit_contents(self, contents: Dict[str, str]) -> Dict[str, str]:
+        """Apply the size limit to contents fetched elsewhere (bulk or async retrieval)"""
+        self.fetched.update(contents)
+        return {
+            filepath: self._limit_size(filepath, content)
+            for filepath, content in contents.items()
+            if content
+        }
+    
+    def _limit_size(self, filepath: str, content: str) -> str:
+        """Enclosing scopes of the changed lines, or content truncated to max_file_size"""
+        if self.scope_extractor is not None:
+            scoped = self.scope_extractor.extract(filepath, content)
+            if scoped is not None:
+                logger.info("Retrieved %s (%s chars of enclosing scopes out of %s)", filepath, len(scoped), len(content))
+                return scoped
+        
+        max_size = self.scope_extractor.max_chars if self.scope_extractor is not None else self.max_file_size
+        if len(content) <= max_size:
+            logger.info("Retrieved %s (%s chars)", filepath, len(content))
+            return content
+        
+        # Truncate large files
+        logger.info("Retrieved %s (truncated from %s to %s chars)", filepath, len(content), max_size)
+        return content[:max_size] + "\n\n// ... (truncated)"
 
 
 class ConfidenceScorer:
@@ -88,6 +131,13 @@ class ConfidenceScorer:
         
         # Ensure score is between 0 and 1
         return max(0.0, min(1.0, confidence_score))
+    
+    @staticmethod
+    def calculate_findings_confidence(findings: List[Dict]) -> float:
+        """Confidence of a structured review: mean of the per-finding confidences (1.0 if nothing was found)"""
+        if not findings:
+            return 1.0
+        return sum(finding['confidence'] for finding in findings) / len(findings)
 
 
 class SimilaritySearch:
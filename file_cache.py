@@ -0,0 +1,193 @@
+"""
+Persistent file content cache
+File contents fetched at a commit never change, so they are kept on disk, one file per
+(commit, path), and shared by every later run that reads the same commit: re-runs of a PR
+and other PRs on the same source commit. Entries are written atomically (temp file + rename),
+so concurrent workers sharing the directory never see partial files; the least recently read
+entries are evicted beyond a size cap.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+from utils import logger
+
+
+# Only immutable refs are cached: hex commit hashes (Bitbucket's 12-character short form or full)
+COMMIT_HASH = re.compile(r'[0-9a-f]{12,40}')
+TEMP_PREFIX = '.tmp-'
+# Temp files this old were left behind by a crashed writer
+STALE_TEMP_SECONDS = 3600
+
+
+class FileContentCache:
+    """Content-addressed on-disk cache of file contents keyed by commit hash and path"""
+    
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, use_mmap: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Read entries through a memory map and decode straight from it instead of read() copies
+        self.use_mmap = use_mmap
+        self.hits = 0
+        self.misses = 0
+        # Size of the directory as this process knows it; learned by one scan on the first write
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def from_config(config) -> Optional['FileContentCache']:
+        """Open the cache configured under file_cache, or None when disabled"""
+        settings = config.get('file_cache', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        return FileContentCache(
+            settings.get('directory', '.codewise/files'),
+            max_bytes=int(settings.get('max_mb', 256) * 1024 * 1024),
+            use_mmap=settings.get('mmap', False)
+        )
+    
+    @staticmethod
+    def cacheable(ref: str) -> bool:
+        """Whether contents at ref are immutable (a commit hash, not a branch name)"""
+        return bool(COMMIT_HASH.fullmatch(ref or ''))
+    
+    def _path(self, commit: str, filepath: str) -> str:
+        digest = hashlib.sha256(f"{commit}\0{filepath}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:])
+    
+    def get(self, commit: str, filepath: str) -> Optional[str]:
+        """Cached content of filepath at commit, or None"""
+        path = self._path(commit, filepath)
+        try:
+            with open(path, 'rb') as f:
+                content = self._read(f)
+            # Reads refresh the modification time, which orders eviction
+            os.utime(path)
+        except FileNotFoundError:
+            content = None
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning("File cache read of %s failed: %s", filepath, e)
+            content = None
+        
+        with self._lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return content
+    
+    def get_many(self, commit: str, filepaths: List[str]) -> Dict[str, str]:
+        """Cached contents of the given files at commit; misses are left out"""
+        contents = {}
+        for filepath in filepaths:
+            content = self.get(commit, filepath)
+            if content is not None:
+                contents[filepath] = content
+        return contents
+    
+    def _read(self, f) -> str:
+        if self.use_mmap and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return str(mapped, 'utf-8')
+        return f.read().decode('utf-8')
+    
+    def put(self, commit: str, filepath: str, content: str):
+        """Store content of filepath at commit; concurrent writers of the same entry are harmless"""
+        data = content.encode('utf-8')
+        if not data or len(data) > self.max_bytes:
+            return
+        
+        path = self._path(commit, filepath)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as e:
+            logger.warning("File cache write of %s failed: %s", filepath, e)
+            return
+        
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            over_cap = self._size > self.max_bytes
+        if over_cap:
+            self.evict()
+    
+    def _entries(self) -> List[os.DirEntry]:
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for bucket in os.scandir(self.directory):
+            if bucket.is_dir():
+                entries.extend(entry for entry in os.scandir(bucket.path) if entry.is_file())
+        return entries
+    
+    def _scan_size(self) -> int:
+        total = 0
+        for entry in self._entries():
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+    
+    def evict(self):
+        """Delete least recently read entries until the cache is back under 90% of max_bytes"""
+        now = time.time()
+        files = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith(TEMP_PREFIX):
+                if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                    self._remove(entry.path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            # Another worker may have evicted it already
+            if self._remove(path):
+                removed += 1
+            total -= size
+        
+        with self._lock:
+            self._size = total
+        if removed:
+            logger.info("File cache evicted %s entries (%.1f MiB left)", removed, total / 1048576)
+    
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning("File cache eviction of %s failed: %s", path, e)
+            return False
+    
+    def log_stats(self):
+        lookups = self.hits + self.misses
+        if lookups:
+            logger.info("File cache: %s hits, %s misses (%.0f%% hit rate)", self.hits, self.misses, 100 * self.hits / lookups)
@@ -2,18 +2,114 @@
 Diff filtering and processing
 """
 
+import math
 import re
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 from utils import logger
 
 
+HUNK_START = re.compile(r'^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+# Generation markers; they only count in comments near the top of a file
+GENERATED_MARKER = re.compile(
+    r'@generated|do not edit|code generated by|auto-?generated|automatically generated|'
+    r'generated by the protocol buffer compiler|jest snapshot v\d',
+    re.IGNORECASE
+)
+COMMENT_START = ('//', '#', '/*', '*', '<!--', '--', ';', '"""', "'''")
+
+
+class GeneratedFileDetector:
+    """
+    Content-based detection of generated, minified and binary files from a bounded prefix of
+    their diff: binary markers, generation markers in top-of-file comments, average added line
+    length and character entropy of the added text
+    """
+    
+    def __init__(self, sample_chars: int = 8192, marker_lines: int = 20, max_average_line_length: int = 300,
+                 max_entropy: float = 5.8, min_entropy_chars: int = 2048):
+        self.sample_chars = sample_chars
+        self.marker_lines = marker_lines
+        self.max_average_line_length = max_average_line_length
+        # Bits per character; source code sits around 4.5-5.2, base64 and packed data near 6
+        self.max_entropy = max_entropy
+        self.min_entropy_chars = min_entropy_chars
+    
+    @staticmethod
+    def from_config(config) -> Optional['GeneratedFileDetector']:
+        settings = config.get('generated_detection', {}) or {}
+        if not settings.get('enabled', True):
+            return None
+        return GeneratedFileDetector(
+            sample_chars=settings.get('sample_chars', 8192),
+            marker_lines=settings.get('marker_lines', 20),
+            max_average_line_length=settings.get('max_average_line_length', 300),
+            max_entropy=settings.get('max_entropy', 5.8),
+            min_entropy_chars=settings.get('min_entropy_chars', 2048)
+        )
+    
+    @staticmethod
+    def entropy(text: str) -> float:
+        """Shannon entropy of the characters of text, in bits per character"""
+        total = len(text)
+        counts = (text.count(char) for char in set(text))
+        return -sum(count / total * math.log2(count / total) for count in counts) if total else 0.0
+    
+    def detect(self, lines: List[str]) -> Optional[str]:
+        """Why the file whose diff starts with lines is generated, minified or binary, or None"""
+        # Header lines up to the first hunk; binary files have no hunks
+        start = 0
+        for start, line in enumerate(lines):
+            if line.startswith(('Binary files ', 'GIT binary patch')):
+                return 'binary'
+            if line.startswith('@@'):
+                break
+        else:
+            return None
+        
+        # Markers are only looked for while the line numbers are near the top of the file
+        new_no = old_no = 0
+        for line in lines[start:]:
+            match = HUNK_START.match(line)
+            if match:
+                old_no, new_no = int(match.group(1)), int(match.group(2))
+                continue
+            if min(old_no or new_no, new_no or old_no) > self.marker_lines:
+                break
+            tag, text = line[:1], line[1:]
+            if text.lstrip().startswith(COMMENT_START) and GENERATED_MARKER.search(text):
+                return 'generated'
+            if tag != '-':
+                new_no += 1
+            if tag != '+':
+                old_no += 1
+        
+        added = [line[1:] for line in lines[start:] if line.startswith('+')]
+        if not added:
+            return None
+        sample = ''.join(added)
+        average = len(sample) / len(added)
+        if average > self.max_average_line_length:
+            return f"minified (average line length {average:.0f})"
+        if len(sample) >= self.min_entropy_chars:
+            bits = self.entropy(sample)
+            if bits > self.max_entropy:
+                return f"high entropy ({bits:.1f} bits/char)"
+        return None
+
+
 class DiffFilter:
     """Filter and process PR diffs"""
     
-    def __init__(self, exclude_patterns: List[str], max_diff_size: int, max_files: int):
+    # diff --git, index, ---, +++ lines written for every file
+    DIFF_HEADER_LINES = 4
+    
+    def __init__(self, exclude_patterns: List[str], max_diff_size: int, max_files: int,
+                 detector: Optional[GeneratedFileDetector] = None):
         self.exclude_patterns = exclude_patterns
         self.max_diff_size = max_diff_size
         self.max_files = max_files
+        # Excludes generated, minified and binary files that no pattern matches
+        self.detector = detector
     
     def should_exclude(self, filepath: str) -> bool:
         """Check if file should be excluded"""
@@ -24,42 +120,118 @@ class DiffFilter:
         return False
     
     def filter_diff(self, diff_text: str) -> Tuple[str, Dict]:
-        """Filter diff and return (filtered_diff, stats)"""
-        lines = diff_text.split('\n')
+        """
+        Filter diff and return (filtered_diff, stats)
+        With a detector, each file's lines are held back until its first sample_chars have been
+        checked; after that they stream through, so the check costs the same for any diff size
+        """
         filtered_lines = []
         current_file = None
         file_count = 0
         excluded_files = []
         changed_files = []
+        generated_files: Dict[str, str] = {}
+        held: Optional[List[str]] = None
+        held_size = 0
         
-        for line in lines:
+        def settle() -> bool:
+            """Keep or drop the held file; False once the max files limit is exceeded"""
+            nonlocal current_file, held, file_count
+            lines, held = held, None
+            reason = self.detector.detect(lines) if self.detector is not None else None
+            if reason:
+                generated_files[current_file] = reason
+                excluded_files.append(current_file)
+                current_file = None
+                return True
+            changed_files.append(current_file)
+            file_count += 1
+            if file_count > self.max_files:
+                logger.warning("Max files limit (%s) reached", self.max_files)
+                return False
+            filtered_lines.extend(lines)
+            return True
+        
+        for line in diff_text.split('\n'):
             if line.startswith('diff --git'):
+                if held is not None and not settle():
+                    break
+                current_file = None
                 # Extract filename
                 match = re.search(r'b/(.+)$', line)
                 if match:
-                    current_file = match.group(1)
-                    if self.should_exclude(current_file):
-                        excluded_files.append(current_file)
-                        current_file = None
+                    if self.should_exclude(match.group(1)):
+                        excluded_files.append(match.group(1))
                         continue
-                    changed_files.append(current_file)
-                    file_count += 1
-                    if file_count > self.max_files:
-                        logger.warning(f"Max files limit ({self.max_files}) reached")
+                    current_file = match.group(1)
+                    held, held_size = [line], 0
+                    if self.detector is None and not settle():
                         break
+                continue
             
-            if current_file is not None:
+            if held is not None:
+                held.append(line)
+                held_size += len(line)
+                if held_size >= self.detector.sample_chars and not settle():
+                    break
+            elif current_file is not None:
                 filtered_lines.append(line)
         
+        if held is not None:
+            settle()
+        
+        for filepath, reason in generated_files.items():
+            logger.info("Excluded %s: %s", filepath, reason)
+        
         filtered_diff = '\n'.join(filtered_lines)
         diff_line_count = len(filtered_lines)
         
         stats = {
             'total_files': file_count,
             'excluded_files': excluded_files,
+            'generated_files': generated_files,
             'changed_files': changed_files,
             'diff_lines': diff_line_count,
             'exceeds_limit': diff_line_count > self.max_diff_size
         }
         
         return filtered_diff, stats
+    
+    def filter_diffstat(self, diffstat: List[Dict]) -> Tuple[List[str], Dict]:
+        """
+        Apply exclusion and size limits to diffstat metadata before any diff is downloaded.
+        Returns (paths_to_fetch, stats); diff_lines is an estimate (changed lines plus headers)
+        that never exceeds the size of the real diff.
+        """
+        selected_files = []
+        excluded_files = []
+        diff_line_count = 0
+        
+        for entry in diffstat:
+            new_file = entry.get('new') or {}
+            old_file = entry.get('old') or {}
+            filepath = new_file.get('path') or old_file.get('path')
+            if not filepath:
+                continue
+            
+            if self.should_exclude(filepath):
+                excluded_files.append(filepath)
+                continue
+            
+            if len(selected_files) >= self.max_files:
+                logger.warning("Max files limit (%s) reached", self.max_files)
+                break
+            
+            selected_files.append(filepath)
+            diff_line_count += (entry.get('lines_added') or 0) + (entry.get('lines_removed') or 0) + self.DIFF_HEADER_LINES
+        
+        stats = {
+            'total_files': len(selected_files),
+            'excluded_files': excluded_files,
+            'changed_files': selected_files,
+            'diff_lines': diff_line_count,
+            'exceeds_limit': diff_line_count > self.max_diff_size,
+            'estimated': True
+        }
+        
+        return selected_files, stats
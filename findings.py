@@ -0,0 +1,106 @@
+"""
+Structured review findings
+In structured output mode the model returns compact JSON findings instead of markdown prose;
+they are validated once here and every later step (confidence, resources, formatting) works
+on the parsed fields.
+"""
+
+import json
+import re
+from typing import Dict, Optional
+
+
+SEVERITIES = ('critical', 'important', 'suggestion')
+
+# Models sometimes answer with words instead of numbers
+CONFIDENCE_WORDS = {'high': 0.9, 'medium': 0.6, 'low': 0.3}
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = """Respond with a single JSON object and nothing else:
+{"summary": "<one sentence overall assessment>",
+ "findings": [{"file": "<path>", "line": <line number in the new file or null>,
+   "severity": "critical|important|suggestion", "category": "<short snake_case category, e.g. sql_injection>",
+   "confidence": <0.0-1.0>, "issue": "<what is wrong and why, one or two sentences>",
+   "fix": "<concrete fix, code allowed>"}]}
+Severity: critical = security vulnerabilities, breaking changes, data corruption; important = performance
+problems, anti-patterns, likely bugs; suggestion = quality and readability. Report only real issues,
+most severe first; return an empty findings list if there are none."""
+
+FENCE_PATTERN = re.compile(r'^```(?:json)?\s*(.*?)\s*```$', re.DOTALL)
+
+
+def structured_system_prompt(system_prompt: str) -> str:
+    """Replace the markdown formatting instruction of a reviewer prompt with the JSON schema"""
+    prompt = system_prompt.rstrip()
+    if prompt.endswith("Format your response in clean markdown."):
+        prompt = prompt[:-len("Format your response in clean markdown.")].rstrip()
+    return f"{prompt}\n\n{STRUCTURED_OUTPUT_INSTRUCTIONS}"
+
+
+def _parse_confidence(value) -> float:
+    if isinstance(value, str):
+        word = value.strip().lower()
+        if word in CONFIDENCE_WORDS:
+            return CONFIDENCE_WORDS[word]
+        value = float(word[:-1]) / 100 if word.endswith('%') else float(word)
+    return max(0.0, min(1.0, float(value)))
+
+
+def _parse_line(value) -> Optional[int]:
+    if value is None or value == '':
+        return None
+    try:
+        line = int(value)
+    except (TypeError, ValueError):
+        return None
+    return line if line > 0 else None
+
+
+def load_json_document(content: str) -> Dict:
+    """Decode a JSON object answer (a bare list is taken as the findings list); raises ValueError"""
+    text = content.strip()
+    fenced = FENCE_PATTERN.match(text)
+    if fenced:
+        text = fenced.group(1)
+    
+    try:
+        document = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Review is not valid JSON: {e}")
+    if isinstance(document, list):
+        document = {'findings': document}
+    if not isinstance(document, dict) or not isinstance(document.get('findings', []), list):
+        raise ValueError("Review JSON must be an object with a 'findings' list")
+    return document
+
+
+def normalize_findings(document: Dict) -> Dict:
+    """Normalize a decoded findings document (severity, line, confidence), sorted by severity"""
+    findings = []
+    for raw in document.get('findings', []):
+        if not isinstance(raw, dict) or not (raw.get('issue') or raw.get('fix')):
+            continue
+        severity = str(raw.get('severity', '')).strip().lower()
+        try:
+            confidence = _parse_confidence(raw.get('confidence', 0.5))
+        except (TypeError, ValueError):
+            confidence = 0.5
+        findings.append({
+            'file': str(raw.get('file') or ''),
+            'line': _parse_line(raw.get('line')),
+            'severity': severity if severity in SEVERITIES else 'suggestion',
+            'category': str(raw.get('category') or 'general').strip().lower().replace(' ', '_'),
+            'confidence': confidence,
+            'issue': str(raw.get('issue') or '').strip(),
+            'fix': str(raw.get('fix') or '').strip()
+        })
+    
+    findings.sort(key=lambda finding: SEVERITIES.index(finding['severity']))
+    return {'summary': str(document.get('summary') or '').strip(), 'findings': findings}
+
+
+def parse_findings(content: str) -> Dict:
+    """
+    Validate a structured review, returns {'summary': str, 'findings': [finding, ...]}
+    Raises ValueError when the content is not a usable findings document.
+    """
+    return normalize_findings(load_json_document(content))
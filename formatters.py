@@ -2,10 +2,97 @@
 Comment formatting for Bitbucket
 """
 
+import re
 from datetime import datetime
 from typing import Dict, List, Optional
 
 
+# Room kept in every part for the "Part n/total" labels
+PART_LABEL_ROOM = 80
+
+SECTION_START = re.compile(r'^(?:#{1,6} |---\s*$)')
+
+FENCE = '```'
+
+
+def _boundary(line: str, previous: str, level: int) -> bool:
+    """Whether a part may start at line: sections (level 0), paragraphs (1) or any line (2)"""
+    if level == 0:
+        return bool(SECTION_START.match(line))
+    if level == 1:
+        return not previous.strip()
+    return True
+
+
+def _units(text: str, level: int) -> List[str]:
+    """Split text before every boundary of the level that is outside a code block"""
+    units, current, previous, in_fence = [], [], '', False
+    for line in text.splitlines(keepends=True):
+        if current and not in_fence and _boundary(line, previous, level):
+            units.append(''.join(current))
+            current = []
+        current.append(line)
+        if line.lstrip().startswith(FENCE):
+            in_fence = not in_fence
+        previous = line
+    if current:
+        units.append(''.join(current))
+    return units
+
+
+def _split_lines(text: str, budget: int) -> List[str]:
+    """Line-level split; a code block cut in two is closed and reopened with its opening line"""
+    pieces, current, opener = [], '', None
+    for line in text.splitlines(keepends=True):
+        room = budget - (len(opener) + len(FENCE) + 2 if opener else 0)
+        while len(line) > room:
+            # A single line longer than a part is cut hard
+            if current:
+                pieces.append(current + (f"\n{FENCE}\n" if opener else ''))
+                current = f"{opener}\n" if opener else ''
+            cut = max(1, room - len(current))
+            pieces.append(current + line[:cut] + (f"\n{FENCE}\n" if opener else ''))
+            current = f"{opener}\n" if opener else ''
+            line = line[cut:]
+        if current.strip() and current != f"{opener}\n" and len(current) + len(line) > room:
+            pieces.append(current + (f"{FENCE}\n" if opener else ''))
+            current = f"{opener}\n" if opener else ''
+        current += line
+        if line.lstrip().startswith(FENCE):
+            opener = None if opener else line.strip()
+    if current.strip():
+        pieces.append(current)
+    return pieces
+
+
+def _pack(text: str, budget: int, level: int) -> List[str]:
+    """Greedily join the units of a level into pieces of at most budget; oversized units go a level down"""
+    if len(text) <= budget:
+        return [text]
+    if level > 1:
+        return _split_lines(text, budget)
+    
+    pieces, current = [], ''
+    for unit in _units(text, level):
+        if len(unit) > budget:
+            split = _pack(unit, budget, level + 1)
+            if len(current) + len(split[0]) <= budget:
+                split[0] = current + split[0]
+            elif current:
+                pieces.append(current)
+            # The tail of the unit can still share a piece with what follows
+            pieces.extend(split[:-1])
+            current = split[-1]
+        elif len(current) + len(unit) > budget:
+            pieces.append(current)
+            current = unit
+        else:
+            current += unit
+    if current.strip():
+        pieces.append(current)
+    return pieces
+
+
 class CommentFormatter:
     """Format AI review as Bitbucket comment"""
     
@@ -26,7 +113,7 @@ class CommentFormatter:
         files = stats.get('files', 0)
         author = pr_details.get('author', {}).get('display_name', 'N/A')
         
-        header = f"""## 🤖 AI Code Review by CodeWise
+        parts = [f"""## 🤖 AI Code Review by CodeWise
 
 | 📊 **Review Details** | |
 |:---|:---|
@@ -34,34 +121,103 @@ class CommentFormatter:
 | **🧠 AI Model** | {model} |
 | **📁 Files Analyzed** | {files} |
 | **👤 PR Author** | {author} |
-"""
+"""]
         
         # Add confidence score if available
         if confidence_score is not None:
             confidence_icon = "🟢" if confidence_score >= 0.8 else "🟡" if confidence_score >= 0.6 else "🔴"
-            header += f"| **{confidence_icon} Confidence Score** | {confidence_score:.0%} |\n"
+            parts.append(f"| **{confidence_icon} Confidence Score** | {confidence_score:.0%} |\n")
         
-        header += "\n---\n\n"
+        parts.append("\n---\n\n")
         
         # Main review content
-        body = review_content
+        parts.append(review_content)
         
         # Add learning resources if available
         if learning_resources:
-            body += "\n\n---\n\n### 📚 Learning Resources\n\n"
-            body += "*Based on the issues found, these resources might be helpful:*\n\n"
+            parts.append("\n\n---\n\n### 📚 Learning Resources\n\n")
+            parts.append("*Based on the issues found, these resources might be helpful:*\n\n")
             for resource in learning_resources[:5]:  # Top 5 resources
-                body += f"- **{resource['title']}**: {resource['url']}\n"
+                parts.append(f"- **{resource['title']}**: {resource['url']}\n")
                 if resource.get('description'):
-                    body += f"  *{resource['description']}*\n"
-                body += "\n"
+                    parts.append(f"  *{resource['description']}*\n")
+                parts.append("\n")
         
         # Footer
-        footer = "\n\n---\n\n"
+        parts.append("\n\n---\n\n")
         if cost:
-            footer += f"*🤖 Powered by **CodeWise** • AI Model: {model} • Cost: ~${cost:.4f}*\n\n"
+            parts.append(f"*🤖 Powered by **CodeWise** • AI Model: {model} • Cost: ~${cost:.4f}*\n\n")
         else:
-            footer += f"*🤖 Powered by **CodeWise** • AI Model: {model}*\n\n"
-        footer += "*This is an automated code review. Please verify all suggestions before applying.*"
+            parts.append(f"*🤖 Powered by **CodeWise** • AI Model: {model}*\n\n")
+        parts.append("*This is an automated code review. Please verify all suggestions before applying.*")
+        
+        return ''.join(parts)
+    
+    @staticmethod
+    def split(comment: str, max_chars: int) -> List[str]:
+        """
+        Split a rendered comment into ordered parts of at most max_chars: at section boundaries
+        (headings, --- rules) where possible, then at paragraphs, then at lines. Code blocks are
+        only cut at lines, and are closed and reopened around the cut. Parts are labeled n/total.
+        """
+        if len(comment) <= max_chars:
+            return [comment]
+        
+        budget = max_chars - PART_LABEL_ROOM
+        pieces = [piece for piece in _pack(comment, budget, 0) if piece.strip()]
+        total = len(pieces)
+        parts = []
+        for number, piece in enumerate(pieces, 1):
+            if number > 1:
+                piece = f"*Part {number}/{total} (continued)*\n\n" + piece.lstrip('\n')
+            if number < total:
+                piece = piece.rstrip('\n') + f"\n\n*Continued in part {number + 1}/{total}*"
+            parts.append(piece)
+        return parts
+    
+    @staticmethod
+    def format_findings(
+        document: Dict,
+        severity_labels: Optional[Dict[str, str]] = None
+    ) -> str:
+        """Render parsed structured findings (see findings.parse_findings) as review markdown"""
+        labels = {
+            'critical': "🔴 Critical Issues",
+            'important': "🟡 Important Issues",
+            'suggestion': "🔵 Suggestions"
+        }
+        if severity_labels:
+            labels.update({key: value for key, value in severity_labels.items() if key in labels})
+        
+        parts = []
+        if document.get('summary'):
+            parts.append(document['summary'] + "\n")
+        
+        findings = document.get('findings', [])
+        if not findings:
+            parts.append("✅ No issues found.")
+        
+        for severity, label in labels.items():
+            group = [finding for finding in findings if finding['severity'] == severity]
+            if not group:
+                continue
+            parts.append(f"### {label}\n")
+            for finding in group:
+                location = f"`{finding['file']}`" if finding['file'] else ""
+                if location and finding['line']:
+                    location += f" line {finding['line']}"
+                heading = f"- **{finding['category'].replace('_', ' ')}**"
+                if location:
+                    heading += f" ({location})"
+                parts.append(f"{heading}: {finding['issue']} *(confidence {finding['confidence']:.0%})*")
+                if '\n' in finding['fix']:
+                    code = finding['fix']
+                    if code.startswith('```'):
+                        code = code.split('\n', 1)[-1].rsplit('```', 1)[0]
+                    code = code.strip('\n').replace('\n', '\n    ')
+                    parts.append(f"  - **Fix:**\n    ```\n    {code}\n    ```")
+                elif finding['fix']:
+                    parts.append(f"  - **Fix:** {finding['fix']}")
+            parts.append("")
         
-        return header + body + footer
+        return "\n".join(parts).rstrip() + "\n"
@@ -0,0 +1,127 @@
+"""
+Multi-keyword matcher for issue catalogs
+Compiles all keywords into one Aho-Corasick automaton, so a review is scanned once
+regardless of how many keywords the catalog has.
+"""
+
+import json
+from collections import Counter, deque
+from functools import lru_cache
+from typing import Dict, Iterator, List, Tuple
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+class KeywordMatcher:
+    """Case-insensitive Aho-Corasick matcher that only reports whole-word matches"""
+    
+    def __init__(self, keywords: Dict[str, List[str]]):
+        """keywords maps each keyword to the labels (e.g. issue keys) it counts for"""
+        self.keywords = []
+        self.labels = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        
+        for keyword, labels in keywords.items():
+            keyword = keyword.lower().strip()
+            if keyword:
+                self._add(keyword, labels)
+        self._build_failure_links()
+    
+    def _add(self, keyword: str, labels: List[str]):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        
+        self._out[state].append(len(self.keywords))
+        self.keywords.append(keyword)
+        self.labels.append(list(labels))
+    
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+    
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """Yield (start, keyword) for every whole-word occurrence, in one pass over text"""
+        for start, index in self._scan(text):
+            yield start, self.keywords[index]
+    
+    def _scan(self, text: str) -> Iterator[Tuple[int, int]]:
+        text = text.lower()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        
+        for end, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            
+            for index in out[state]:
+                keyword = self.keywords[index]
+                start = end - len(keyword) + 1
+                # Boundaries only matter where the keyword itself starts/ends with a word character
+                if _is_word_char(keyword[0]) and start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if _is_word_char(keyword[-1]) and end + 1 < len(text) and _is_word_char(text[end + 1]):
+                    continue
+                yield start, index
+    
+    def count_labels(self, text: str) -> Counter:
+        """Number of keyword hits per label"""
+        counts = Counter()
+        for _, index in self._scan(text):
+            for label in self.labels[index]:
+                counts[label] += 1
+        return counts
+    
+    @staticmethod
+    def from_issue_catalog(common_issues: Dict[str, Dict]) -> 'KeywordMatcher':
+        """
+        Matcher over a get_common_issues() catalog; issues without keywords match their key
+        Compiled once per distinct catalog and shared, since reviewers are created per PR
+        """
+        return _compile_catalog(catalog_keywords(common_issues))
+
+
+def catalog_keywords(common_issues: Dict[str, Dict]) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+    """(issue_key, keywords) of every catalog issue, hashable so compiled matchers can be cached on it"""
+    return tuple(
+        (issue_key, tuple(issue_data.get('keywords', [issue_key.replace('_', ' ')])))
+        for issue_key, issue_data in common_issues.items()
+    )
+
+
+@lru_cache(maxsize=32)
+def _compile_catalog(issue_keywords: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> KeywordMatcher:
+    keywords = {}
+    for issue_key, issue_keyword_list in issue_keywords:
+        for keyword in issue_keyword_list:
+            labels = keywords.setdefault(keyword.lower().strip(), [])
+            if issue_key not in labels:
+                labels.append(issue_key)
+    return KeywordMatcher(keywords)
+
+
+@lru_cache(maxsize=32)
+def load_issue_catalog(path: str) -> Dict[str, Dict]:
+    """Read an issue catalog data file (JSON object of issue_key -> issue data), cached per path"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
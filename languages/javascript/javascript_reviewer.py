@@ -59,5 +59,5 @@ Format your response in clean markdown."""
         ]
     
     def get_common_issues(self) -> Dict[str, Dict]:
-        """Return dictionary of common JavaScript issues"""
-        return {}
+        """Return dictionary of common JavaScript issues, loaded from the issue catalog data files"""
+        return self.load_issue_catalog()
@@ -69,5 +69,5 @@ Format your response in clean markdown."""
         ]
     
     def get_common_issues(self) -> Dict[str, Dict]:
-        """Return dictionary of common Python issues"""
-        return {}
+        """Return dictionary of common Python issues, loaded from the issue catalog data files"""
+        return self.load_issue_catalog()
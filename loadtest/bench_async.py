@@ -0,0 +1,70 @@
+"""
+Throughput of the synchronous vs asyncio pipeline against the local fake server
+
+    python -m loadtest.bench_async --prs 20 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from async_clients import AsyncBitbucketClient, AsyncOpenAIClient
+from async_pipeline import run_reviews_async
+from clients import BitbucketClient, OpenAIClient
+from config import Config
+from loadtest.fake_servers import FakeServer
+from pipeline import run_review
+from utils import configure_logging
+
+
+def bench_sync(server: FakeServer, config: Config, pr_ids) -> float:
+    bb_client = BitbucketClient('bench', 'repo', 'token', base_url=server.bitbucket_url)
+    ai_client = OpenAIClient('test-key', model='gpt-4o-mini', base_url=server.openai_url)
+    start = time.perf_counter()
+    for pr_id in pr_ids:
+        run_review(bb_client, ai_client, pr_id, config)
+    return time.perf_counter() - start
+
+
+def bench_async(server: FakeServer, config: Config, pr_ids, concurrency: int) -> float:
+    async def run():
+        bb_client = AsyncBitbucketClient('bench', 'repo', 'token', base_url=server.bitbucket_url)
+        ai_client = AsyncOpenAIClient('test-key', model='gpt-4o-mini', base_url=server.openai_url)
+        try:
+            errors = await run_reviews_async(bb_client, ai_client, pr_ids, config, concurrency=concurrency)
+        finally:
+            await bb_client.aclose()
+            await ai_client.aclose()
+        failed = [e for e in errors if e]
+        if failed:
+            raise failed[0]
+    
+    start = time.perf_counter()
+    asyncio.run(run())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--prs', type=int, default=20, help="Number of PRs to review")
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake server latency per request (seconds)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent reviews in the async run")
+    args = parser.parse_args()
+    
+    configure_logging('WARNING')
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    config = Config()
+    pr_ids = [str(i) for i in range(1, args.prs + 1)]
+    
+    with FakeServer(latency=args.latency) as server:
+        sync_seconds = bench_sync(server, config, pr_ids)
+        async_seconds = bench_async(server, config, pr_ids, args.concurrency)
+    
+    print(f"{args.prs} reviews, {args.latency * 1000:.0f} ms per request")
+    print(f"  sync : {sync_seconds:6.2f}s  {args.prs / sync_seconds:6.1f} reviews/s")
+    print(f"  async: {async_seconds:6.2f}s  {args.prs / async_seconds:6.1f} reviews/s  (concurrency {args.concurrency})")
+
+
+if __name__ == '__main__':
+    main()
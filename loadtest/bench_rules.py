@@ -0,0 +1,111 @@
+"""
+Speed of the local rule engine over large synthetic diffs
+
+    python -m loadtest.bench_rules --files 2000 --lines 50
+
+Compares the single-pass engine with running every rule on its own over each added line.
+"""
+
+import argparse
+import random
+import re
+import time
+
+from config import Config
+from reviewer_factory import ReviewerFactory
+from rule_engine import LocalRuleEngine
+from utils import configure_logging
+
+
+SAMPLE_LINES = {
+    'python': (
+        ['total = sum(item.price for item in items)', 'logger.info("Processed %s rows", count)',
+         'result = {key: value for key, value in pairs}', 'if user.is_active and not user.is_staff:',
+         'return self.repository.find_by_id(entity_id)'],
+        ['digest = hashlib.md5(password.encode()).hexdigest()', 'data = pickle.loads(payload)',
+         'cursor.execute("SELECT * FROM users WHERE id = " + user_id)', 'requests.get(url, verify=False)']
+    ),
+    'javascript': (
+        ['const total = items.reduce((sum, item) => sum + item.price, 0);', 'logger.info(`Processed ${count} rows`);',
+         'export function isActive(user) { return user.active && !user.banned; }', 'await repository.findById(id);',
+         'setState((previous) => ({ ...previous, loading: false }));'],
+        ['element.innerHTML = response.body;', 'eval(userCode);', 'db.query("SELECT * FROM users WHERE id = " + id);',
+         "const hash = crypto.createHash('md5');"]
+    ),
+    'php': (
+        ['$total = array_sum(array_column($items, \'price\'));', 'Log::info("Processed {$count} rows");',
+         'return $this->repository->findById($id);', 'if ($user->isActive() && !$user->isBanned()) {',
+         '$query->where(\'status\', \'active\')->get();'],
+        ['$hash = md5($password);', '$data = unserialize($input);', 'mysqli_query($db, "SELECT * FROM users WHERE id = " . $id);',
+         'echo $_GET[\'name\'];']
+    )
+}
+
+EXTENSIONS = {'python': 'py', 'javascript': 'js', 'php': 'php'}
+
+
+def synthetic_diff(language: str, files: int, lines: int, hit_rate: float, seed: int = 1) -> str:
+    """Diff adding lines lines to each of files files; hit_rate of the lines match a rule"""
+    clean, risky = SAMPLE_LINES[language]
+    rng = random.Random(seed)
+    parts = []
+    for index in range(files):
+        path = f"src/module_{index}.{EXTENSIONS[language]}"
+        parts.append(f"diff --git a/{path} b/{path}\n--- a/{path}\n+++ b/{path}\n@@ -1,2 +1,{lines + 2} @@\n context")
+        for _ in range(lines):
+            line = rng.choice(risky) if rng.random() < hit_rate else rng.choice(clean)
+            parts.append(f"+    {line}")
+        parts.append(" context")
+    return '\n'.join(parts) + '\n'
+
+
+def naive_scan(engine: LocalRuleEngine, diff: str) -> int:
+    """Baseline: every rule on its own over every added line"""
+    patterns = [re.compile(rule['pattern']) for _, rule in engine.rules]
+    hits = 0
+    for line in diff.split('\n'):
+        if line.startswith('+') and not line.startswith('+++'):
+            for pattern in patterns:
+                if pattern.search(line):
+                    hits += 1
+    return hits
+
+
+def best_of(repeat: int, function, *args):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=2000, help="Files in the synthetic diff")
+    parser.add_argument('--lines', type=int, default=50, help="Added lines per file")
+    parser.add_argument('--hit-rate', type=float, default=0.01, help="Share of added lines matching a rule")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+    
+    configure_logging('WARNING')
+    config = Config()
+    for language in ('python', 'javascript', 'php'):
+        engine = LocalRuleEngine.from_config(config, ReviewerFactory.create_reviewer(language, config.config))
+        # No finding cap, so both scans do the same work
+        engine.max_findings = 10 ** 9
+        diff = synthetic_diff(language, args.files, args.lines, args.hit_rate)
+        typical = synthetic_diff(language, 8, 40, args.hit_rate)
+        
+        engine_seconds, result = best_of(args.repeat, engine.evaluate, diff)
+        naive_seconds, hits = best_of(args.repeat, naive_scan, engine, diff)
+        typical_seconds, _ = best_of(args.repeat, engine.evaluate, typical)
+        print(f"{language}: {len(diff) / 1e6:.1f} MB, {result['added_lines']} added lines, {len(engine.rules)} rules")
+        print(f"  single pass:   {engine_seconds * 1000:8.1f} ms  ({result['added_lines'] / engine_seconds / 1e6:.2f}M lines/s, "
+              f"{len(result['findings'])} findings)")
+        print(f"  rule by rule:  {naive_seconds * 1000:8.1f} ms  ({hits} matches)")
+        print(f"  typical PR (8 files x 40 lines): {typical_seconds * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
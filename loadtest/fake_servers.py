@@ -0,0 +1,637 @@
+"""
+Local fake Bitbucket and OpenAI HTTP servers for benchmarks, load tests and the test suite
+Serves the Bitbucket REST endpoints used by BitbucketClient, the chat completions endpoint
+and the Batch API (/files, /batches) on one threaded HTTP server, fully offline. Latency is drawn from a configurable
+distribution per service, a share of requests can be answered with 429s or 5xx errors,
+and traffic can be recorded to / replayed from a cassette file.
+"""
+
+import base64
+import email.parser
+import email.policy
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import tarfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import Request, urlopen
+
+
+SAMPLE_FILES = {
+    'app/services/payment.py': (
+        "import hashlib\n\n\n"
+        "def charge(user, amount):\n"
+        "    token = hashlib.md5(user.password.encode()).hexdigest()\n"
+        "    return {'user': user.id, 'amount': amount, 'token': token}\n"
+    ),
+    'app/views/orders.py': (
+        "from app.services.payment import charge\n\n\n"
+        "def checkout(request):\n"
+        "    return charge(request.user, request.POST['amount'])\n"
+    ),
+}
+
+
+def make_diff(files: Dict[str, str]) -> str:
+    """Unified diff adding every line of the given files"""
+    parts = []
+    for path, content in files.items():
+        lines = content.rstrip('\n').split('\n')
+        parts.append(f"diff --git a/{path} b/{path}\nindex 0000000..1111111 100644\n--- a/{path}\n+++ b/{path}\n")
+        parts.append(f"@@ -0,0 +1,{len(lines)} @@\n" + ''.join(f"+{line}\n" for line in lines))
+    return ''.join(parts)
+
+
+class LatencyModel:
+    """Per-request latency in seconds drawn from a fixed, uniform, lognormal or exponential distribution"""
+    
+    KINDS = ('fixed', 'uniform', 'lognormal', 'exponential')
+    
+    def __init__(self, kind: str = 'fixed', a: float = 0.0, b: float = 0.0, seed: Optional[int] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}' (expected one of {', '.join(self.KINDS)})")
+        # fixed: a seconds; uniform: a..b; lognormal: median a, sigma b; exponential: mean a
+        self.kind = kind
+        self.a = a
+        self.b = b
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    def sample(self) -> float:
+        if self.kind == 'fixed' or self.a <= 0:
+            return max(0.0, self.a)
+        with self._lock:
+            if self.kind == 'uniform':
+                return self._random.uniform(self.a, self.b)
+            if self.kind == 'lognormal':
+                return self._random.lognormvariate(math.log(self.a), self.b)
+            return self._random.expovariate(1 / self.a)
+    
+    def describe(self) -> str:
+        if self.kind == 'fixed':
+            return f"fixed {self.a * 1000:.0f} ms"
+        if self.kind == 'uniform':
+            return f"uniform {self.a * 1000:.0f}-{self.b * 1000:.0f} ms"
+        if self.kind == 'lognormal':
+            return f"lognormal median {self.a * 1000:.0f} ms, sigma {self.b:g}"
+        return f"exponential mean {self.a * 1000:.0f} ms"
+    
+    @staticmethod
+    def parse(spec: Union[str, float, 'LatencyModel', None], seed: Optional[int] = None) -> 'LatencyModel':
+        """
+        Build a model from a spec: seconds as a number, "fixed:S", "uniform:LOW:HIGH",
+        "lognormal:MEDIAN:SIGMA" or "exponential:MEAN"
+        """
+        if isinstance(spec, LatencyModel):
+            return spec
+        if spec is None or isinstance(spec, (int, float)):
+            return LatencyModel('fixed', float(spec or 0.0))
+        
+        kind, _, rest = str(spec).partition(':')
+        try:
+            if not rest:
+                return LatencyModel('fixed', float(kind))
+            params = [float(value) for value in rest.split(':')]
+        except ValueError:
+            raise ValueError(f"Invalid latency spec '{spec}'")
+        if kind in ('uniform', 'lognormal') and len(params) != 2:
+            raise ValueError(f"Latency spec '{spec}' needs two parameters")
+        return LatencyModel(kind, params[0], params[1] if len(params) > 1 else 0.0, seed)
+
+
+class Cassette:
+    """
+    Recorded responses keyed by request, stored as JSON lines
+    Replay looks up the exact request first (method, path, query and a hash of the body), then
+    any recording of the same route with numeric ids generalized; repeated lookups cycle through
+    the matching recordings. Request headers (credentials) are never stored.
+    """
+    
+    def __init__(self, path: str, load: bool = True):
+        self.path = path
+        self.entries: List[Dict] = []
+        self._by_key: Dict[str, List[Dict]] = {}
+        self._by_route: Dict[str, List[Dict]] = {}
+        self._cursors = Counter()
+        self._lock = threading.Lock()
+        if load and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self._index(json.loads(line))
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    @staticmethod
+    def key(method: str, path: str, query: Dict, body: Optional[Dict]) -> str:
+        query_string = urlencode(sorted((name, value) for name, values in query.items() for value in values))
+        digest = ''
+        if body is not None:
+            digest = hashlib.sha256(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        return f"{method} {path}?{query_string} {digest}"
+    
+    @staticmethod
+    def route(method: str, path: str) -> str:
+        return f"{method} " + re.sub(r'/\d+(?=/|$)', '/{id}', path)
+    
+    def _index(self, entry: Dict):
+        self.entries.append(entry)
+        self._by_key.setdefault(entry['key'], []).append(entry)
+        self._by_route.setdefault(entry['route'], []).append(entry)
+    
+    def lookup(self, method: str, path: str, query: Dict, body: Optional[Dict]) -> Optional[Dict]:
+        """Recorded response for a request, or None"""
+        with self._lock:
+            for index, name in ((self._by_key, self.key(method, path, query, body)), (self._by_route, self.route(method, path))):
+                recordings = index.get(name)
+                if recordings:
+                    cursor = self._cursors[name]
+                    self._cursors[name] += 1
+                    return recordings[cursor % len(recordings)]
+        return None
+    
+    def record(self, method: str, path: str, query: Dict, body: Optional[Dict], status: int, content_type: str, payload):
+        entry = {
+            'key': self.key(method, path, query, body),
+            'route': self.route(method, path),
+            'status': status,
+            'content_type': content_type,
+            # Binary payloads (archives) are stored base64-encoded
+            'payload': base64.b64encode(payload).decode('ascii') if isinstance(payload, bytes) else payload,
+            'base64': isinstance(payload, bytes)
+        }
+        with self._lock:
+            self._index(entry)
+    
+    def save(self):
+        """Write every recording to the cassette file (atomically)"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with self._lock, open(temp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(temp_path, self.path)
+
+
+class FakeServer:
+    """
+    Threaded HTTP server answering Bitbucket (/2.0) and OpenAI (/v1) requests
+    Batches run every input line through the chat completions fake when created and report
+    'in_progress' for the first batch_polls retrievals, then 'completed'; requests whose custom_id
+    is in batch_errors are rejected with that message in the batch's error file.
+    mode 'fake' serves synthetic responses, 'record' also stores them in the cassette (or, with
+    upstreams set, proxies to the real services and stores their answers), 'replay' serves
+    only from the cassette. Latency and injected faults apply in every mode and are never recorded.
+    """
+    
+    MODES = ('fake', 'record', 'replay')
+    
+    def __init__(
+        self,
+        latency: Union[float, str, LatencyModel] = 0.0,
+        files: Optional[Dict[str, str]] = None,
+        llm_latency: Union[float, str, LatencyModel, None] = None,
+        rate_limit_rate: float = 0.0,
+        error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None,
+        cassette: Optional[Cassette] = None,
+        mode: str = 'fake',
+        upstreams: Optional[Dict[str, str]] = None,
+        batch_polls: int = 0,
+        diff: Optional[str] = None,
+        batch_errors: Optional[Dict[str, str]] = None
+    ):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown fake server mode '{mode}'")
+        if mode != 'fake' and cassette is None:
+            raise ValueError(f"Mode '{mode}' needs a cassette")
+        self.latency = LatencyModel.parse(latency, seed)
+        # Chat completions are usually much slower than REST calls, so they get their own distribution
+        self.llm_latency = self.latency if llm_latency is None else LatencyModel.parse(
+            llm_latency, None if seed is None else seed + 1
+        )
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.cassette = cassette
+        self.mode = mode
+        # Upstream base URLs per service for recording real traffic, e.g. {'openai': 'https://api.openai.com'}
+        self.upstreams = upstreams or {}
+        self.files = files or SAMPLE_FILES
+        # PR diff served for the whole PR; by default every file is added from scratch
+        self.diff = diff or make_diff(self.files)
+        self.stats = Counter()
+        # (method, path, query) of every request, in arrival order
+        self.request_log: List[Tuple[str, str, Dict]] = []
+        # Comment id -> {'id', 'repository', 'pr_id', 'content': {'raw'}, 'deleted'}
+        self.pr_comments: Dict[int, Dict] = {}
+        # Uploaded and generated files by id ({'id', 'filename', 'purpose', 'content'}) and batch objects by id
+        self.uploaded_files: Dict[str, Dict] = {}
+        self.batches: Dict[str, Dict] = {}
+        self.batch_polls = batch_polls
+        self.batch_errors = batch_errors or {}
+        self._batch_retrievals = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+    
+    @property
+    def comments(self) -> List[Tuple[str, Dict]]:
+        """(pr_id, body) of every comment not deleted, in posting order"""
+        with self._lock:
+            return [
+                (comment['pr_id'], {'content': comment['content']})
+                for _, comment in sorted(self.pr_comments.items()) if not comment['deleted']
+            ]
+    
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    @property
+    def bitbucket_url(self) -> str:
+        return f"{self.url}/2.0"
+    
+    @property
+    def openai_url(self) -> str:
+        return f"{self.url}/v1"
+    
+    @property
+    def request_count(self) -> int:
+        return self.stats['requests']
+    
+    def __enter__(self) -> 'FakeServer':
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.mode == 'record':
+            self.cassette.save()
+    
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+    
+    def handle(self, method: str, path: str, query: Dict, body: Optional[Dict], headers: Optional[Dict] = None):
+        """Return (status, content_type, payload) for a request"""
+        # Bitbucket serves the REST API under /2.0 and source archives from the site root
+        service = 'openai' if path.startswith('/v1/') else 'bitbucket'
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats[f'{service}_requests'] += 1
+            self.request_log.append((method, path, query))
+            roll = self._random.random()
+        delay = (self.llm_latency if service == 'openai' else self.latency).sample()
+        if delay > 0:
+            time.sleep(delay)
+        
+        if roll < self.rate_limit_rate:
+            self._count('injected_429')
+            return 429, 'application/json', {'error': {
+                'message': 'Rate limit reached (injected by the fake server)',
+                'type': 'rate_limit_error',
+                'code': 'rate_limit_exceeded'
+            }}
+        if roll < self.rate_limit_rate + self.error_rate:
+            self._count('injected_5xx')
+            return 503, 'application/json', {'error': {
+                'message': 'Service unavailable (injected by the fake server)',
+                'type': 'server_error'
+            }}
+        
+        if self.mode == 'replay':
+            entry = self.cassette.lookup(method, path, query, body)
+            if entry is None:
+                self._count('replay_misses')
+                return 404, 'application/json', {'error': {'message': f"no recording for {method} {path}"}}
+            self._count('replayed')
+            payload = base64.b64decode(entry['payload']) if entry.get('base64') else entry['payload']
+            return entry['status'], entry['content_type'], payload
+        
+        if self.mode == 'record' and service in self.upstreams:
+            status, content_type, payload = self._forward(service, method, path, query, body, headers or {})
+        else:
+            status, content_type, payload = self._respond(method, path, query, body)
+        if self.mode == 'record':
+            self.cassette.record(method, path, query, body, status, content_type, payload)
+            self._count('recorded')
+        return status, content_type, payload
+    
+    def _respond(self, method: str, path: str, query: Dict, body: Optional[Dict]):
+        """Synthetic response for a request"""
+        if method == 'POST' and path.endswith('/chat/completions'):
+            return 200, 'application/json', self._completion(body or {})
+        if path.startswith('/v1/files') or path.startswith('/v1/batches'):
+            return self._batch_api(method, path, body or {})
+        
+        archive = re.match(r'^/([^/]+)/([^/]+)/get/([^/]+)\.tar\.gz$', path)
+        if archive and method == 'GET':
+            return 200, 'application/x-gzip', self._archive(archive.group(1), archive.group(2))
+        
+        match = re.match(r'^/2\.0/repositories/([^/]+)/([^/]+)/(pullrequests/(\d+)(/.*)?|src/([^/]+)/(.*))$', path)
+        if not match:
+            return 404, 'application/json', {'error': {'message': f"no route for {path}"}}
+        
+        workspace, repo, _, pr_id, pr_suffix, branch, filepath = match.groups()
+        if filepath is not None and (filepath == '' or filepath.endswith('/')):
+            directory = filepath.rstrip('/')
+            entries = [{'type': 'commit_file', 'path': path_} for path_ in self.files if os.path.dirname(path_) == directory]
+            if not entries:
+                return 404, 'application/json', {'error': {'message': 'not found'}}
+            return 200, 'application/json', {'values': entries}
+        if filepath is not None:
+            if filepath not in self.files:
+                return 404, 'application/json', {'error': {'message': 'not found'}}
+            return 200, 'text/plain', self.files[filepath]
+        if not pr_suffix:
+            return 200, 'application/json', self._pr_details(workspace, repo, pr_id)
+        if pr_suffix == '/diffstat':
+            return 200, 'application/json', {'values': [
+                {'new': {'path': path_}, 'lines_added': content.count('\n'), 'lines_removed': 0}
+                for path_, content in self.files.items()
+            ]}
+        if pr_suffix == '/diff':
+            paths = query.get('path')
+            diff = make_diff({p: self.files[p] for p in paths if p in self.files}) if paths else self.diff
+            return 200, 'text/plain', diff
+        if pr_suffix == '/comments' and method == 'POST':
+            with self._lock:
+                comment_id = len(self.pr_comments) + 1
+                self.pr_comments[comment_id] = {
+                    'id': comment_id,
+                    'repository': f"{workspace}/{repo}",
+                    'pr_id': pr_id,
+                    'content': {'raw': ((body or {}).get('content') or {}).get('raw', '')},
+                    'deleted': False
+                }
+                return 201, 'application/json', dict(self.pr_comments[comment_id])
+        if pr_suffix == '/comments' and method == 'GET':
+            with self._lock:
+                values = [
+                    dict(comment) for _, comment in sorted(self.pr_comments.items())
+                    if comment['repository'] == f"{workspace}/{repo}" and comment['pr_id'] == pr_id
+                ]
+            return 200, 'application/json', {'values': values}
+        comment_route = re.match(r'^/comments/(\d+)$', pr_suffix or '')
+        if comment_route and method in ('PUT', 'DELETE'):
+            with self._lock:
+                comment = self.pr_comments.get(int(comment_route.group(1)))
+                if comment is None or comment['deleted']:
+                    return 404, 'application/json', {'error': {'message': 'comment not found'}}
+                if method == 'DELETE':
+                    comment['deleted'] = True
+                    return 204, 'application/json', ''
+                comment['content'] = {'raw': ((body or {}).get('content') or {}).get('raw', '')}
+                return 200, 'application/json', dict(comment)
+        return 404, 'application/json', {'error': {'message': f"no route for {path}"}}
+    
+    def _store_file(self, filename: str, purpose: str, content: str) -> Dict:
+        with self._lock:
+            file_id = f"file-{len(self.uploaded_files) + 1}"
+            self.uploaded_files[file_id] = {'id': file_id, 'filename': filename, 'purpose': purpose, 'content': content}
+        return self._file_object(self.uploaded_files[file_id])
+    
+    @staticmethod
+    def _file_object(stored: Dict) -> Dict:
+        return {
+            'id': stored['id'],
+            'object': 'file',
+            'bytes': len(stored['content'].encode('utf-8')),
+            'created_at': int(time.time()),
+            'filename': stored['filename'],
+            'purpose': stored['purpose'],
+            'status': 'processed'
+        }
+    
+    def _batch_api(self, method: str, path: str, body: Dict):
+        """Batch API: file upload and download, batch creation and retrieval"""
+        if path == '/v1/files' and method == 'POST':
+            return 200, 'application/json', self._store_file(
+                body.get('filename') or 'upload.jsonl', body.get('purpose', 'batch'), body.get('file', '')
+            )
+        file_route = re.match(r'^/v1/files/([^/]+)(/content)?$', path)
+        if file_route and method == 'GET':
+            stored = self.uploaded_files.get(file_route.group(1))
+            if stored is None:
+                return 404, 'application/json', {'error': {'message': 'file not found'}}
+            if file_route.group(2):
+                return 200, 'application/octet-stream', stored['content'].encode('utf-8')
+            return 200, 'application/json', self._file_object(stored)
+        
+        if path == '/v1/batches' and method == 'POST':
+            stored = self.uploaded_files.get(body.get('input_file_id'))
+            if stored is None:
+                return 400, 'application/json', {'error': {'message': 'input file not found'}}
+            results, errors = [], []
+            for number, line in enumerate(line for line in stored['content'].splitlines() if line.strip()):
+                request = json.loads(line)
+                message = self.batch_errors.get(request['custom_id'])
+                if message:
+                    response = {'status_code': 400, 'body': {'error': {'message': message, 'type': 'invalid_request_error'}}}
+                else:
+                    response = {'status_code': 200, 'body': self._completion(request['body'])}
+                response['request_id'] = f"req_{number + 1}"
+                (errors if message else results).append({
+                    'id': f"batch_req_{number + 1}",
+                    'custom_id': request['custom_id'],
+                    'response': response,
+                    'error': None
+                })
+            output = self._store_file('batch_output.jsonl', 'batch_output', ''.join(json.dumps(result) + '\n' for result in results))
+            error_file = self._store_file('batch_errors.jsonl', 'batch_output', ''.join(json.dumps(error) + '\n' for error in errors)) if errors else None
+            with self._lock:
+                batch_id = f"batch_{len(self.batches) + 1}"
+                self.batches[batch_id] = {
+                    'id': batch_id,
+                    'object': 'batch',
+                    'endpoint': body.get('endpoint', '/v1/chat/completions'),
+                    'input_file_id': stored['id'],
+                    'completion_window': body.get('completion_window', '24h'),
+                    'created_at': int(time.time()),
+                    'status': 'validating',
+                    'output_file_id': None,
+                    'error_file_id': None,
+                    'request_counts': {'total': len(results) + len(errors), 'completed': 0, 'failed': 0},
+                    '_output_file_id': output['id'],
+                    '_error_file_id': error_file['id'] if error_file else None
+                }
+            return 200, 'application/json', self._batch_object(batch_id)
+        batch_route = re.match(r'^/v1/batches/([^/]+)$', path)
+        if batch_route and method == 'GET':
+            batch_id = batch_route.group(1)
+            with self._lock:
+                batch = self.batches.get(batch_id)
+                if batch is None:
+                    return 404, 'application/json', {'error': {'message': 'batch not found'}}
+                self._batch_retrievals[batch_id] += 1
+                if self._batch_retrievals[batch_id] > self.batch_polls:
+                    batch['status'] = 'completed'
+                    batch['output_file_id'] = batch['_output_file_id']
+                    batch['error_file_id'] = batch['_error_file_id']
+                    batch['request_counts']['failed'] = self._failed_requests(batch['_error_file_id'])
+                    batch['request_counts']['completed'] = batch['request_counts']['total'] - batch['request_counts']['failed']
+                else:
+                    batch['status'] = 'in_progress'
+            return 200, 'application/json', self._batch_object(batch_id)
+        return 404, 'application/json', {'error': {'message': f"no route for {path}"}}
+    
+    def _failed_requests(self, error_file_id: Optional[str]) -> int:
+        if not error_file_id:
+            return 0
+        return len(self.uploaded_files[error_file_id]['content'].splitlines())
+    
+    def _batch_object(self, batch_id: str) -> Dict:
+        with self._lock:
+            return {name: value for name, value in self.batches[batch_id].items() if not name.startswith('_')}
+    
+    def _forward(self, service: str, method: str, path: str, query: Dict, body: Optional[Dict], headers: Dict):
+        """Send a request to the real service (record mode with upstreams)"""
+        url = self.upstreams[service].rstrip('/') + path
+        if query:
+            url += '?' + urlencode(query, doseq=True)
+        forwarded = {name: value for name, value in headers.items() if name.lower() in ('authorization', 'accept', 'content-type')}
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        try:
+            with urlopen(Request(url, data=data, headers=forwarded, method=method), timeout=300) as response:
+                status, content_type, raw = response.status, response.headers.get('Content-Type', ''), response.read()
+        except HTTPError as e:
+            status, content_type, raw = e.code, e.headers.get('Content-Type', ''), e.read()
+        
+        text = raw.decode('utf-8', errors='replace')
+        if 'json' in content_type:
+            try:
+                return status, 'application/json', json.loads(text)
+            except json.JSONDecodeError:
+                pass
+        return status, content_type.split(';')[0] or 'text/plain', text
+    
+    def _archive(self, workspace: str, repo: str) -> bytes:
+        """tar.gz of the served files under one top-level directory, like Bitbucket's source archives"""
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            for path, content in self.files.items():
+                data = content.encode('utf-8')
+                member = tarfile.TarInfo(f"{workspace}-{repo}-0123456789ab/{path}")
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+        return buffer.getvalue()
+    
+    @staticmethod
+    def _pr_details(workspace: str, repo: str, pr_id: str) -> Dict:
+        return {
+            'id': int(pr_id),
+            'title': f"Load test PR {pr_id}",
+            'author': {'display_name': 'Load Tester'},
+            'source': {
+                'branch': {'name': 'feature'},
+                'commit': {'hash': 'f' * 40},
+                'repository': {'full_name': f"{workspace}/{repo}"}
+            },
+            'destination': {'branch': {'name': 'main'}, 'commit': {'hash': 'a' * 40}}
+        }
+    
+    @staticmethod
+    def _completion(body: Dict) -> Dict:
+        prompt_tokens = sum(len(m.get('content', '')) for m in body.get('messages', [])) // 4
+        review = "### 🔴 Critical Issues\n- `app/services/payment.py` line 5: md5 is not a password hash."
+        # Packed requests (request_coalescing) get one answer per unit
+        units = re.findall(r'^===== UNIT (\d+) =====$', body.get('messages', [{}])[-1].get('content', ''), re.MULTILINE)
+        if units:
+            review = '\n\n'.join(f"===== REVIEW {number} =====\n{review}" for number in units)
+        completion_tokens = 24 * max(1, len(units))
+        return {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {
+                    'role': 'assistant',
+                    'content': review
+                }
+            }],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+        }
+    
+    def _handler_class(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def _serve(self, method: str):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                content_type = self.headers.get('Content-Type') or ''
+                if content_type.startswith('multipart/form-data'):
+                    body = self._form(content_type, raw)
+                else:
+                    body = json.loads(raw) if raw else None
+                
+                status, content_type, payload = server.handle(
+                    method, parsed.path, parse_qs(parsed.query), body, dict(self.headers)
+                )
+                if isinstance(payload, bytes):
+                    data = payload
+                elif isinstance(payload, str):
+                    data = payload.encode('utf-8')
+                else:
+                    data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                if status == 429:
+                    self.send_header('Retry-After', f"{server.retry_after:g}")
+                self.end_headers()
+                self.wfile.write(data)
+            
+            @staticmethod
+            def _form(content_type: str, raw: bytes) -> Dict:
+                """Fields of a multipart upload (the Batch API input file); file fields also give 'filename'"""
+                message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+                    f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + raw
+                )
+                fields = {}
+                for part in message.iter_parts():
+                    name = part.get_param('name', header='content-disposition')
+                    fields[name] = part.get_payload(decode=True).decode('utf-8')
+                    if part.get_filename():
+                        fields['filename'] = part.get_filename()
+                return fields
+            
+            def do_GET(self):
+                self._serve('GET')
+            
+            def do_POST(self):
+                self._serve('POST')
+            
+            def do_PUT(self):
+                self._serve('PUT')
+            
+            def do_DELETE(self):
+                self._serve('DELETE')
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
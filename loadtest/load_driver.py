@@ -0,0 +1,213 @@
+"""
+Load driver: N concurrent end-to-end reviews against the local fake servers
+
+    python -m loadtest.load_driver --reviews 200 --concurrency 16 --llm-latency lognormal:0.8:0.5 --rate-limit-rate 0.02
+    python -m loadtest.load_driver --record cassette.jsonl --reviews 1 --pr-ids 42 --workspace ws --repo repo \\
+        --upstream-bitbucket https://api.bitbucket.org --upstream-openai https://api.openai.com
+    python -m loadtest.load_driver --replay cassette.jsonl --reviews 500 --pr-ids 42 --workspace ws --repo repo
+
+Reports throughput, p50/p95/p99 review latency, the error rate by exception type and what the
+fake server injected. Only recording against real upstreams needs network access.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from async_clients import AsyncBitbucketClient, AsyncOpenAIClient
+from async_pipeline import run_review_async
+from clients import BitbucketClient, OpenAIClient
+from config import Config
+from loadtest.fake_servers import Cassette, FakeServer
+from pipeline import run_review
+from resilience import LatencyTracker, LLMResilience
+from utils import configure_logging
+
+
+def drive_sync(server: FakeServer, config: Config, pr_ids: List[str], concurrency: int, credentials: Dict) -> List[Tuple[float, Optional[str]]]:
+    """Run every review with run_review on a thread pool; each review gets its own clients, like a CI job"""
+    def review(pr_id: str) -> Tuple[float, Optional[str]]:
+        start = time.perf_counter()
+        try:
+            bb_client = BitbucketClient.from_config(credentials['workspace'], credentials['repo'],
+                                                    credentials['bitbucket_token'], config, base_url=server.bitbucket_url)
+            ai_client = OpenAIClient(
+                credentials['openai_key'],
+                model=config.get('model', 'gpt-3.5-turbo'),
+                temperature=config.get('temperature', 0.2),
+                max_tokens=config.get('max_tokens', 2000),
+                base_url=server.openai_url,
+                resilience=LLMResilience.from_config(config)
+            )
+            run_review(bb_client, ai_client, pr_id, config)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, type(e).__name__
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        return list(executor.map(review, pr_ids))
+
+
+def drive_async(server: FakeServer, config: Config, pr_ids: List[str], concurrency: int, credentials: Dict) -> List[Tuple[float, Optional[str]]]:
+    """Run every review with run_review_async on shared async clients, at most concurrency at a time"""
+    async def run():
+        bb_client = AsyncBitbucketClient.from_config(credentials['workspace'], credentials['repo'],
+                                                     credentials['bitbucket_token'], config, base_url=server.bitbucket_url)
+        ai_client = AsyncOpenAIClient(
+            credentials['openai_key'],
+            model=config.get('model', 'gpt-3.5-turbo'),
+            temperature=config.get('temperature', 0.2),
+            max_tokens=config.get('max_tokens', 2000),
+            base_url=server.openai_url,
+            resilience=LLMResilience.from_config(config)
+        )
+        limit = asyncio.Semaphore(max(1, concurrency))
+        
+        async def review(pr_id: str) -> Tuple[float, Optional[str]]:
+            async with limit:
+                start = time.perf_counter()
+                try:
+                    await run_review_async(bb_client, ai_client, pr_id, config)
+                    return time.perf_counter() - start, None
+                except Exception as e:
+                    return time.perf_counter() - start, type(e).__name__
+        
+        try:
+            return await asyncio.gather(*(review(pr_id) for pr_id in pr_ids))
+        finally:
+            await bb_client.aclose()
+            await ai_client.aclose()
+    
+    return asyncio.run(run())
+
+
+def summarize(results: List[Tuple[float, Optional[str]]], elapsed: float, server: FakeServer) -> Dict:
+    """Throughput, latency percentiles of successful reviews, error rate by type and server counters"""
+    succeeded = [seconds for seconds, error in results if error is None]
+    errors = Counter(error for _, error in results if error is not None)
+    tracker = LatencyTracker(window=max(1, len(succeeded)))
+    for seconds in succeeded:
+        tracker.record(seconds)
+    
+    return {
+        'reviews': len(results),
+        'succeeded': len(succeeded),
+        'failed': sum(errors.values()),
+        'error_rate': sum(errors.values()) / len(results) if results else 0.0,
+        'errors': dict(errors),
+        'elapsed': elapsed,
+        'throughput': len(succeeded) / elapsed if elapsed else 0.0,
+        'latency': {
+            'p50': tracker.percentile(50),
+            'p95': tracker.percentile(95),
+            'p99': tracker.percentile(99),
+            'max': max(succeeded) if succeeded else None,
+            'mean': sum(succeeded) / len(succeeded) if succeeded else None
+        },
+        'server': dict(server.stats)
+    }
+
+
+def format_summary(summary: Dict, description: str) -> str:
+    def ms(value: Optional[float]) -> str:
+        return f"{value * 1000:8.0f} ms" if value is not None else "       - ms"
+    
+    lines = [
+        description,
+        f"  reviews    : {summary['reviews']} ({summary['succeeded']} ok, {summary['failed']} failed) in {summary['elapsed']:.2f}s",
+        f"  throughput : {summary['throughput']:.2f} reviews/s",
+        f"  error rate : {summary['error_rate'] * 100:.1f}%"
+        + (f"  ({', '.join(f'{name}: {count}' for name, count in sorted(summary['errors'].items()))})" if summary['errors'] else ''),
+        "  latency    : " + "  ".join(f"{name} {ms(summary['latency'][name])}" for name in ('p50', 'p95', 'p99', 'max')),
+        "  server     : " + ", ".join(f"{name} {count}" for name, count in sorted(summary['server'].items()))
+    ]
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reviews', type=int, default=50, help="Number of end-to-end reviews to run")
+    parser.add_argument('--concurrency', type=int, default=8, help="Reviews in flight at once")
+    parser.add_argument('--pipeline', choices=('async', 'sync'), default='async',
+                        help="async: run_review_async on shared clients; sync: run_review on a thread pool")
+    parser.add_argument('--pr-ids', nargs='+', help="PR ids to review in turn (default 1..N)")
+    parser.add_argument('--workspace', default='loadtest')
+    parser.add_argument('--repo', default='repo')
+    parser.add_argument('--latency', default='lognormal:0.03:0.5',
+                        help="Bitbucket latency: seconds, fixed:S, uniform:LOW:HIGH, lognormal:MEDIAN:SIGMA or exponential:MEAN")
+    parser.add_argument('--llm-latency', default='lognormal:0.4:0.5', help="Chat completions latency, same format")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for latencies and injected faults")
+    parser.add_argument('--record', metavar='CASSETTE', help="Record responses to a cassette file")
+    parser.add_argument('--replay', metavar='CASSETTE', help="Serve responses only from a cassette file")
+    parser.add_argument('--upstream-bitbucket', help="With --record: proxy Bitbucket requests to this base URL")
+    parser.add_argument('--upstream-openai', help="With --record: proxy chat completions to this base URL")
+    parser.add_argument('--config', default=os.getenv('CONFIG_FILE', 'config.yaml'))
+    parser.add_argument('--log-level', default='ERROR')
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    args = parser.parse_args()
+    
+    if args.record and args.replay:
+        parser.error("--record and --replay are mutually exclusive")
+    
+    configure_logging(args.log_level)
+    config = Config(args.config)
+    pr_ids = args.pr_ids or [str(i) for i in range(1, args.reviews + 1)]
+    pr_ids = [pr_ids[i % len(pr_ids)] for i in range(args.reviews)]
+    credentials = {
+        'workspace': args.workspace,
+        'repo': args.repo,
+        # Only forwarded when recording against real upstreams
+        'bitbucket_token': os.getenv('BITBUCKET_APP_PASSWORD', 'load-test'),
+        'openai_key': os.getenv('OPENAI_KEY', 'load-test')
+    }
+    
+    mode, cassette = 'fake', None
+    if args.record or args.replay:
+        mode = 'record' if args.record else 'replay'
+        # A recording run starts a fresh cassette
+        cassette = Cassette(args.record or args.replay, load=not args.record)
+    upstreams = {}
+    if args.upstream_bitbucket:
+        upstreams['bitbucket'] = args.upstream_bitbucket
+    if args.upstream_openai:
+        upstreams['openai'] = args.upstream_openai
+    
+    server = FakeServer(
+        latency=args.latency,
+        llm_latency=args.llm_latency,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        cassette=cassette,
+        mode=mode,
+        upstreams=upstreams
+    )
+    drive = drive_async if args.pipeline == 'async' else drive_sync
+    with server:
+        start = time.perf_counter()
+        results = drive(server, config, pr_ids, args.concurrency, credentials)
+        elapsed = time.perf_counter() - start
+    
+    summary = summarize(results, elapsed, server)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    description = (
+        f"{args.pipeline} pipeline, concurrency {args.concurrency}, {mode} mode; "
+        f"bitbucket {server.latency.describe()}, llm {server.llm_latency.describe()}; "
+        f"{args.rate_limit_rate * 100:g}% 429s, {args.error_rate * 100:g}% 503s"
+    )
+    print(format_summary(summary, description))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Local git client - review a diff straight from a local checkout
+Drop-in replacement for BitbucketClient that reads from git instead of the Bitbucket API
+"""
+
+import os
+import subprocess
+from typing import Dict, List, Optional
+from deadline import Deadline, DeadlineExceeded
+from utils import logger
+
+
+class LocalGitClient:
+    """Serve PR details, diffs and file contents from a local git repository"""
+    
+    def __init__(self, repo_path: str = '.', base: str = 'origin/main', head: str = 'HEAD',
+                 deadline: Optional[Deadline] = None):
+        self.repo_path = repo_path
+        self.base = base
+        self.head = head
+        # Run deadline every git command is clamped to, as with BitbucketClient
+        self.deadline = deadline
+    
+    def _git(self, *args: str, input_data: Optional[bytes] = None) -> bytes:
+        """Run a git command in the repository and return its raw stdout"""
+        logger.debug("git %s", ' '.join(args))
+        timeout = self.deadline.timeout(None, f"git {args[0]}") if self.deadline else None
+        try:
+            result = subprocess.run(
+                ['git', '-C', self.repo_path, *args],
+                input=input_data,
+                capture_output=True,
+                check=False,
+                timeout=timeout
+            )
+        except subprocess.TimeoutExpired as e:
+            raise DeadlineExceeded(f"Run deadline reached during git {args[0]}") from e
+        if result.returncode != 0:
+            raise RuntimeError(f"git {args[0]} failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return result.stdout
+    
+    def _git_text(self, *args: str) -> str:
+        return self._git(*args).decode('utf-8', 'replace')
+    
+    @property
+    def _range(self) -> str:
+        return f"{self.base}...{self.head}"
+    
+    def get_pr_details(self, pr_id: str) -> Dict:
+        """Build Bitbucket-shaped PR metadata from the head commit"""
+        subject, author, head_hash = self._git_text(
+            'log', '-1', '--format=%s%x00%an%x00%H', self.head
+        ).strip().split('\x00')
+        base_hash = self._git_text('rev-parse', self.base).strip()
+        toplevel = self._git_text('rev-parse', '--show-toplevel').strip()
+        
+        return {
+            'id': pr_id,
+            'title': subject,
+            'author': {'display_name': author},
+            'source': {
+                'branch': {'name': self.head},
+                'commit': {'hash': head_hash},
+                'repository': {'full_name': os.path.basename(toplevel)}
+            },
+            'destination': {
+                'branch': {'name': self.base},
+                'commit': {'hash': base_hash}
+            }
+        }
+    
+    def get_pr_diffstat(self, pr_id: str) -> List[Dict]:
+        """Per-file line counts in the shape of Bitbucket diffstat entries"""
+        entries = []
+        output = self._git_text('diff', '--numstat', '--no-renames', '-z', self._range)
+        for record in output.split('\x00'):
+            if not record:
+                continue
+            added, removed, filepath = record.split('\t', 2)
+            entries.append({
+                'new': {'path': filepath},
+                # Binary files are reported as '-'
+                'lines_added': int(added) if added.isdigit() else 0,
+                'lines_removed': int(removed) if removed.isdigit() else 0
+            })
+        return entries
+    
+    def get_pr_diff(self, pr_id: str) -> str:
+        """Diff of head against its merge base with base (git diff base...head)"""
+        return self._git_text('diff', '--no-color', '--no-ext-diff', self._range)
+    
+    def get_pr_diff_for_files(self, pr_id: str, filepaths: List[str], max_workers: int = 8) -> str:
+        """Diff limited to the given files; a single git call, no parallelism needed locally"""
+        if not filepaths:
+            return ""
+        return self._git_text('diff', '--no-color', '--no-ext-diff', self._range, '--', *filepaths)
+    
+    def get_file_content(self, filepath: str, branch: str) -> str:
+        """Fetch full file content at a ref"""
+        try:
+            return self._git_text('show', f"{branch}:{filepath}")
+        except RuntimeError as e:
+            logger.warning("Failed to read %s: %s", filepath, e)
+            return ""
+    
+    def get_files_content(self, filepaths: List[str], branch: str) -> Dict[str, str]:
+        """Read many files at a ref with one `git cat-file --batch` call"""
+        if not filepaths:
+            return {}
+        
+        request = ''.join(f"{branch}:{filepath}\n" for filepath in filepaths).encode('utf-8')
+        output = self._git('cat-file', '--batch', input_data=request)
+        
+        contents = {}
+        pos = 0
+        for filepath in filepaths:
+            header_end = output.index(b'\n', pos)
+            header = output[pos:header_end].decode('utf-8', 'replace')
+            pos = header_end + 1
+            
+            # "<object> missing" for paths that do not exist at the ref
+            parts = header.split()
+            if len(parts) != 3 or not parts[2].isdigit():
+                logger.warning("Failed to read %s: %s", filepath, header)
+                continue
+            
+            size = int(parts[2])
+            if parts[1] == 'blob':
+                contents[filepath] = output[pos:pos + size].decode('utf-8', 'replace')
+            pos += size + 1  # content is followed by a newline
+        
+        return contents
+    
+    def list_directory(self, dirpath: str, branch: str) -> Dict[str, Optional[str]]:
+        """Files directly in a directory at a ref, mapped to their blob hashes (one `git ls-tree` call)"""
+        directory = dirpath.strip('/')
+        output = self._git_text('ls-tree', '-z', branch, *([f"{directory}/"] if directory else []))
+        files = {}
+        for record in output.split('\x00'):
+            if not record:
+                continue
+            info, filepath = record.split('\t', 1)
+            _, object_type, object_hash = info.split()
+            if object_type == 'blob':
+                files[filepath] = object_hash
+        return files
+    
+    def post_comment(self, pr_id: str, content: str, key: Optional[str] = None) -> Dict:
+        """Print the review to stdout instead of posting it (whole, whatever its length)"""
+        print(content)
+        return {}
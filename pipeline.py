@@ -0,0 +1,668 @@
+"""
+Review pipeline stages shared by every run mode (Bitbucket, local git, batch, async)
+fetch -> filter -> detect -> context -> prompt -> LLM -> format -> post
+I/O-free steps are separate functions so async_pipeline.py can reuse them
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from cascade import ModelCascade, split_units
+from clients import OpenAIClient
+from comment_posting import WARNING_KEY
+from deadline import Deadline, DeadlineExceeded
+from filters import DiffFilter, GeneratedFileDetector
+from findings import parse_findings, structured_system_prompt
+from formatters import CommentFormatter
+from utils import logger, calculate_cost
+from dedupe import DedupeStore, fingerprint_diff, neutralize_paths, restore_paths
+from diff_compaction import DiffCompactor
+from enhancements import (
+    MultiFileContext,
+    ConfidenceScorer,
+    SimilaritySearch
+)
+from language_detector import LanguageDetector
+from profiling import profile_stage
+from reviewer_factory import ReviewerFactory
+from rule_engine import (
+    LocalRuleEngine,
+    local_findings_section,
+    local_review_content,
+    log_evaluation,
+    merge_findings,
+    reported_lines_note
+)
+from symbol_index import SymbolIndex
+
+
+REUSED_FINDINGS_NOTE = "*♻️ These findings were reused from an identical change reviewed earlier.*\n\n"
+# Hunks touching these are reviewed first when only part of a diff fits before the run deadline
+RISK_PATTERN = re.compile(
+    r'auth|password|passwd|secret|token|credential|permission|sql|query|exec|eval|shell|subprocess|'
+    r'deserializ|pickle|crypt|hash|session|cookie|csrf|redirect|upload|path|lock|thread|async|transaction',
+    re.IGNORECASE
+)
+
+
+def create_diff_filter(config: Config) -> DiffFilter:
+    return DiffFilter(
+        config.get('exclude_patterns', []),
+        config.get('max_diff_size', 5000),
+        config.get('max_files', 50),
+        detector=GeneratedFileDetector.from_config(config)
+    )
+
+
+def size_warning(diff_stats: Dict, config: Config) -> Optional[str]:
+    """Warning comment for a PR that is too large to review, or None if warnings are off"""
+    logger.warning("PR exceeds size limits, review skipped")
+    if not config.get('post_warning_on_skip', True):
+        return None
+    return f"""## ⚠️ AI Code Review Skipped
+This pull request is too large for automated AI review.
+**Diff size:** {diff_stats['diff_lines']} lines (limit: {config.get('max_diff_size', 5000)})
+**Files changed:** {diff_stats['total_files']}
+*AI code review works best with focused PRs under 1000 lines of changes.*"""
+
+
+def post_size_warning(bb_client, pr_id: str, diff_stats: Dict, config: Config):
+    """Post the size warning for a PR that is too large to review (if enabled)"""
+    warning = size_warning(diff_stats, config)
+    if warning:
+        bb_client.post_comment(pr_id, warning, key=WARNING_KEY)
+
+
+def fetch_filtered_diff(bb_client, pr_id: str, config: Config) -> Optional[Tuple[str, Dict]]:
+    """
+    Fetch and filter the PR diff, returns (filtered_diff, diff_stats)
+    or None when the PR is too large to review
+    """
+    diff_filter = create_diff_filter(config)
+    
+    # Decide on exclusions and size from the cheap diffstat before downloading any diff
+    raw_diff = None
+    if config.get('use_diffstat', True):
+        logger.info("Fetching PR diffstat...")
+        try:
+            with profile_stage('fetch'):
+                diffstat = bb_client.get_pr_diffstat(pr_id)
+        except Exception as e:
+            logger.warning("Diffstat unavailable, falling back to full diff: %s", e)
+            diffstat = None
+    
+        if diffstat is not None:
+            with profile_stage('filter'):
+                selected_files, diffstat_stats = diff_filter.filter_diffstat(diffstat)
+            if diffstat_stats['exceeds_limit'] and config.get('skip_large_prs', True):
+                with profile_stage('post'):
+                    post_size_warning(bb_client, pr_id, diffstat_stats, config)
+                return None
+    
+            with profile_stage('fetch'):
+                if len(selected_files) == len(diffstat):
+                    # Nothing to leave out, a single download is cheaper than per-file requests
+                    logger.info("Fetching PR diff...")
+                    raw_diff = bb_client.get_pr_diff(pr_id)
+                else:
+                    logger.info("Fetching diffs for %s of %s files...", len(selected_files), len(diffstat))
+                    raw_diff = bb_client.get_pr_diff_for_files(
+                        pr_id,
+                        selected_files,
+                        max_workers=config.get('diff_fetch_workers', 8)
+                    )
+    
+    if raw_diff is None:
+        logger.info("Fetching PR diff...")
+        with profile_stage('fetch'):
+            raw_diff = bb_client.get_pr_diff(pr_id)
+    
+    with profile_stage('filter'):
+        filtered_diff, diff_stats, too_large = filter_raw_diff(raw_diff, diff_filter, config)
+    if too_large:
+        with profile_stage('post'):
+            post_size_warning(bb_client, pr_id, diff_stats, config)
+        return None
+    return filtered_diff, diff_stats
+
+
+def filter_raw_diff(raw_diff: str, diff_filter: DiffFilter, config: Config) -> Tuple[str, Dict, bool]:
+    """Filter a downloaded diff, returns (filtered_diff, diff_stats, too_large_to_review)"""
+    logger.info("Filtering diff...")
+    filtered_diff, diff_stats = diff_filter.filter_diff(raw_diff)
+    
+    # Check if PR is too large
+    if diff_stats['exceeds_limit'] and config.get('skip_large_prs', True):
+        return filtered_diff, diff_stats, True
+    
+    logger.info("Diff stats: %s files, %s lines", diff_stats['total_files'], diff_stats['diff_lines'])
+    return filtered_diff, diff_stats, False
+
+
+def detect_language(filtered_diff: str, diff_stats: Dict) -> Tuple[str, str, Dict, str]:
+    """Detect (language, framework, lang_stats, language_name) from the changed files"""
+    logger.info("Detecting programming language...")
+    language, framework, lang_stats = LanguageDetector.detect_from_diff(
+        filtered_diff,
+        diff_stats.get('changed_files', [])
+    )
+    language_name = LanguageDetector.get_language_name(language, framework)
+    logger.info("Detected language: %s", language_name)
+    return language, framework, lang_stats, language_name
+
+
+def unsupported_language_warning(language: str, lang_stats: Dict) -> str:
+    """Warning comment for a PR whose primary language has no reviewer"""
+    logger.warning("Language %s not supported", language)
+    supported = ', '.join(ReviewerFactory.get_supported_languages())
+    return f"""## ⚠️ Language Not Supported
+The detected language **{language}** is not currently supported for automated review.
+
+**Supported languages:** {supported}
+
+**Language distribution in this PR:**
+{chr(10).join([f'- {lang}: {count} files' for lang, count in lang_stats.get('language_distribution', {}).items()])}
+
+*Please ensure the PR contains code in one of the supported languages.*"""
+
+
+def context_ref(pr_details: Dict) -> str:
+    """
+    Ref the full file context is read from: the source commit, so contents match the reviewed
+    diff and can be cached (file_cache), or the source branch when the commit is not known
+    """
+    source = pr_details.get('source', {})
+    return source.get('commit', {}).get('hash') or source.get('branch', {}).get('name', '')
+
+
+def context_allowed(deadline: Optional[Deadline], what: str, cuts: List[str]) -> bool:
+    """Whether optional context may still be gathered before the run deadline; records the cut if not"""
+    if deadline is None or deadline.allows_context():
+        return True
+    logger.warning("Run deadline close (%.0fs left), skipping %s", deadline.remaining(), what)
+    cuts.append(what)
+    return False
+
+
+def hunk_rank(unit: str) -> Tuple[int, int]:
+    """(risky lines, changed lines) of a hunk; more risky lines rank first, then larger hunks"""
+    changed = [line for line in unit.split('\n') if line[:1] in '+-' and not line.startswith(('+++', '---'))]
+    return sum(1 for line in changed if RISK_PATTERN.search(line)), len(changed)
+
+
+def top_hunks(diff: str, fraction: float) -> Optional[Tuple[str, Dict]]:
+    """
+    The highest-ranked hunks adding up to about fraction of the changed lines (at least one), in
+    diff order, and a summary of what was left out; None when everything fits
+    """
+    units = split_units(diff, 'hunk')
+    if fraction >= 1.0 or len(units) < 2:
+        return None
+    
+    ranks = [hunk_rank(unit) for _, unit in units]
+    budget = fraction * sum(changed for _, changed in ranks)
+    kept, spent = set(), 0
+    for index in sorted(range(len(units)), key=lambda index: (-ranks[index][0], -ranks[index][1])):
+        changed = ranks[index][1]
+        if kept and spent + changed > budget:
+            continue
+        kept.add(index)
+        spent += changed
+    if len(kept) == len(units):
+        return None
+    
+    parts, previous = [], None
+    for index, (path, unit) in enumerate(units):
+        if index not in kept:
+            continue
+        # Hunks of the same file share one file header
+        parts.append(unit[unit.find('\n@@') + 1:] if path == previous and '\n@@' in unit else unit)
+        previous = path
+    kept_paths = {units[index][0] for index in kept}
+    skipped_paths = {path for index, (path, _) in enumerate(units) if index not in kept}
+    return ''.join(parts), {
+        'hunks_reviewed': len(kept),
+        'hunks_total': len(units),
+        'files_partially_reviewed': sorted(skipped_paths & kept_paths),
+        'files_not_reviewed': sorted(skipped_paths - kept_paths)
+    }
+
+
+def fit_to_deadline(prepared: Dict, deadline: Optional[Deadline]):
+    """
+    Cut the prompt to the top-ranked hunks the LLM can review in the time left before the deadline;
+    the review is then marked partial (prepared['partial'])
+    """
+    if deadline is None or local_only(prepared):
+        return
+    fraction = deadline.review_fraction()
+    if fraction <= 0:
+        raise DeadlineExceeded("Run deadline reached before the LLM review")
+    trimmed = top_hunks(prepared['prompt_diff'], fraction)
+    if trimmed is None:
+        return
+    
+    prompt_diff, partial = trimmed
+    logger.warning(
+        "Run deadline close (%.0fs left): reviewing %s of %s hunks, highest risk first",
+        deadline.remaining(), partial['hunks_reviewed'], partial['hunks_total']
+    )
+    prepared['prompt_diff'] = prompt_diff
+    prepared['partial'] = partial
+    # Context of files left out entirely is not needed any more
+    full_files = {
+        path: content for path, content in (prepared.get('full_files') or {}).items()
+        if path not in partial['files_not_reviewed']
+    }
+    prepared['user_prompt'] = prepared['reviewer'].format_user_prompt(
+        prepared['pr_details'], prompt_diff, full_files or None, prepared['framework'], prepared.get('symbol_context')
+    )
+
+
+def partial_review_note(prepared: Dict) -> str:
+    """Label for a review whose scope was cut by the run deadline, or an empty string"""
+    partial = prepared.get('partial')
+    cuts = prepared.get('deadline_cuts') or []
+    if not partial and not cuts:
+        return ""
+    if not partial:
+        return f"*⏱️ Reviewed without {' and '.join(cuts)}: the run deadline was close.*\n\n"
+    
+    lines = [
+        "### ⏱️ Partial review",
+        f"The run deadline was close, so only {partial['hunks_reviewed']} of {partial['hunks_total']} changed hunks "
+        "were reviewed (highest risk first)."
+    ]
+    if partial['files_not_reviewed']:
+        lines.append(f"**Not reviewed:** {', '.join(f'`{path}`' for path in partial['files_not_reviewed'])}")
+    if partial['files_partially_reviewed']:
+        lines.append(f"**Partly reviewed:** {', '.join(f'`{path}`' for path in partial['files_partially_reviewed'])}")
+    if cuts:
+        lines.append(f"Reviewed without {' and '.join(cuts)}.")
+    return '\n'.join(lines) + "\n\n---\n\n"
+
+
+def deadline_notice(prepared: Dict, severity_labels: Optional[Dict[str, str]] = None) -> str:
+    """
+    Comment posted when the run deadline arrives before the LLM review finished; prepared may be
+    the partial progress of prepare_review (the change may not even have been fetched). Findings
+    of the local rules, when they ran, are included
+    """
+    if 'diff_stats' in prepared:
+        files = prepared['diff_stats'].get('changed_files', [])
+        listed = ', '.join(f'`{path}`' for path in files[:20]) + (f" and {len(files) - 20} more" if len(files) > 20 else "")
+    else:
+        listed = "not known, the deadline arrived while the change was being fetched"
+    findings = (prepared.get('local_rules') or {}).get('findings')
+    if findings:
+        outcome = "only the findings of the local rules below are available."
+        local = local_findings_section(findings, severity_labels)
+    else:
+        outcome = "no findings are available."
+        local = ""
+    return f"""## ⏱️ Partial review: AI code review not completed
+The run deadline was reached before the AI review of this pull request finished, so {outcome}
+**Files in the change:** {listed or 'none'}
+*Re-run the pipeline, or raise `deadline.seconds`, for a full review.*{local}"""
+
+
+def degrade_on_deadline(what: str, cuts: List[str], function, *args):
+    """Run an optional context stage; when the run deadline arrives during it, go on without that context"""
+    try:
+        return function(*args)
+    except DeadlineExceeded as e:
+        logger.warning("Run deadline reached while gathering %s, continuing without it: %s", what, e)
+        cuts.append(what)
+        return None
+
+
+def collect_symbol_context(bb_client, diff: str, branch: str, contents: Dict[str, str], config: Config) -> Optional[str]:
+    """Definitions from other files referenced by the change (symbol_context), or None"""
+    symbol_index = SymbolIndex.from_config(config)
+    if symbol_index is None:
+        return None
+    try:
+        return symbol_index.context_for(bb_client, diff, branch, contents)
+    finally:
+        symbol_index.close()
+
+
+def build_prepared(
+    pr_details: Dict,
+    filtered_diff: str,
+    diff_stats: Dict,
+    language: str,
+    framework: str,
+    language_name: str,
+    full_files: Optional[Dict[str, str]],
+    config: Config,
+    symbol_context: Optional[str] = None
+) -> Dict:
+    """Create the reviewer and prompts for a PR that passed every check"""
+    # The prompt gets the compacted diff; 'diff' stays as filtered for fingerprinting
+    prompt_diff, compaction = filtered_diff, None
+    compactor = DiffCompactor.from_config(config)
+    if compactor is not None:
+        prompt_diff, compaction = compactor.compact(filtered_diff)
+        compactor.log_stats(compaction)
+    
+    reviewer = ReviewerFactory.create_reviewer(language, config.config)
+    structured = config.get('output_format', 'markdown') == 'json'
+    system_prompt = reviewer.get_system_prompt(framework)
+    if structured:
+        system_prompt = structured_system_prompt(system_prompt)
+    
+    local_rules = None
+    engine = LocalRuleEngine.from_config(config, reviewer)
+    if engine is not None:
+        local_rules = engine.evaluate(filtered_diff)
+        log_evaluation(local_rules)
+    user_prompt = reviewer.format_user_prompt(pr_details, prompt_diff, full_files, framework, symbol_context)
+    if local_rules and not structured:
+        # Markdown reviews cannot be deduplicated afterwards, so the model is told what is already reported
+        user_prompt += reported_lines_note(local_rules['findings'])
+    return {
+        'pr_details': pr_details,
+        'diff': filtered_diff,
+        'prompt_diff': prompt_diff,
+        'compaction': compaction,
+        'diff_stats': diff_stats,
+        'language': language,
+        'framework': framework,
+        'language_name': language_name,
+        'full_files': full_files,
+        'symbol_context': symbol_context,
+        'reviewer': reviewer,
+        'structured': structured,
+        'system_prompt': system_prompt,
+        'user_prompt': user_prompt,
+        'local_rules': local_rules
+    }
+
+
+def prepare_review(bb_client, pr_id: str, config: Config, progress: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Run every stage up to the LLM call: fetch, filter, detect, context and prompt.
+    Returns None (after posting any warning) when the PR should not be reviewed.
+    progress collects pr_details and diff_stats as they arrive, for the deadline notice when the
+    run deadline interrupts the fetch; optional context stages are skipped instead.
+    """
+    progress = {} if progress is None else progress
+    logger.info("Fetching PR details...")
+    with profile_stage('fetch'):
+        pr_details = bb_client.get_pr_details(pr_id)
+    progress['pr_details'] = pr_details
+    
+    fetched = fetch_filtered_diff(bb_client, pr_id, config)
+    if fetched is None:
+        return None
+    filtered_diff, diff_stats = fetched
+    progress['diff_stats'] = diff_stats
+    
+    with profile_stage('detect'):
+        language, framework, lang_stats, language_name = detect_language(filtered_diff, diff_stats)
+    
+    # Check if language is supported
+    if not ReviewerFactory.is_language_supported(language):
+        with profile_stage('post'):
+            bb_client.post_comment(pr_id, unsupported_language_warning(language, lang_stats), key=WARNING_KEY)
+        return None
+    
+    deadline = getattr(bb_client, 'deadline', None)
+    cuts = []
+    
+    # Multi-file context
+    full_files, fetched = None, {}
+    if config.get('enable_multi_file_context', True) and context_allowed(deadline, 'full file context', cuts):
+        logger.info("Retrieving full file context...")
+        with profile_stage('context'):
+            context = MultiFileContext.from_config(bb_client, config, filtered_diff)
+            full_files = degrade_on_deadline(
+                'full file context', cuts, context.get_full_files,
+                diff_stats.get('changed_files', []), context_ref(pr_details)
+            )
+            fetched = context.fetched
+    
+    symbol_context = None
+    if context_allowed(deadline, 'symbol context', cuts):
+        with profile_stage('context'):
+            symbol_context = degrade_on_deadline(
+                'symbol context', cuts, collect_symbol_context,
+                bb_client, filtered_diff, context_ref(pr_details), fetched, config
+            )
+    if getattr(bb_client, 'file_cache', None):
+        bb_client.file_cache.log_stats()
+    
+    with profile_stage('prompt'):
+        prepared = build_prepared(
+            pr_details, filtered_diff, diff_stats, language, framework, language_name, full_files, config,
+            symbol_context
+        )
+    prepared['deadline_cuts'] = cuts
+    return prepared
+
+
+def render_review(
+    config: Config,
+    prepared: Dict,
+    review_content: str,
+    input_tokens: int,
+    output_tokens: int,
+    cached_tokens: int = 0,
+    batch: bool = False
+) -> Optional[str]:
+    """Score and format the AI review; returns None if it is held back by min_confidence_score"""
+    model = config.get('model', 'gpt-3.5-turbo')
+    reviewer = prepared['reviewer']
+    # Set by request_review when the two-tier cascade produced the review
+    cascade_report = prepared.get('cascade_report')
+    if cascade_report:
+        model = cascade_report['model_label']
+    
+    if input_tokens:
+        logger.info("Prompt cache: %s/%s input tokens cached (%.0f%%)", cached_tokens, input_tokens, (cached_tokens / input_tokens) * 100)
+    
+    cost = None
+    if config.get('enable_cost_tracking', True):
+        if cascade_report:
+            cost = cascade_report['total_cost']
+        else:
+            cost = calculate_cost(input_tokens, output_tokens, model, cached_tokens, batch)
+        logger.info("Review cost: $%.4f", cost)
+    
+    findings = None
+    if prepared.get('structured'):
+        note = REUSED_FINDINGS_NOTE if review_content.startswith(REUSED_FINDINGS_NOTE) else ""
+        try:
+            findings = parse_findings(review_content[len(note):])
+        except ValueError as e:
+            logger.warning("Structured findings could not be parsed, posting the raw response: %s", e)
+        else:
+            logger.info("Parsed %s structured findings", len(findings['findings']))
+            review_content = note + CommentFormatter.format_findings(findings, config.get('severity_labels', {}))
+    review_content = partial_review_note(prepared) + review_content
+    
+    confidence_score = None
+    if config.get('enable_confidence_scoring', True):
+        if findings is not None:
+            confidence_score = ConfidenceScorer.calculate_findings_confidence(findings['findings'])
+        else:
+            confidence_score = ConfidenceScorer.calculate_confidence(review_content)
+        logger.info("Confidence score: %.0f%%", confidence_score * 100)
+        if confidence_score < config.get('min_confidence_score', 0.0):
+            logger.warning("Confidence below min_confidence_score, review not posted")
+            return None
+    
+    learning_resources = None
+    if config.get('enable_learning_resources', True):
+        if findings is not None:
+            learning_resources = reviewer.resources_for_findings(findings['findings'])
+        else:
+            learning_resources = reviewer.enhance_review_with_resources(review_content)
+    
+    similar_code = None
+    if config.get('enable_similarity_search', False):
+        similar_code = SimilaritySearch().find_similar_code(prepared['diff_stats'].get('changed_files', []))
+    
+    return CommentFormatter.format(
+        review_content,
+        prepared['pr_details'],
+        {'model': model, 'files': prepared['diff_stats']['total_files']},
+        cost=cost,
+        confidence_score=confidence_score,
+        learning_resources=learning_resources,
+        similar_code=similar_code
+    )
+
+
+def publish_review(
+    bb_client,
+    pr_id: str,
+    config: Config,
+    prepared: Dict,
+    review_content: str,
+    input_tokens: int,
+    output_tokens: int,
+    cached_tokens: int = 0,
+    batch: bool = False
+) -> bool:
+    """Score, format and post the AI review; returns False if it was held back by min_confidence_score"""
+    with profile_stage('format'):
+        comment = render_review(config, prepared, review_content, input_tokens, output_tokens, cached_tokens, batch)
+    if comment is None:
+        return False
+    
+    logger.info("Posting review comment...")
+    with profile_stage('post'):
+        bb_client.post_comment(pr_id, comment)
+    return True
+
+
+def local_only(prepared: Dict) -> bool:
+    """Whether the local rules decided the change needs no LLM review"""
+    return bool((prepared.get('local_rules') or {}).get('skip_reason'))
+
+
+def local_rules_review(prepared: Dict, config: Config) -> Tuple[str, int, int, int]:
+    """Review of a change the local rules settled on their own, in the request_review result format"""
+    local_rules = prepared['local_rules']
+    content = local_review_content(
+        local_rules['skip_reason'], local_rules['findings'], prepared.get('structured', False),
+        config.get('severity_labels', {})
+    )
+    return content, 0, 0, 0
+
+
+def merge_local_findings(prepared: Dict, review_content: str, config: Config) -> str:
+    """LLM review with the local rule findings added"""
+    local_rules = prepared.get('local_rules')
+    if not local_rules:
+        return review_content
+    return merge_findings(
+        review_content, local_rules['findings'], prepared.get('structured', False), config.get('severity_labels', {})
+    )
+
+
+def lookup_reusable_findings(model: str, prepared: Dict, config: Config) -> Tuple[Optional[DedupeStore], Optional[str], Optional[str], Optional[str]]:
+    """
+    Look the PR's normalized change up in the dedupe store
+    Returns (store, fingerprint, version, findings); store is None when dedupe is disabled
+    and findings is None on a miss. The caller closes the store.
+    """
+    store = DedupeStore.from_config(config)
+    fingerprint = fingerprint_diff(prepared['diff']) if store else None
+    if not fingerprint:
+        return store, None, None, None
+    
+    version = DedupeStore.version_key(
+        model,
+        prepared['system_prompt'],
+        str((config.get('dedupe_store', {}) or {}).get('prompt_version', '1'))
+    )
+    findings = store.get(fingerprint, version)
+    store.log_stats()
+    if findings is not None:
+        logger.info("Reusing findings for an identical change (fingerprint %s)", fingerprint[:12])
+    return store, fingerprint, version, findings
+
+
+def request_review(ai_client: OpenAIClient, prepared: Dict, config: Config) -> Tuple[str, int, int, int]:
+    """
+    Get the review for a prepared PR, returns (content, input_tokens, output_tokens, cached_tokens)
+    Findings stored for an identical normalized change (in any repository) are reused without an LLM call,
+    and changes the local rules settled need none either
+    """
+    if local_only(prepared):
+        return local_rules_review(prepared, config)
+    
+    cascade = ModelCascade.from_config(ai_client, config)
+    model = cascade.model_label if cascade else ai_client.model
+    store, fingerprint, version, findings = lookup_reusable_findings(model, prepared, config)
+    try:
+        if findings is not None:
+            # Stored findings cover the whole change, whatever the deadline allowed
+            prepared.pop('partial', None)
+            return REUSED_FINDINGS_NOTE + restore_paths(findings, prepared['diff']), 0, 0, 0
+    
+        logger.info("Requesting AI review (%s)...", prepared['language_name'])
+        if cascade:
+            review_content, input_tokens, output_tokens, cached_tokens, report = cascade.run(prepared)
+            prepared['cascade_report'] = report
+        else:
+            review_content, input_tokens, output_tokens, cached_tokens = ai_client.review_code(
+                prepared['system_prompt'],
+                prepared['user_prompt'],
+                json_output=prepared.get('structured', False)
+            )
+        review_content = merge_local_findings(prepared, review_content, config)
+    
+        # A partial review must not be reused for the whole change
+        if fingerprint and not prepared.get('partial'):
+            store.put(fingerprint, version, neutralize_paths(review_content, prepared['diff']))
+        return review_content, input_tokens, output_tokens, cached_tokens
+    finally:
+        if store:
+            store.close()
+
+
+def run_review(bb_client, ai_client: OpenAIClient, pr_id: str, config: Config) -> None:
+    """
+    Review one pull request end to end
+    bb_client is a BitbucketClient or a LocalGitClient (same interface)
+    """
+    progress: Dict = {}
+    try:
+        prepared = prepare_review(bb_client, pr_id, config, progress)
+    except DeadlineExceeded as e:
+        logger.warning("Run deadline reached while preparing the review, posting a partial review: %s", e)
+        with profile_stage('post'):
+            bb_client.post_comment(pr_id, deadline_notice(progress, config.get('severity_labels', {})))
+        return
+    if prepared is None:
+        return
+    
+    try:
+        with profile_stage('llm'):
+            fit_to_deadline(prepared, getattr(ai_client, 'deadline', None))
+            review_content, input_tokens, output_tokens, cached_tokens = request_review(ai_client, prepared, config)
+    except DeadlineExceeded as e:
+        logger.warning("Run deadline reached before the review finished, posting a partial review: %s", e)
+        with profile_stage('post'):
+            bb_client.post_comment(pr_id, deadline_notice(prepared, config.get('severity_labels', {})))
+        return
+    finally:
+        if getattr(ai_client, 'resilience', None):
+            ai_client.resilience.log_stats()
+    
+    publish_review(
+        bb_client,
+        pr_id,
+        config,
+        prepared,
+        review_content,
+        input_tokens,
+        output_tokens,
+        cached_tokens=cached_tokens
+    )
+    logger.info("✅ AI code review completed successfully (%s, v2.0)", prepared['language_name'])
@@ -0,0 +1,160 @@
+"""
+Per-stage CPU and memory profiling of a review run (--profile)
+Each pipeline stage (fetch, filter, detect, context, prompt, llm, format, post) runs under
+cProfile and between tracemalloc snapshots; the report lists the top hotspots and allocation
+sites of every stage. cProfile only sees the calling thread: work done in thread pools (parallel
+diff and file fetches, hedged LLM requests) shows up as the time spent waiting on its futures.
+"""
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Optional
+from utils import logger
+
+
+STAGES = ('fetch', 'filter', 'detect', 'context', 'prompt', 'llm', 'format', 'post')
+
+# Python 3.8 has no tracemalloc.reset_peak; stage peaks are then the net growth between snapshots
+HAS_RESET_PEAK = hasattr(tracemalloc, 'reset_peak')
+
+_active_profiler: Optional['StageProfiler'] = None
+
+
+class StageProfiler:
+    """Collects cProfile stats, wall/CPU time and allocation peaks per stage"""
+    
+    def __init__(self, top_n: int = 20, exclude_network_wait: bool = False, trace_frames: int = 1):
+        self.top_n = top_n
+        # A CPU-time profiler clock leaves out time spent blocked on sockets (and any other waiting)
+        self.exclude_network_wait = exclude_network_wait
+        self.trace_frames = trace_frames
+        self.stages: Dict[str, Dict] = {}
+        self._current: Optional[str] = None
+    
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+    
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+    
+    @contextmanager
+    def stage(self, name: str):
+        """Profile the enclosed block as stage name; nested stages are counted in the outer one"""
+        if self._current is not None:
+            yield
+            return
+        
+        self._current = name
+        timer = time.process_time if self.exclude_network_wait else time.perf_counter
+        profile = cProfile.Profile(timer)
+        if HAS_RESET_PEAK:
+            tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            # Read before the second snapshot, whose own allocations would raise the peak
+            peak = tracemalloc.get_traced_memory()[1] - start_memory if HAS_RESET_PEAK else None
+            allocations = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+            if peak is None:
+                peak = sum(diff.size_diff for diff in allocations if diff.size_diff > 0 and not self._own(diff))
+            self._current = None
+            self._record(name, profile, wall, cpu, peak, allocations)
+    
+    @staticmethod
+    def _own(diff) -> bool:
+        """Whether an allocation is snapshot bookkeeping of tracemalloc itself"""
+        return diff.traceback[0].filename == tracemalloc.__file__
+    
+    def _record(self, name: str, profile: cProfile.Profile, wall: float, cpu: float, peak: int, allocations):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {
+                'runs': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_bytes': 0, 'stats': None, 'allocations': {}
+            }
+        entry['runs'] += 1
+        entry['wall'] += wall
+        entry['cpu'] += cpu
+        entry['peak_bytes'] = max(entry['peak_bytes'], peak)
+        if entry['stats'] is None:
+            entry['stats'] = pstats.Stats(profile)
+        else:
+            entry['stats'].add(profile)
+        for diff in allocations:
+            # Snapshot bookkeeping of tracemalloc itself is not part of the stage
+            if diff.size_diff > 0 and not self._own(diff):
+                site = str(diff.traceback[0])
+                entry['allocations'][site] = entry['allocations'].get(site, 0) + diff.size_diff
+    
+    def report(self) -> str:
+        """Plain-text report: summary table, then hotspots and allocation sites per stage"""
+        clock = "CPU time (network wait excluded)" if self.exclude_network_wait else "wall time"
+        lines = [
+            f"CodeWise stage profile - hotspots by {clock}",
+            "Only the pipeline thread is profiled: thread pool work (get_pr_diff_for_files, get_files_content,",
+            "hedged LLM requests) appears as Future.result / wait time, not as the workers' own functions.",
+        ]
+        if not HAS_RESET_PEAK:
+            lines.append("Peak MiB is the net growth during the stage (no tracemalloc.reset_peak before Python 3.9).")
+        lines.append("")
+        lines.append(f"{'stage':<10}{'runs':>6}{'wall s':>10}{'cpu s':>10}{'peak MiB':>11}")
+        ordered = [name for name in STAGES if name in self.stages]
+        ordered += [name for name in self.stages if name not in STAGES]
+        for name in ordered:
+            entry = self.stages[name]
+            lines.append(
+                f"{name:<10}{entry['runs']:>6}{entry['wall']:>10.3f}{entry['cpu']:>10.3f}"
+                f"{entry['peak_bytes'] / 1048576:>11.2f}"
+            )
+        
+        for name in ordered:
+            entry = self.stages[name]
+            lines += ["", "=" * 80, f"Stage: {name}", "=" * 80, f"Top {self.top_n} functions by cumulative time:"]
+            stream = io.StringIO()
+            entry['stats'].stream = stream
+            entry['stats'].sort_stats('cumulative').print_stats(self.top_n)
+            lines.append(stream.getvalue().strip())
+            
+            lines += ["", f"Top {self.top_n} allocation sites (net bytes allocated during the stage):"]
+            sites = sorted(entry['allocations'].items(), key=lambda item: -item[1])[:self.top_n]
+            lines += [f"  {size / 1024:>10.1f} KiB  {site}" for site, size in sites] or ["  (none)"]
+        
+        return '\n'.join(lines) + '\n'
+    
+    def write_report(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.report())
+        logger.info("Profile report written to %s", path)
+
+
+def activate(profiler: Optional[StageProfiler]):
+    """Install the profiler used by profile_stage (None to deactivate)"""
+    global _active_profiler
+    if _active_profiler is not None:
+        _active_profiler.stop()
+    _active_profiler = profiler
+    if profiler is not None:
+        profiler.start()
+
+
+@contextmanager
+def profile_stage(name: str):
+    """Profile a pipeline stage when profiling is active, otherwise do nothing"""
+    if _active_profiler is None:
+        yield
+    else:
+        with _active_profiler.stage(name):
+            yield
@@ -0,0 +1,271 @@
+"""
+Tail-latency and failure handling for LLM calls
+Hedging sends a duplicate request when the first one is slower than a percentile of recently
+observed latencies; the circuit breaker fails fast (or switches to a fallback model) while the
+error rate of the primary model is above a threshold. Breakers and latency windows are kept per
+model, so the clients of a cascade (cheap triage model, strong review model) sharing one policy
+do not trip or skew each other.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+from utils import logger
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the LLM while the circuit is open and no fallback model is set"""
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies"""
+    
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._samples)
+    
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def percentile(self, pct: float) -> Optional[float]:
+        """Nearest-rank percentile of the window, or None without samples"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples))) - 1))
+        return samples[rank]
+
+
+class CircuitBreaker:
+    """Error-rate circuit breaker: closed -> open -> half-open (one probe) -> closed"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, error_threshold: float = 0.5, window: int = 20, min_calls: int = 5, cooldown: float = 60,
+                 name: str = 'the primary model'):
+        # Model the breaker protects, for the log
+        self.name = name
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.open_count = 0
+        self._results = deque(maxlen=window)
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    def allow_request(self) -> bool:
+        """Whether the protected model may be called now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                logger.info("Circuit breaker closed: probe call succeeded")
+                self.state = self.CLOSED
+                self._results.clear()
+            self._results.append(True)
+    
+    def release_probe(self):
+        """End an attempt without a verdict (the run deadline or a cancellation stopped it), so a new probe may start"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return
+            self._results.append(False)
+            failures = self._results.count(False)
+            if (self.state == self.CLOSED and len(self._results) >= self.min_calls
+                    and failures / len(self._results) >= self.error_threshold):
+                self._open()
+    
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.open_count += 1
+        self._results.clear()
+        logger.warning("Circuit breaker opened, retrying %s in %.0fs", self.name, self.cooldown)
+
+
+class LLMResilience:
+    """Hedging policy, circuit breaker and their metrics, shared by the sync and async OpenAI clients"""
+    
+    def __init__(
+        self,
+        hedging: bool = False,
+        hedge_percentile: float = 95,
+        hedge_min_samples: int = 20,
+        hedge_initial_delay: Optional[float] = None,
+        hedge_min_delay: float = 1.0,
+        breaker: Optional[Dict] = None,
+        fallback_model: Optional[str] = None,
+        request_timeout: Optional[float] = None
+    ):
+        """breaker: CircuitBreaker keyword arguments (every model gets its own breaker), None = no breaker"""
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_initial_delay = hedge_initial_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker_settings = breaker
+        self.fallback_model = fallback_model or None
+        self.request_timeout = request_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latencies: Dict[str, LatencyTracker] = {}
+        self.metrics = {
+            'calls': 0,
+            'errors': 0,
+            'hedged': 0,
+            'hedge_wins': 0,
+            'fallback_calls': 0,
+            'fast_failures': 0
+        }
+        self._lock = threading.Lock()
+    
+    def count(self, metric: str, amount: int = 1):
+        with self._lock:
+            self.metrics[metric] += amount
+    
+    def breaker(self, model: str) -> Optional[CircuitBreaker]:
+        """The circuit breaker of a model, or None when circuit breaking is off"""
+        if self.breaker_settings is None:
+            return None
+        with self._lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(name=model, **self.breaker_settings)
+            return self.breakers[model]
+    
+    def latency_tracker(self, model: str) -> LatencyTracker:
+        with self._lock:
+            if model not in self.latencies:
+                self.latencies[model] = LatencyTracker()
+            return self.latencies[model]
+    
+    def record_latency(self, model: str, seconds: float):
+        self.latency_tracker(model).record(seconds)
+    
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds to wait before sending a duplicate request to model, or None to not hedge"""
+        if not self.hedging:
+            return None
+        latencies = self.latency_tracker(model)
+        if len(latencies) < self.hedge_min_samples:
+            delay = self.hedge_initial_delay
+        else:
+            delay = latencies.percentile(self.hedge_percentile)
+        return None if delay is None else max(delay, self.hedge_min_delay)
+    
+    def select_model(self, primary_model: str) -> str:
+        """Model for the next attempt; raises CircuitOpenError when failing fast"""
+        breaker = self.breaker(primary_model)
+        if breaker is None or breaker.allow_request():
+            return primary_model
+        if self.fallback_model:
+            self.count('fallback_calls')
+            return self.fallback_model
+        self.count('fast_failures')
+        raise CircuitOpenError(f"Circuit open for {primary_model}, failing fast")
+    
+    def record_result(self, model: str, primary_model: str, success: bool):
+        """Record one attempt; only results of the client's own (primary) model drive its breaker"""
+        self.count('calls')
+        if not success:
+            self.count('errors')
+        breaker = self.breaker(primary_model)
+        if breaker is None or model != primary_model:
+            return
+        if success:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+    
+    def release(self, model: str, primary_model: str):
+        """An attempt stopped by the caller rather than failed by the model; frees a half-open probe"""
+        breaker = self.breaker(primary_model)
+        if breaker is not None and model == primary_model:
+            breaker.release_probe()
+    
+    def stats(self) -> Dict:
+        """Metrics with per-model latency percentiles and breaker states"""
+        with self._lock:
+            stats = dict(self.metrics)
+            latencies = dict(self.latencies)
+            breakers = dict(self.breakers)
+        stats['latency'] = {
+            model: (tracker.percentile(50), tracker.percentile(95))
+            for model, tracker in latencies.items() if len(tracker)
+        }
+        stats['breaker_states'] = {model: breaker.state for model, breaker in breakers.items()}
+        stats['breaker_opens'] = sum(breaker.open_count for breaker in breakers.values())
+        return stats
+    
+    def log_stats(self):
+        stats = self.stats()
+        if not stats['calls'] and not stats['fast_failures']:
+            return
+        latency = ''.join(
+            f", {model} p50 {p50:.1f}s / p95 {p95:.1f}s" for model, (p50, p95) in sorted(stats['latency'].items())
+        )
+        if self.breaker_settings is None:
+            circuit = 'disabled'
+        else:
+            circuit = ', '.join(f"{model} {state}" for model, state in sorted(stats['breaker_states'].items())) or 'closed'
+        logger.info(
+            "LLM calls: %s (%s errors%s); hedged %s (hedge won %s); "
+            "circuit %s, opened %sx, %s fallback calls, %s fast failures",
+            stats['calls'], stats['errors'], latency, stats['hedged'], stats['hedge_wins'],
+            circuit, stats['breaker_opens'], stats['fallback_calls'], stats['fast_failures']
+        )
+    
+    @staticmethod
+    def from_config(config) -> Optional['LLMResilience']:
+        """Build the policy from the llm_resilience section, or None when nothing is enabled"""
+        settings = config.get('llm_resilience', {}) or {}
+        hedging = settings.get('hedging', {}) or {}
+        breaker_settings = settings.get('circuit_breaker', {}) or {}
+        request_timeout = settings.get('request_timeout')
+        
+        if not (hedging.get('enabled', False) or breaker_settings.get('enabled', False) or request_timeout):
+            return None
+        
+        breaker = None
+        if breaker_settings.get('enabled', False):
+            breaker = {
+                'error_threshold': breaker_settings.get('error_threshold', 0.5),
+                'window': breaker_settings.get('window', 20),
+                'min_calls': breaker_settings.get('min_calls', 5),
+                'cooldown': breaker_settings.get('cooldown', 60)
+            }
+        
+        return LLMResilience(
+            hedging=hedging.get('enabled', False),
+            hedge_percentile=hedging.get('percentile', 95),
+            hedge_min_samples=hedging.get('min_samples', 20),
+            hedge_initial_delay=hedging.get('initial_delay'),
+            hedge_min_delay=hedging.get('min_delay', 1.0),
+            breaker=breaker,
+            fallback_model=breaker_settings.get('fallback_model'),
+            request_timeout=request_timeout
+        )
@@ -33,10 +33,10 @@ class ReviewerFactory:
         reviewer_class = ReviewerFactory.REVIEWER_MAP.get(language.lower())
         
         if not reviewer_class:
-            logger.warning(f"No reviewer available for language: {language}")
+            logger.warning("No reviewer available for language: %s", language)
             return None
         
-        logger.info(f"Creating {language} reviewer")
+        logger.info("Creating %s reviewer", language)
         return reviewer_class(config)
     
     @staticmethod
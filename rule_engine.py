@@ -0,0 +1,392 @@
+"""
+Local rule engine run before the LLM
+Many findings are mechanically detectable (weak password hashing, eval, unsafe deserialization,
+SQL built by string concatenation, innerHTML assignments). Each reviewer has a rule pack
+(rules.json next to its module) of precompiled patterns with literal keywords: one pass over the
+added lines finds the lines containing a keyword (plain substring search), and only the rules
+selected by those keywords run on them, producing structured findings without a model call.
+The raw diff also decides whether the change needs the model at all: documentation-only changes,
+changes to comments and blank lines only, and reordered imports do not. Comments are recognised
+with the comment syntax of each file's language; anything else, moved code included, is substantive.
+"""
+
+import bisect
+import fnmatch
+import os
+import json
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from filters import HUNK_START
+from findings import load_json_document, normalize_findings
+from formatters import CommentFormatter
+from utils import logger
+
+
+DEFAULT_DOC_PATTERNS = [
+    '*.md', '*.markdown', '*.rst', '*.adoc',
+    'docs/*', 'doc/*', 'README*', 'LICENSE*', 'NOTICE*', 'CHANGELOG*', 'AUTHORS*', 'CONTRIBUTING*'
+]
+# Dependency and build manifests (file names) are never documentation, whatever doc_patterns says
+MANIFEST_PATTERNS = [
+    'requirements*.txt', 'constraints*.txt', 'CMakeLists.txt', '*.cmake', 'setup.py', 'setup.cfg',
+    'pyproject.toml', 'Pipfile*', 'poetry.lock', '*.lock', 'package.json', 'package-lock.json',
+    'composer.json', 'go.mod', 'go.sum', 'Cargo.toml', 'Gemfile*', 'pom.xml', 'build.gradle*',
+    'settings.gradle*', 'Makefile', '*.mk', 'Dockerfile*', 'docker-compose*', '*.csproj', 'MANIFEST.in',
+    'tox.ini', 'noxfile.py', '.gitlab-ci.yml', '*.nix'
+]
+
+
+# Comment syntax by file extension: (line comment prefixes, block comment delimiters or None)
+C_STYLE = (('//',), ('/*', '*/'))
+HASH_STYLE = (('#',), None)
+COMMENT_SYNTAX = {
+    **{extension: C_STYLE for extension in (
+        'js', 'jsx', 'mjs', 'cjs', 'ts', 'tsx', 'java', 'kt', 'kts', 'scala', 'c', 'h', 'cc', 'cpp', 'hpp',
+        'cs', 'go', 'rs', 'swift', 'dart', 'scss', 'less'
+    )},
+    **{extension: HASH_STYLE for extension in (
+        'py', 'pyi', 'rb', 'sh', 'bash', 'zsh', 'pl', 'pm', 'r', 'yaml', 'yml', 'toml', 'cfg', 'conf'
+    )},
+    'php': (('//', '#'), ('/*', '*/')),
+    'css': ((), ('/*', '*/')),
+    'sql': (('--',), ('/*', '*/')),
+    'lua': (('--',), None),
+    'hs': (('--',), None),
+    'ini': ((';', '#'), None),
+    **{extension: ((), ('<!--', '-->')) for extension in ('html', 'htm', 'xml', 'vue', 'svelte')}
+}
+NO_COMMENTS = ((), None)
+
+
+def comment_syntax(path: str) -> Tuple[Tuple[str, ...], Optional[Tuple[str, str]]]:
+    """Comment syntax of a file; files of unknown languages have none, so all their lines count as code"""
+    extension = os.path.splitext(path)[1][1:].lower()
+    return COMMENT_SYNTAX.get(extension, NO_COMMENTS)
+
+
+class CommentTracker:
+    """
+    Tells comment lines from code along one side (old or new) of a file's diff, following block
+    comments across lines. Each hunk starts outside any block, so a hunk opening inside a block
+    comment reads as code, never the other way round.
+    """
+    
+    def __init__(self, path: str):
+        self.prefixes, self.block = comment_syntax(path)
+        self.in_block = False
+    
+    def reset(self):
+        self.in_block = False
+    
+    def is_comment(self, line: str) -> bool:
+        """Whether a (stripped, non-blank) line is entirely comment"""
+        if self.in_block:
+            close = line.find(self.block[1])
+            if close == -1:
+                return True
+            self.in_block = False
+            return not line[close + len(self.block[1]):].strip()
+        # PHP 8 / Rust attributes start with '#[' and are code
+        if line.startswith('#['):
+            return False
+        if any(line.startswith(prefix) for prefix in self.prefixes):
+            return True
+        if self.block and line.startswith(self.block[0]):
+            close = line.find(self.block[1], len(self.block[0]))
+            if close == -1:
+                self.in_block = True
+                return True
+            return not line[close + len(self.block[1]):].strip()
+        return False
+
+
+# Reordering these is mechanical; reordering other statements can change behaviour
+IMPORT_LINE = re.compile(r'^(?:import\s|from\s+\S+\s+import\s|use\s|require(?:_once)?\b|include(?:_once)?\b)')
+
+
+def diff_path(line: str, old_path: str) -> str:
+    """File path of a '+++ ' diff header line; deleted files (+++ /dev/null) keep their old path"""
+    path = line[4:].split('\t')[0]
+    if path == '/dev/null':
+        return old_path
+    return path[2:] if path.startswith('b/') else path
+
+
+def load_rule_pack(path: str) -> Dict[str, Dict]:
+    """Read a rule pack data file (JSON object of rule_id -> rule)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class LocalRuleEngine:
+    """Single-pass pattern rules over added lines, plus the decision whether an LLM review is needed"""
+    
+    def __init__(self, rules: Dict[str, Dict], doc_patterns: Optional[List[str]] = None,
+                 skip_docs_only: bool = True, skip_mechanical: bool = True, max_findings: int = 50):
+        """
+        rules: rule_id -> {pattern, keywords, severity, category, confidence, issue, fix, files}
+        pattern is a Python regex matched within one added line; keywords are literal substrings,
+        one of which (case-insensitive) every match contains
+        """
+        self.rules = [(rule_id, rule) for rule_id, rule in rules.items() if rule.get('pattern')]
+        self.doc_patterns = DEFAULT_DOC_PATTERNS if doc_patterns is None else doc_patterns
+        self.skip_docs_only = skip_docs_only
+        self.skip_mechanical = skip_mechanical
+        self.max_findings = max_findings
+        self.patterns = [re.compile(rule['pattern']) for _, rule in self.rules]
+        # keyword -> indexes of the rules it selects; rules without keywords run on every line
+        self.keywords: Dict[str, List[int]] = {}
+        self.unfiltered = []
+        for index, (_, rule) in enumerate(self.rules):
+            if not rule.get('keywords'):
+                self.unfiltered.append(index)
+            for keyword in rule.get('keywords') or []:
+                self.keywords.setdefault(keyword.lower(), []).append(index)
+    
+    @staticmethod
+    def from_config(config, reviewer) -> Optional['LocalRuleEngine']:
+        """Engine with the reviewer's rule pack, or None when local rules are disabled"""
+        settings = config.get('local_rules', {}) or {}
+        if not settings.get('enabled', True):
+            return None
+        return LocalRuleEngine(
+            reviewer.load_rule_pack(),
+            doc_patterns=settings.get('doc_patterns'),
+            skip_docs_only=settings.get('skip_llm_for_docs_only', True),
+            skip_mechanical=settings.get('skip_llm_for_mechanical', True),
+            max_findings=settings.get('max_findings', 50)
+        )
+    
+    def is_doc(self, path: str) -> bool:
+        name = os.path.basename(path)
+        if any(fnmatch.fnmatch(name, pattern) for pattern in MANIFEST_PATTERNS):
+            return False
+        return any(fnmatch.fnmatch(path, pattern) for pattern in self.doc_patterns)
+    
+    def _applies(self, rule: Dict, path: str) -> bool:
+        files = rule.get('files')
+        return not files or any(fnmatch.fnmatch(path, pattern) for pattern in files)
+    
+    def evaluate(self, diff: str) -> Dict:
+        """
+        Scan a unified diff (the filtered diff, never the compacted prompt diff, which no longer
+        shows moved code or whitespace changes), returns {'findings', 'skip_reason', 'added_lines',
+        'elapsed_ms'}. Findings use the findings.normalize_findings schema; skip_reason is None
+        when the change needs an LLM review.
+        """
+        start = time.perf_counter()
+        paths: List[str] = []
+        code_lines: List[str] = []
+        line_files: List[int] = []
+        line_numbers: List[int] = []
+        path_index = -1
+        new_no = 0
+        old_path = ''
+        tracker = None
+        for line in diff.split('\n'):
+            tag = line[:1]
+            if tag == ' ':
+                new_no += 1
+                if tracker and line.strip():
+                    tracker.is_comment(line.strip())
+            elif tag == '+':
+                if line.startswith('+++ '):
+                    paths.append(diff_path(line, old_path))
+                    path_index = len(paths) - 1
+                    tracker = CommentTracker(paths[-1])
+                    continue
+                text = line[1:]
+                stripped = text.strip()
+                if tracker and not (stripped and tracker.is_comment(stripped)):
+                    code_lines.append(text)
+                    line_files.append(path_index)
+                    line_numbers.append(new_no)
+                new_no += 1
+            elif tag == '@':
+                hunk = HUNK_START.match(line)
+                new_no = int(hunk.group(2)) if hunk else 0
+                if tracker:
+                    tracker.reset()
+            elif line.startswith('--- '):
+                old_path = line[4:].split('\t')[0]
+                old_path = old_path[2:] if old_path.startswith('a/') else old_path
+        
+        findings = self._match(code_lines, line_files, line_numbers, paths)
+        skip_reason = self.skip_reason(diff, paths)
+        return {
+            'findings': findings,
+            'skip_reason': skip_reason,
+            'added_lines': len(code_lines),
+            'elapsed_ms': (time.perf_counter() - start) * 1000
+        }
+    
+    def candidates(self, code_lines: List[str]) -> Dict[int, Set[int]]:
+        """Line index -> indexes of the rules to run on it, from plain substring search for the keywords"""
+        text = '\n'.join(code_lines).lower()
+        starts = [0]
+        for code_line in code_lines[:-1]:
+            starts.append(starts[-1] + len(code_line) + 1)
+        
+        candidates: Dict[int, Set[int]] = {}
+        for keyword, rule_indexes in self.keywords.items():
+            position = text.find(keyword)
+            while position != -1:
+                line_index = bisect.bisect_right(starts, position) - 1
+                candidates.setdefault(line_index, set()).update(rule_indexes)
+                # Continue after this line, its other occurrences add nothing
+                next_start = starts[line_index + 1] if line_index + 1 < len(starts) else len(text)
+                position = text.find(keyword, next_start)
+        if self.unfiltered:
+            for line_index in range(len(code_lines)):
+                candidates.setdefault(line_index, set()).update(self.unfiltered)
+        return candidates
+    
+    def _match(self, code_lines: List[str], line_files: List[int], line_numbers: List[int],
+               paths: List[str]) -> List[Dict]:
+        if not self.rules or not code_lines:
+            return []
+        raw, applies = [], {}
+        candidates = self.candidates(code_lines)
+        for line_index in sorted(candidates):
+            path = paths[line_files[line_index]]
+            for rule_index in sorted(candidates[line_index]):
+                rule_id, rule = self.rules[rule_index]
+                if (rule_index, path) not in applies:
+                    applies[(rule_index, path)] = self._applies(rule, path)
+                if not applies[(rule_index, path)] or not self.patterns[rule_index].search(code_lines[line_index]):
+                    continue
+                raw.append({
+                    'file': path,
+                    'line': line_numbers[line_index],
+                    'severity': rule.get('severity', 'suggestion'),
+                    'category': rule.get('category', rule_id),
+                    'confidence': rule.get('confidence', 0.7),
+                    'issue': rule.get('issue', rule_id),
+                    'fix': rule.get('fix', '')
+                })
+            if len(raw) >= self.max_findings:
+                break
+        return normalize_findings({'findings': raw[:self.max_findings]})['findings']
+    
+    def skip_reason(self, diff: str, paths: List[str]) -> Optional[str]:
+        """
+        Why the change needs no LLM review, or None when it does. diff must be the raw (filtered)
+        diff: only changes whose changed lines are all comments or blank, or whose changed lines
+        in code files are the same imports in a new order, are mechanical
+        """
+        if self.skip_docs_only and paths and all(self.is_doc(path) for path in paths):
+            return "documentation-only change"
+        if not self.skip_mechanical:
+            return None
+        
+        # Changed import lines per file; the first substantive line that is not an import settles it
+        added, removed = Counter(), Counter()
+        path = old_path = ''
+        doc_file = False
+        old_side = new_side = None
+        for line in diff.split('\n'):
+            tag = line[:1]
+            if line.startswith('--- '):
+                old_path = line[4:].split('\t')[0]
+                old_path = old_path[2:] if old_path.startswith('a/') else old_path
+                continue
+            if line.startswith('+++ '):
+                path = diff_path(line, old_path)
+                doc_file = self.is_doc(path)
+                old_side, new_side = CommentTracker(old_path or path), CommentTracker(path)
+                continue
+            if tag == '@':
+                if old_side:
+                    old_side.reset()
+                    new_side.reset()
+                continue
+            if tag not in (' ', '+', '-') or old_side is None or doc_file:
+                continue
+            text = line[1:].strip()
+            if not text:
+                continue
+            if tag == ' ':
+                old_side.is_comment(text)
+                new_side.is_comment(text)
+                continue
+            if (new_side if tag == '+' else old_side).is_comment(text):
+                continue
+            if not IMPORT_LINE.match(text):
+                return None
+            (added if tag == '+' else removed)[(path, text)] += 1
+        if not added and not removed:
+            return "only comments, blank lines or documentation changed"
+        if added == removed:
+            return "imports reordered"
+        return None
+
+
+def local_findings_section(findings: List[Dict], severity_labels: Optional[Dict[str, str]] = None) -> str:
+    """Markdown section listing local rule findings under an LLM review"""
+    body = CommentFormatter.format_findings({'summary': '', 'findings': findings}, severity_labels)
+    return f"\n\n---\n\n## ⚡ Local Rule Findings\n\n{body}"
+
+
+def reported_lines_note(findings: List[Dict]) -> str:
+    """
+    User prompt addition listing the lines local rules flagged, so that a markdown review (which
+    gets them as a separate section) does not report the same lines again
+    """
+    if not findings:
+        return ""
+    lines = [
+        f"- `{finding['file']}`" + (f" line {finding['line']}" if finding.get('line') else "") + f": {finding['issue']}"
+        for finding in findings
+    ]
+    return (
+        "\n**ALREADY REPORTED BY LOCAL RULES (added to the review separately; do not report these lines again):**\n"
+        + '\n'.join(lines) + "\n"
+    )
+
+
+def merge_findings(content: str, findings: List[Dict], structured: bool,
+                   severity_labels: Optional[Dict[str, str]] = None) -> str:
+    """
+    Add local rule findings to an LLM review; in structured mode findings at a line the model
+    already reported on are left out, markdown reviews get them as a separate section (the
+    prompt asked the model to skip those lines, see reported_lines_note)
+    """
+    if not findings:
+        return content
+    if not structured:
+        return content + local_findings_section(findings, severity_labels)
+    
+    try:
+        document = load_json_document(content)
+    except ValueError:
+        # Left for render_review to report; the raw answer is posted as is
+        return content
+    reported = {
+        (str(finding.get('file') or ''), str(finding.get('line') or ''))
+        for finding in document.get('findings', []) if isinstance(finding, dict)
+    }
+    document['findings'] = list(document.get('findings', [])) + [
+        finding for finding in findings if (finding['file'], str(finding['line'] or '')) not in reported
+    ]
+    return json.dumps(document)
+
+
+def local_review_content(skip_reason: str, findings: List[Dict], structured: bool,
+                         severity_labels: Optional[Dict[str, str]] = None) -> str:
+    """Review content for a change that needs no LLM call"""
+    summary = f"⚡ Reviewed with local rules only ({skip_reason}); no model call was needed."
+    document = {'summary': summary, 'findings': findings}
+    if structured:
+        return json.dumps(document)
+    return CommentFormatter.format_findings(document, severity_labels)
+
+
+def log_evaluation(result: Dict):
+    logger.info(
+        "Local rules: %s findings over %s added lines in %.1f ms%s",
+        len(result['findings']), result['added_lines'], result['elapsed_ms'],
+        f", skipping the LLM: {result['skip_reason']}" if result['skip_reason'] else ""
+    )
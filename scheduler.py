@@ -0,0 +1,199 @@
+"""
+Priority and fairness scheduling of queued review jobs
+When many PRs are queued at once, a fixed number run concurrently and the next one is picked by:
+- fairness: the repository with the fewest running reviews, then the least cost served so far
+  (a repository that becomes active starts level with the others instead of at zero)
+- shortest job first within the repository, by estimated cost (changed lines plus a weight per
+  file), with aging: every second of waiting lowers a job's effective cost by aging_rate, so
+  large reviews are not starved by a stream of small ones
+Queue wait times are tracked per job and per repository and logged after a run.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+from resilience import LatencyTracker
+from utils import logger
+
+
+class ReviewJob:
+    """A queued review: its group (workspace/repo), estimated cost and the coroutine function running it"""
+    
+    def __init__(self, group: str, cost: float, run: Callable[[], Awaitable], label: str = ''):
+        self.group = group
+        self.cost = cost
+        self.run = run
+        self.label = label or group
+        self.enqueued = time.monotonic()
+        self.started: Optional[float] = None
+        self.future: Optional[asyncio.Future] = None
+    
+    @property
+    def wait(self) -> float:
+        """Seconds spent queued (so far, while still queued)"""
+        return (self.started or time.monotonic()) - self.enqueued
+
+
+class ReviewScheduler:
+    """Runs submitted review jobs at most max_concurrency at a time, shortest first and fair across groups"""
+    
+    def __init__(self, max_concurrency: int = 4, max_per_group: int = 0, aging_rate: float = 50.0,
+                 file_weight: float = 20.0, default_cost: float = 500.0, report_path: Optional[str] = None):
+        self.max_concurrency = max(1, max_concurrency)
+        # 0 = a single group may use every slot when nothing else is queued
+        self.max_per_group = max_per_group
+        # Cost units (changed lines) taken off a job's priority per second of waiting
+        self.aging_rate = aging_rate
+        self.file_weight = file_weight
+        # Cost assumed for jobs whose size could not be estimated
+        self.default_cost = default_cost
+        self.report_path = report_path
+        self.waits = LatencyTracker(window=10000)
+        self.counts = Counter()
+        self._queues: Dict[str, List[ReviewJob]] = {}
+        self._running = Counter()
+        self._served: Dict[str, float] = {}
+        self._group_waits: Dict[str, List[float]] = {}
+        self._active = 0
+        self._paused = False
+        self._tasks = set()
+    
+    @staticmethod
+    def from_config(config) -> 'ReviewScheduler':
+        settings = config.get('review_scheduler', {}) or {}
+        return ReviewScheduler(
+            max_concurrency=settings.get('max_concurrency', 4),
+            max_per_group=settings.get('max_per_repo', 0),
+            aging_rate=settings.get('aging_lines_per_second', 50.0),
+            file_weight=settings.get('file_weight', 20.0),
+            default_cost=settings.get('default_cost', 500.0),
+            report_path=settings.get('report_path') or None
+        )
+    
+    def estimate_cost(self, diffstat: Optional[List[Dict]]) -> float:
+        """Estimated review cost of a PR from its diffstat entries: changed lines plus file_weight per file"""
+        if not diffstat:
+            return self.default_cost
+        lines = sum((entry.get('lines_added') or 0) + (entry.get('lines_removed') or 0) for entry in diffstat)
+        return lines + self.file_weight * len(diffstat)
+    
+    def submit(self, group: str, cost: float, run: Callable[[], Awaitable], label: str = '') -> asyncio.Future:
+        """Queue a job; the returned future resolves to the result (or exception) of run()"""
+        job = ReviewJob(group, cost, run, label)
+        job.future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(group, [])
+        if not queue and not self._running[group]:
+            # A group becoming active starts level with the least served active group
+            active = [self._served[name] for name, jobs in self._queues.items()
+                      if name in self._served and (jobs or self._running[name])]
+            self._served[group] = max(self._served.get(group, 0.0), min(active, default=0.0))
+        queue.append(job)
+        self.counts['submitted'] += 1
+        self._dispatch()
+        return job.future
+    
+    def pause(self):
+        """Hold dispatching, so a batch of jobs can be queued before the first one is picked"""
+        self._paused = True
+    
+    def resume(self):
+        self._paused = False
+        self._dispatch()
+    
+    def priority(self, job: ReviewJob, now: float) -> float:
+        """Effective cost of a queued job; lower runs first"""
+        return job.cost - self.aging_rate * (now - job.enqueued)
+    
+    def _next_job(self) -> Optional[ReviewJob]:
+        eligible = [
+            group for group, queue in self._queues.items()
+            if queue and (not self.max_per_group or self._running[group] < self.max_per_group)
+        ]
+        if not eligible:
+            return None
+        group = min(eligible, key=lambda name: (self._running[name], self._served[name]))
+        now = time.monotonic()
+        queue = self._queues[group]
+        job = min(queue, key=lambda queued: self.priority(queued, now))
+        queue.remove(job)
+        return job
+    
+    def _dispatch(self):
+        while not self._paused and self._active < self.max_concurrency:
+            job = self._next_job()
+            if job is None:
+                return
+            job.started = time.monotonic()
+            self._active += 1
+            self._running[job.group] += 1
+            self._served[job.group] += job.cost
+            self.waits.record(job.wait)
+            self._group_waits.setdefault(job.group, []).append(job.wait)
+            logger.debug("Starting %s (cost %.0f) after %.2fs queued", job.label, job.cost, job.wait)
+            task = asyncio.ensure_future(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _execute(self, job: ReviewJob):
+        try:
+            result = await job.run()
+        except asyncio.CancelledError:
+            # CancelledError is not an Exception (Python 3.8+); the caller awaiting job.future must still wake up
+            self.counts['cancelled'] += 1
+            job.future.cancel()
+            raise
+        except Exception as e:
+            self.counts['failed'] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.counts['completed'] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._active -= 1
+            self._running[job.group] -= 1
+            self._dispatch()
+    
+    def stats(self) -> Dict:
+        """Job counts and queue wait times, overall and per group"""
+        return {
+            'submitted': self.counts['submitted'],
+            'completed': self.counts['completed'],
+            'failed': self.counts['failed'],
+            'cancelled': self.counts['cancelled'],
+            'queued': sum(len(queue) for queue in self._queues.values()),
+            'running': self._active,
+            'wait_p50': self.waits.percentile(50),
+            'wait_p95': self.waits.percentile(95),
+            'wait_max': self.waits.percentile(100),
+            'groups': {
+                group: {
+                    'started': len(waits),
+                    'mean_wait': sum(waits) / len(waits),
+                    'max_wait': max(waits),
+                    'served_cost': self._served.get(group, 0.0)
+                }
+                for group, waits in self._group_waits.items()
+            }
+        }
+    
+    def log_stats(self):
+        stats = self.stats()
+        if not stats['submitted']:
+            return
+        logger.info(
+            "Review queue: %s jobs (%s failed, %s cancelled) over %s repositories; queue wait p50 %.1fs, p95 %.1fs, max %.1fs",
+            stats['submitted'], stats['failed'], stats['cancelled'], len(stats['groups']),
+            stats['wait_p50'] or 0.0, stats['wait_p95'] or 0.0, stats['wait_max'] or 0.0
+        )
+        for group, entry in sorted(stats['groups'].items()):
+            logger.info("  %s: %s jobs, mean wait %.1fs, max wait %.1fs",
+                        group, entry['started'], entry['mean_wait'], entry['max_wait'])
+        if self.report_path:
+            os.makedirs(os.path.dirname(self.report_path) or '.', exist_ok=True)
+            with open(self.report_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(stats, timestamp=time.time())) + '\n')
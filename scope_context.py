@@ -0,0 +1,211 @@
+"""
+Enclosing-scope context extraction
+Instead of the first N characters of every changed file, the prompt gets the functions and
+classes that enclose the changed lines: found with ast for Python and by brace-aware scanning
+for PHP and JavaScript/TypeScript. Changes outside any scope get a few lines around them.
+"""
+
+import ast
+import bisect
+import re
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+
+HUNK_HEADER = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+
+PYTHON_EXTENSIONS = ('.py', '.pyi')
+BRACE_EXTENSIONS = ('.php', '.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx')
+
+# Strings and comments are blanked out before braces are matched; '#' comments only for PHP
+_STRINGS_AND_COMMENTS = r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`|//[^\n]*|/\*.*?\*/'
+MASK_PATTERN = re.compile(_STRINGS_AND_COMMENTS, re.DOTALL)
+MASK_PATTERN_HASH = re.compile(_STRINGS_AND_COMMENTS + r'|#[^\n]*', re.DOTALL)
+
+# Declarations that open a scope: functions, classes, interfaces, traits, functions assigned to
+# names and method shorthand (name(args) {), with any modifiers in front
+BRACE_DECLARATION = re.compile(
+    r'^[ \t]*(?:(?:export|default|async|public|private|protected|static|abstract|final|readonly|declare)\s+)*'
+    r'(?:function\b|class\b|interface\b|trait\b|enum\b'
+    r'|(?:const|let|var)\s+[\w$]+\s*=\s*(?:async\s+)?(?:function\b|\([^)\n]*\)\s*=>\s*\{|[\w$]+\s*=>\s*\{)'
+    r'|(?!(?:if|for|foreach|while|switch|catch|with|return|elseif|else)\b)[\w$]+\s*\([^)\n]*\)\s*(?::\s*[^{;\n]+)?\{)',
+    re.MULTILINE
+)
+BODY_START = re.compile(r'[{;]')
+PYTHON_DECLARATION = re.compile(r'^([ \t]*)(?:async[ \t]+def|def|class)\b')
+
+
+def changed_lines(diff: str) -> Dict[str, List[int]]:
+    """New-file line numbers touched by a unified diff, per path (deletions anchor at the next line)"""
+    changed: Dict[str, List[int]] = {}
+    lines, line_no, in_header = None, 0, False
+    for line in diff.split('\n'):
+        if line.startswith('diff --git'):
+            lines, in_header = None, True
+        elif in_header and line.startswith('+++ '):
+            target = line[4:].strip()
+            path = None if target == '/dev/null' else (target[2:] if target.startswith('b/') else target)
+            lines = changed.setdefault(path, []) if path else None
+        elif line.startswith('@@'):
+            match = HUNK_HEADER.match(line)
+            line_no, in_header = (int(match.group(1)) if match else 0), False
+        elif lines is None or in_header:
+            continue
+        elif line.startswith('+'):
+            lines.append(line_no)
+            line_no += 1
+        elif line.startswith('-'):
+            if not lines or lines[-1] != line_no:
+                lines.append(line_no)
+        elif line.startswith(' '):
+            line_no += 1
+    return {path: sorted(set(lines)) for path, lines in changed.items() if lines}
+
+
+def python_scopes(source: str) -> List[Tuple[int, int]]:
+    """(start, end) lines of every function and class, decorators included; indent scan on syntax errors"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return indent_scopes(source)
+    
+    scopes = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            scopes.append((start, node.end_lineno or node.lineno))
+    return scopes
+
+
+def indent_scopes(source: str) -> List[Tuple[int, int]]:
+    """Python scopes by indentation, for sources ast cannot parse"""
+    lines = source.split('\n')
+    scopes = []
+    for index, line in enumerate(lines):
+        match = PYTHON_DECLARATION.match(line)
+        if not match:
+            continue
+        indent = len(match.group(1).expandtabs())
+        end = index
+        for next_index in range(index + 1, len(lines)):
+            text = lines[next_index]
+            if not text.strip():
+                continue
+            if len(text) - len(text.lstrip()) <= indent and not text.lstrip().startswith((')', ']', '}')):
+                break
+            end = next_index
+        scopes.append((index + 1, end + 1))
+    return scopes
+
+
+def mask_source(source: str, hash_comments: bool = False) -> str:
+    """Blank out strings and comments, keeping offsets and newlines, so braces inside them do not count"""
+    pattern = MASK_PATTERN_HASH if hash_comments else MASK_PATTERN
+    return pattern.sub(lambda match: re.sub(r'[^\n]', ' ', match.group(0)), source)
+
+
+def brace_pairs(masked: str) -> Dict[int, int]:
+    """Offset of every opening brace mapped to the offset of its closing brace"""
+    pairs: Dict[int, int] = {}
+    stack = []
+    for match in re.finditer(r'[{}]', masked):
+        if match.group(0) == '{':
+            stack.append(match.start())
+        elif stack:
+            pairs[stack.pop()] = match.start()
+    return pairs
+
+
+def brace_scopes(source: str, hash_comments: bool = False) -> List[Tuple[int, int]]:
+    """(start, end) lines of functions, methods and classes in a brace language (PHP, JS, TS)"""
+    masked = mask_source(source, hash_comments)
+    pairs = brace_pairs(masked)
+    line_starts = [0] + [match.end() for match in re.finditer('\n', masked)]
+    scopes = []
+    for match in BRACE_DECLARATION.finditer(masked):
+        body = BODY_START.search(masked, match.start())
+        if body is None or body.group(0) != '{' or body.start() not in pairs:
+            continue
+        start = bisect.bisect_right(line_starts, match.start())
+        end = bisect.bisect_right(line_starts, pairs[body.start()])
+        scopes.append((start, end))
+    return scopes
+
+
+class ScopeExtractor:
+    """Cut changed files down to the scopes enclosing their changed lines, within a character budget"""
+    
+    def __init__(self, changed: Dict[str, List[int]], max_chars: int = 4000, max_scope_lines: int = 150,
+                 context_lines: int = 5):
+        self.changed = changed
+        self.max_chars = max_chars
+        self.max_scope_lines = max_scope_lines
+        self.context_lines = context_lines
+    
+    @staticmethod
+    def from_config(config: Config, diff: str) -> Optional['ScopeExtractor']:
+        settings = config.get('scope_context', {}) or {}
+        if not settings.get('enabled', True):
+            return None
+        return ScopeExtractor(
+            changed_lines(diff),
+            max_chars=settings.get('max_chars_per_file', 4000),
+            max_scope_lines=settings.get('max_scope_lines', 150),
+            context_lines=settings.get('context_lines', 5)
+        )
+    
+    @staticmethod
+    def scopes(path: str, content: str) -> List[Tuple[int, int]]:
+        lowered = path.lower()
+        if lowered.endswith(PYTHON_EXTENSIONS):
+            return python_scopes(content)
+        if lowered.endswith(BRACE_EXTENSIONS):
+            return brace_scopes(content, hash_comments=lowered.endswith('.php'))
+        return []
+    
+    def line_ranges(self, scopes: List[Tuple[int, int]], lines: List[int], total_lines: int) -> List[Tuple[int, int]]:
+        """Merged line ranges to show: the innermost scope of each change, or a window around it"""
+        ranges = []
+        for line in lines:
+            if ranges and ranges[-1][0] <= line <= ranges[-1][1]:
+                continue
+            enclosing = [scope for scope in scopes if scope[0] <= line <= scope[1]]
+            if not enclosing:
+                ranges.append((max(1, line - self.context_lines), min(total_lines, line + self.context_lines)))
+                continue
+            start, end = min(enclosing, key=lambda scope: scope[1] - scope[0])
+            if end - start + 1 <= self.max_scope_lines:
+                ranges.append((start, end))
+            else:
+                # Large scope (usually a class): its declaration line plus a window around the change
+                ranges.append((start, start))
+                ranges.append((max(start, line - self.context_lines), min(end, line + self.context_lines)))
+        
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+    
+    def extract(self, path: str, content: str) -> Optional[str]:
+        """Scoped context of a changed file, or None when the diff has no changed lines for it"""
+        lines = self.changed.get(path)
+        if not lines:
+            return None
+        source_lines = content.split('\n')
+        comment = '#' if path.lower().endswith(PYTHON_EXTENSIONS) else '//'
+        
+        parts, size = [], 0
+        for start, end in self.line_ranges(self.scopes(path, content), lines, len(source_lines)):
+            snippet = f"{comment} ... lines {start}-{end} of {len(source_lines)}\n" + '\n'.join(source_lines[start - 1:end])
+            if parts and size + len(snippet) > self.max_chars:
+                parts.append(f"{comment} ... (further changed regions omitted)")
+                break
+            parts.append(snippet[:self.max_chars])
+            size += len(snippet)
+        scoped = '\n'.join(parts)
+        # Small files where the scopes cover (almost) everything are sent whole
+        return content if len(content) <= len(scoped) else scoped
@@ -19,6 +19,7 @@ setup(
     long_description_content_type="text/markdown",
     url="https://github.com/abhishek27iiitdmj/codewise",
     packages=find_packages(),
+    package_data={"languages": ["*/common_issues.json", "*/rules.json"]},
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: Developers",
@@ -0,0 +1,712 @@
+"""
+Import-aware cross-file symbol context
+The imports of each changed file (Python import/from, PHP namespace/use, JS import/require) are
+resolved to repository files, and the definitions of the imported names that the added lines
+reference are added to the prompt within a budget. Directory listings and candidate files are
+fetched in parallel (diff_fetch_workers at a time) within the run deadline. Parsed files are cached
+in SQLite by git blob hash where the client reports one (local git), and by source commit and path,
+so a file version is fetched and parsed once across runs; listings are cached by commit too.
+"""
+
+import ast
+import bisect
+import hashlib
+import json
+import os
+import posixpath
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from deadline import DeadlineExceeded
+from scope_context import BODY_START, brace_pairs, mask_source
+from utils import logger, user_cache_dir
+
+
+# Bump when the parsed format changes so cached entries are re-parsed
+PARSER_VERSION = '1'
+
+# Definitions longer than this are never stored whole, only their signatures
+SOURCE_LINE_CAP = 80
+
+IDENTIFIER = re.compile(r'[A-Za-z_$][\w$]*')
+# Refs that name one immutable tree: contents and listings read at them can be cached by path
+COMMIT_HASH = re.compile(r'^[0-9a-f]{40}$')
+PARENTHESES = re.compile(r'[()]')
+
+PHP_NAMESPACE = re.compile(r'^[ \t]*namespace\s+([\w\\]+)\s*[;{]', re.MULTILINE)
+PHP_GROUP_USE = re.compile(r'^[ \t]*use\s+([\w\\]+?)\\?\{([^}]*)\}\s*;', re.MULTILINE)
+PHP_USE = re.compile(r'^[ \t]*use\s+([\w\\]+)(?:\s+as\s+(\w+))?\s*;', re.MULTILINE)
+PHP_DECLARATION = re.compile(
+    r'^[ \t]*(?:(?:abstract|final|readonly)\s+)*(?:class|interface|trait|enum)\s+(\w+)'
+    r'|^function\s+&?(\w+)\s*\(',
+    re.MULTILINE
+)
+PHP_METHOD = re.compile(r'^[ \t]+(?:(?:public|static|abstract|final)\s+)*function\s+&?(\w+)\s*\(', re.MULTILINE)
+# Built-in and very common class names that never come from the repository
+PHP_BUILTINS = {'Exception', 'Closure', 'DateTime', 'DateTimeImmutable', 'stdClass', 'Throwable', 'ArrayObject'}
+
+JS_IMPORT = re.compile(r'^[ \t]*import\s+(?:type\s+)?([^\'";]+?)\s+from\s+[\'"]([^\'"]+)[\'"]', re.MULTILINE)
+JS_REQUIRE = re.compile(
+    r'^[ \t]*(?:const|let|var)\s+(\{[^}]*\}|[\w$]+)\s*=\s*require\(\s*[\'"]([^\'"]+)[\'"]\s*\)',
+    re.MULTILINE
+)
+JS_DECLARATION = re.compile(
+    r'^(export\s+(?:default\s+)?)?(?:async\s+)?'
+    r'(?:function\*?\s+([\w$]+)|class\s+([\w$]+)|(?:const|let|var)\s+([\w$]+)\s*=)',
+    re.MULTILINE
+)
+JS_DEFAULT_EXPORT = re.compile(r'^(?:export\s+default|module\.exports\s*=)\s*([\w$]+)\s*;?\s*$', re.MULTILINE)
+JS_METHOD = re.compile(r'^[ \t]+(?:static\s+|async\s+|get\s+|set\s+)*(?!(?:if|for|while|switch|catch)\b)([A-Za-z$][\w$]*)\s*\([^)\n]*\)\s*\{', re.MULTILINE)
+JS_EXTENSIONS = ('.ts', '.tsx', '.js', '.jsx', '.mjs', '.cjs')
+
+# Python standard library modules are never resolved to repository files (names known on 3.10+)
+STDLIB_MODULES = set(getattr(sys, 'stdlib_module_names', ()))
+
+LANGUAGES = {'.py': 'python', '.pyi': 'python', '.php': 'php'}
+LANGUAGES.update({extension: 'javascript' for extension in JS_EXTENSIONS})
+
+
+def git_blob_hash(content: str) -> str:
+    """Hash of the content as git computes it for a blob, so local ls-tree hashes match"""
+    data = content.encode('utf-8')
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def file_language(path: str) -> Optional[str]:
+    return LANGUAGES.get(posixpath.splitext(path)[1].lower())
+
+
+def added_lines(diff: str) -> Dict[str, List[str]]:
+    """Text of the added lines of a unified diff, per path"""
+    added: Dict[str, List[str]] = {}
+    lines, in_header = None, False
+    for line in diff.split('\n'):
+        if line.startswith('diff --git'):
+            lines, in_header = None, True
+        elif in_header and line.startswith('+++ '):
+            target = line[4:].strip()
+            lines = None if target == '/dev/null' else added.setdefault(target[2:] if target.startswith('b/') else target, [])
+        elif line.startswith('@@'):
+            in_header = False
+        elif lines is not None and not in_header and line.startswith('+'):
+            lines.append(line[1:])
+    return added
+
+
+def _lines_text(lines: List[str], start: int, end: int) -> str:
+    return '\n'.join(lines[start - 1:end]).rstrip()
+
+
+def _definition(lines: List[str], start: int, end: int, signature: str) -> Dict:
+    return {
+        'line': start,
+        'lines': end - start + 1,
+        'signature': signature,
+        'source': _lines_text(lines, start, end) if end - start + 1 <= SOURCE_LINE_CAP else None
+    }
+
+
+def _python_signature(lines: List[str], node) -> str:
+    """Header lines of a def/class plus the first docstring line"""
+    start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+    header_end = max(node.lineno, node.body[0].lineno - 1) if node.body else node.lineno
+    header = _lines_text(lines, start, header_end)
+    indent = ' ' * (node.col_offset + 4)
+    docstring = ast.get_docstring(node, clean=True)
+    if docstring:
+        header += f'\n{indent}"""{docstring.splitlines()[0]}"""'
+    return header + f'\n{indent}...'
+
+
+def parse_python(path: str, content: str) -> Dict:
+    """Imports and top-level definitions of a Python module"""
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return {'imports': [], 'definitions': {}}
+    lines = content.split('\n')
+    package = posixpath.dirname(path).split('/') if posixpath.dirname(path) else []
+    
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.append([alias.asname or alias.name, alias.name, None])
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ''
+            if node.level:
+                base = package[:len(package) - node.level + 1] if node.level > 1 else package
+                module = '.'.join(base + ([module] if module else []))
+            for alias in node.names:
+                if alias.name != '*':
+                    imports.append([alias.asname or alias.name, module, alias.name])
+    
+    definitions = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            definitions[node.name] = _definition(lines, start, node.end_lineno, _python_signature(lines, node))
+        elif isinstance(node, ast.ClassDef):
+            start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            header_end = max(node.lineno, node.body[0].lineno - 1)
+            signature = [_lines_text(lines, start, header_end)]
+            docstring = ast.get_docstring(node, clean=True)
+            if docstring:
+                signature.append(f'    """{docstring.splitlines()[0]}"""')
+            for member in node.body:
+                if isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef)) and (
+                    not member.name.startswith('_') or member.name == '__init__'
+                ):
+                    signature.append(_python_signature(lines, member))
+            definitions[node.name] = _definition(lines, start, node.end_lineno, '\n'.join(signature))
+        elif isinstance(node, ast.Assign) and node.end_lineno - node.lineno < 3:
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    definitions[target.id] = _definition(lines, node.lineno, node.end_lineno, _lines_text(lines, node.lineno, node.end_lineno))
+    return {'imports': imports, 'definitions': definitions}
+
+
+def _after_parameters(masked: str, offset: int) -> int:
+    """Offset just past the parameter list starting at the first '(' after offset, so default values
+    and destructuring braces in parameters are not taken for the body"""
+    opening = masked.find('(', offset)
+    if opening < 0:
+        return offset
+    depth = 0
+    for match in PARENTHESES.finditer(masked, opening):
+        depth += 1 if match.group(0) == '(' else -1
+        if depth == 0:
+            return match.end()
+    return offset
+
+
+def _brace_definition(content: str, masked: str, pairs: Dict[int, int], line_starts: List[int],
+                      start_offset: int, members: Optional[re.Pattern] = None, body_from: Optional[int] = None) -> Dict:
+    """Definition of a brace-delimited declaration starting at start_offset; members are listed in the signature"""
+    body = BODY_START.search(masked, start_offset if body_from is None else body_from)
+    start = bisect.bisect_right(line_starts, start_offset)
+    if body is None or body.group(0) != '{' or body.start() not in pairs:
+        end = bisect.bisect_right(line_starts, body.start() if body else start_offset)
+        return _definition(content.split('\n'), start, end, content[start_offset:body.end() if body else None].strip())
+    
+    close = pairs[body.start()]
+    end = bisect.bisect_right(line_starts, close)
+    header = ' '.join(content[line_starts[start - 1]:body.start()].split())
+    signature = [header + ' {']
+    if members is not None:
+        for member in members.finditer(masked, body.start(), close):
+            member_body = BODY_START.search(masked, member.start(), close)
+            stop = member_body.start() if member_body else member.end()
+            signature.append('    ' + ' '.join(content[member.start():stop].split()) + ';')
+        signature.append('}')
+    else:
+        signature[0] += ' ... }'
+    return _definition(content.split('\n'), start, end, '\n'.join(signature))
+
+
+def parse_php(path: str, content: str) -> Dict:
+    """Namespace, use imports and class/function declarations of a PHP file"""
+    masked = mask_source(content, hash_comments=True)
+    namespace = PHP_NAMESPACE.search(masked)
+    imports = []
+    for match in PHP_GROUP_USE.finditer(content):
+        for item in match.group(2).split(','):
+            name, _, alias = item.strip().partition(' as ')
+            if name:
+                imports.append([alias.strip() or name.split('\\')[-1], f"{match.group(1)}\\{name}", name.split('\\')[-1]])
+    for match in PHP_USE.finditer(content):
+        if match.group(1).startswith(('function\\', 'const\\')):
+            continue
+        imports.append([match.group(2) or match.group(1).split('\\')[-1], match.group(1), match.group(1).split('\\')[-1]])
+    
+    pairs = brace_pairs(masked)
+    line_starts = [0] + [match.end() for match in re.finditer('\n', masked)]
+    definitions = {}
+    for match in PHP_DECLARATION.finditer(masked):
+        name = match.group(1) or match.group(2)
+        definitions[name] = _brace_definition(
+            content, masked, pairs, line_starts, match.start(), PHP_METHOD if match.group(1) else None,
+            None if match.group(1) else _after_parameters(masked, match.start())
+        )
+    return {
+        'imports': imports,
+        'namespace': namespace.group(1) if namespace else None,
+        'definitions': definitions
+    }
+
+
+def _js_bindings(clause: str, module: str) -> List[List]:
+    """[local name, module, imported name] for an import clause or a require() target"""
+    bindings = []
+    named = re.search(r'\{([^}]*)\}', clause)
+    if named:
+        for item in named.group(1).split(','):
+            item = re.sub(r'^type\s+', '', item.strip())
+            if item:
+                parts = re.split(r'\s+as\s+|\s*:\s*', item, maxsplit=1)
+                bindings.append([parts[-1].strip(), module, parts[0].strip()])
+        clause = clause[:named.start()] + clause[named.end():]
+    namespace = re.search(r'\*\s*as\s+([\w$]+)', clause)
+    if namespace:
+        bindings.append([namespace.group(1), module, None])
+        clause = clause[:namespace.start()] + clause[namespace.end():]
+    default = re.match(r'\s*([\w$]+)', clause)
+    if default:
+        bindings.append([default.group(1), module, 'default'])
+    return bindings
+
+
+def parse_javascript(path: str, content: str) -> Dict:
+    """import/require bindings and top-level declarations of a JavaScript/TypeScript module"""
+    masked = mask_source(content)
+    imports = []
+    for match in JS_IMPORT.finditer(content):
+        imports += _js_bindings(match.group(1), match.group(2))
+    for match in JS_REQUIRE.finditer(content):
+        target = match.group(1)
+        if target.startswith('{'):
+            imports += _js_bindings(target, match.group(2))
+        else:
+            imports.append([target, match.group(2), None])
+    
+    pairs = brace_pairs(masked)
+    line_starts = [0] + [match.end() for match in re.finditer('\n', masked)]
+    definitions = {}
+    for match in JS_DECLARATION.finditer(masked):
+        name = match.group(2) or match.group(3) or match.group(4)
+        body_from = _after_parameters(masked, match.start()) if match.group(2) else match.start()
+        if match.group(4):
+            # Assigned values: only their first line, unless it starts a function or class
+            line_end = masked.find('\n', match.start())
+            line = masked[match.start():len(masked) if line_end < 0 else line_end]
+            arrow = line.find('=>')
+            if arrow < 0 and not re.search(r'\b(?:function|class)\b', line):
+                start = bisect.bisect_right(line_starts, match.start())
+                definitions[name] = _definition(content.split('\n'), start, start, content[match.start():match.start() + len(line)].strip())
+                continue
+            if arrow >= 0:
+                body_from = match.start() + arrow
+        definition = _brace_definition(
+            content, masked, pairs, line_starts, match.start(), JS_METHOD if match.group(3) else None, body_from
+        )
+        definitions[name] = definition
+        if match.group(1) and 'default' in match.group(1):
+            definitions['default'] = definition
+    for match in JS_DEFAULT_EXPORT.finditer(masked):
+        if match.group(1) in definitions:
+            definitions['default'] = definitions[match.group(1)]
+    return {'imports': imports, 'definitions': definitions}
+
+
+PARSERS = {'python': parse_python, 'php': parse_php, 'javascript': parse_javascript}
+
+
+class SymbolCache:
+    """Parsed imports and definitions per git blob hash (or commit and path) in SQLite, with an in-memory front"""
+    
+    def __init__(self, path: Optional[str] = None, max_entries: int = 50000):
+        self.path = path
+        self.max_entries = max_entries
+        self._memory: Dict[str, Dict] = {}
+        self._pending: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS symbols ("
+                " blob TEXT PRIMARY KEY, data TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+    
+    def get(self, blob: str) -> Optional[Dict]:
+        with self._lock:
+            if blob in self._memory:
+                return self._memory[blob]
+            if self._conn is None:
+                return None
+            row = self._conn.execute("SELECT data FROM symbols WHERE blob = ?", (blob,)).fetchone()
+            if row is None:
+                return None
+            parsed = self._memory[blob] = json.loads(row[0])
+            return parsed
+    
+    def put(self, blob: str, parsed: Dict):
+        with self._lock:
+            self._memory[blob] = parsed
+            if self._conn is not None:
+                self._pending[blob] = json.dumps(parsed)
+    
+    def flush(self):
+        """Write new entries in one transaction and evict the oldest beyond max_entries"""
+        with self._lock:
+            if self._conn is None or not self._pending:
+                return
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO symbols VALUES (?, ?, ?)",
+                [(blob, data, now) for blob, data in self._pending.items()]
+            )
+            self._conn.execute(
+                "DELETE FROM symbols WHERE rowid IN ("
+                " SELECT rowid FROM symbols ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+            self._pending.clear()
+    
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SymbolIndex:
+    """Resolve the imports of changed files and collect the definitions their added lines reference"""
+    
+    def __init__(self, cache: SymbolCache, max_chars: int = 3000, max_symbols: int = 15, max_definition_lines: int = 25,
+                 max_workers: int = 8):
+        self.cache = cache
+        self.max_chars = max_chars
+        self.max_symbols = max_symbols
+        self.max_definition_lines = max_definition_lines
+        # Directory listings and file fetches in flight at once
+        self.max_workers = max(1, max_workers)
+        self.parsed_count = 0
+        self.cached_count = 0
+    
+    @staticmethod
+    def from_config(config: Config) -> Optional['SymbolIndex']:
+        settings = config.get('symbol_context', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        # Not in the working directory by default: runs must not leave files in the checkout
+        path = settings.get('cache_path')
+        if path is None:
+            path = os.path.join(user_cache_dir(), 'symbols.sqlite3')
+        max_entries = settings.get('max_cache_entries', 50000)
+        try:
+            cache = SymbolCache(path or None, max_entries=max_entries)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Symbol cache %s unavailable, caching for this run only: %s", path, e)
+            cache = SymbolCache(None, max_entries=max_entries)
+        return SymbolIndex(
+            cache,
+            max_chars=settings.get('max_chars', 3000),
+            max_symbols=settings.get('max_symbols', 15),
+            max_definition_lines=settings.get('max_definition_lines', 25),
+            max_workers=config.get('diff_fetch_workers', 8)
+        )
+    
+    def close(self):
+        self.cache.close()
+    
+    def context_for(self, bb_client, diff: str, branch: str, contents: Optional[Dict[str, str]] = None) -> Optional[str]:
+        """
+        Definitions referenced by the added lines of the diff, rendered for the prompt, or None
+        contents are file contents already fetched for this branch (by MultiFileContext)
+        """
+        start = time.perf_counter()
+        try:
+            lookup = _Lookup(self, bb_client, branch, contents or {})
+            files = {path: '\n'.join(lines) for path, lines in added_lines(diff).items() if file_language(path) is not None}
+            lookup.prefetch(list(files))
+            references = {path: lookup.references(path, text) for path, text in files.items()}
+            # The first existing candidate of every import, all at once
+            lookup.prefetch([candidate for candidate in lookup.first_candidates(references) if candidate])
+            entries = []
+            for path, file_references in references.items():
+                entries += lookup.definitions(path, file_references)
+            rendered = self._render(entries)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.warning("Symbol context failed: %s", e)
+            return None
+        finally:
+            self.cache.flush()
+        
+        logger.info(
+            "Symbol context: %s definitions from other files in %.0f ms (%s files parsed, %s from cache)",
+            len(entries), (time.perf_counter() - start) * 1000, self.parsed_count, self.cached_count
+        )
+        return rendered
+    
+    @staticmethod
+    def _keys(path: str, language: str, blob: Optional[str], commit: Optional[str]) -> List[str]:
+        keys = []
+        if blob is not None:
+            keys.append(f"{PARSER_VERSION}:{language}:{path if language == 'python' else ''}:{blob}")
+        if commit is not None:
+            keys.append(f"{PARSER_VERSION}:{language}:{path}@{commit}")
+        return keys
+    
+    def cached(self, path: str, blob: Optional[str] = None, commit: Optional[str] = None) -> Optional[Dict]:
+        """Parsed file from the cache, by blob hash or by (commit, path), or None"""
+        language = file_language(path)
+        if language is None:
+            return None
+        for key in self._keys(path, language, blob, commit):
+            parsed = self.cache.get(key)
+            if parsed is not None:
+                return parsed
+        return None
+    
+    def parsed(self, path: str, content: Optional[str], blob: Optional[str] = None, commit: Optional[str] = None) -> Optional[Dict]:
+        """
+        Parsed imports and definitions of a file version, from the cache when its blob or the
+        commit it was read at is known; stored under both keys
+        """
+        language = file_language(path)
+        if language is None:
+            return None
+        if blob is None and content is not None:
+            blob = git_blob_hash(content)
+        keys = self._keys(path, language, blob, commit)
+        missing = []
+        parsed = None
+        for key in keys:
+            found = self.cache.get(key)
+            if found is None:
+                missing.append(key)
+            elif parsed is None:
+                parsed = found
+        if parsed is not None:
+            self.cached_count += 1
+        elif content is not None:
+            parsed = PARSERS[language](path, content)
+            self.parsed_count += 1
+        else:
+            return None
+        for key in missing:
+            self.cache.put(key, parsed)
+        return parsed
+    
+    def cached_listing(self, directory: str, commit: str) -> Optional[Dict[str, Optional[str]]]:
+        entry = self.cache.get(f"{PARSER_VERSION}:dir:{directory}@{commit}")
+        return entry['files'] if entry is not None else None
+    
+    def put_listing(self, directory: str, commit: str, files: Dict[str, Optional[str]]):
+        self.cache.put(f"{PARSER_VERSION}:dir:{directory}@{commit}", {'files': files})
+    
+    def _render(self, entries: List[Tuple[str, str, Dict]]) -> Optional[str]:
+        parts, size, seen = [], 0, set()
+        for path, symbol, definition in entries:
+            if (path, definition['line']) in seen:
+                continue
+            seen.add((path, definition['line']))
+            comment = '#' if file_language(path) == 'python' else '//'
+            use_source = definition['source'] is not None and definition['lines'] <= self.max_definition_lines
+            text = f"{comment} {path}:{definition['line']} ({symbol})\n" + (definition['source'] if use_source else definition['signature'])
+            if size + len(text) > self.max_chars or len(parts) >= self.max_symbols:
+                break
+            parts.append(text)
+            size += len(text)
+        return '\n\n'.join(parts) if parts else None
+
+
+class _Lookup:
+    """Per-review resolution state: directory listings, fetched contents, composer autoload map"""
+    
+    def __init__(self, index: SymbolIndex, bb_client, branch: str, contents: Dict[str, str]):
+        self.index = index
+        self.bb_client = bb_client
+        self.branch = branch
+        # Contents at a commit never change, so listings and parses are also cached by (commit, path)
+        self.commit = branch if COMMIT_HASH.match(branch or '') else None
+        self.deadline = getattr(bb_client, 'deadline', None)
+        self.contents = dict(contents)
+        self.listings: Dict[str, Optional[Dict[str, Optional[str]]]] = {}
+        self._psr4 = None
+    
+    def _check_deadline(self, what: str):
+        if self.deadline is not None:
+            self.deadline.timeout(None, what)
+    
+    def _parallel(self, function: Callable, items: List[str]):
+        """Run function over items, index.max_workers at a time; DeadlineExceeded stops the stage"""
+        if len(items) <= 1:
+            for item in items:
+                function(item)
+            return
+        with ThreadPoolExecutor(max_workers=min(self.index.max_workers, len(items))) as executor:
+            list(executor.map(function, items))
+    
+    def _listing(self, directory: str) -> Optional[Dict[str, Optional[str]]]:
+        """path -> blob hash (None when the client cannot tell) of the files in a directory, None if unknown"""
+        if directory not in self.listings:
+            listing = self.index.cached_listing(directory, self.commit) if self.commit else None
+            if listing is None and hasattr(self.bb_client, 'list_directory'):
+                self._check_deadline(f"listing {directory or '/'}")
+                try:
+                    listing = self.bb_client.list_directory(directory, self.branch)
+                    if self.commit and listing is not None:
+                        self.index.put_listing(directory, self.commit, listing)
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    # Usually a 404: the directory does not exist on the branch
+                    logger.debug("Listing %s failed: %s", directory, e)
+                    listing = {}
+                    if self.commit and getattr(getattr(e, 'response', None), 'status_code', None) == 404:
+                        self.index.put_listing(directory, self.commit, listing)
+            self.listings[directory] = listing
+        return self.listings[directory]
+    
+    def _fetch(self, path: str):
+        self._check_deadline(f"fetching {path}")
+        try:
+            self.contents[path] = self.bb_client.get_file_content(path, self.branch) or ''
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.debug("Fetching %s failed: %s", path, e)
+            self.contents[path] = ''
+    
+    def prefetch(self, paths: List[str]):
+        """List the directories of paths, then fetch those of the paths that exist and are not cached, in parallel"""
+        paths = [path for path in dict.fromkeys(paths) if path not in self.contents]
+        directories = [directory for directory in dict.fromkeys(posixpath.dirname(path) for path in paths)
+                       if directory not in self.listings]
+        self._parallel(self._listing, directories)
+        wanted = [
+            path for path in paths
+            if self._exists(path) and self.index.cached(path, (self.listings.get(posixpath.dirname(path)) or {}).get(path), self.commit) is None
+        ]
+        self._parallel(self._fetch, wanted)
+    
+    def _exists(self, path: str) -> bool:
+        listing = self._listing(posixpath.dirname(path))
+        return path in listing if listing is not None else True
+    
+    def _parsed_file(self, path: str) -> Optional[Dict]:
+        if not self._exists(path):
+            return None
+        listing = self.listings.get(posixpath.dirname(path)) or {}
+        blob = listing.get(path)
+        if path not in self.contents:
+            parsed = self.index.parsed(path, None, blob, self.commit)
+            if parsed is not None:
+                return parsed
+            self._fetch(path)
+        content = self.contents[path]
+        return self.index.parsed(path, content, blob, self.commit) if content else None
+    
+    def _psr4_map(self) -> List[Tuple[str, str]]:
+        """Namespace prefix -> directory pairs from composer.json, longest prefix first"""
+        if self._psr4 is None:
+            mapping = {}
+            content = self.contents.get('composer.json')
+            if content is None and self._exists('composer.json'):
+                self._fetch('composer.json')
+                content = self.contents['composer.json']
+            try:
+                composer = json.loads(content) if content else {}
+                for section in ('autoload', 'autoload-dev'):
+                    for prefix, directories in (composer.get(section, {}).get('psr-4', {}) or {}).items():
+                        for directory in directories if isinstance(directories, list) else [directories]:
+                            mapping.setdefault(prefix, directory.rstrip('/') + '/' if directory else '')
+            except (ValueError, AttributeError):
+                pass
+            mapping.setdefault('App\\', 'app/')
+            self._psr4 = sorted(mapping.items(), key=lambda item: -len(item[0]))
+        return self._psr4
+    
+    def _candidates(self, path: str, language: str, module: str, name: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+        """(file, symbol) candidates for an import; symbol None means the module itself"""
+        if language == 'python':
+            if module.split('.')[0] in STDLIB_MODULES:
+                return []
+            base = module.replace('.', '/')
+            roots = ['']
+            first = base.split('/')[0]
+            marker = f"/{first}/"
+            if marker in f"/{path}":
+                roots.insert(0, f"/{path}"[1:f"/{path}".index(marker) + 1])
+            roots.append('src/')
+            candidates = []
+            for root in dict.fromkeys(roots):
+                if name:
+                    candidates += [(f"{root}{base}.py", name), (f"{root}{base}/__init__.py", name),
+                                   (f"{root}{base}/{name}.py", None), (f"{root}{base}/{name}/__init__.py", None)]
+                else:
+                    candidates += [(f"{root}{base}.py", None), (f"{root}{base}/__init__.py", None)]
+            return candidates
+        
+        if language == 'php':
+            candidates = []
+            for prefix, directory in self._psr4_map():
+                if module.startswith(prefix):
+                    candidates.append((directory + module[len(prefix):].replace('\\', '/') + '.php', name))
+            relative = module.split('\\', 1)[-1].replace('\\', '/')
+            candidates += [(f"src/{relative}.php", name), (module.replace('\\', '/') + '.php', name)]
+            return candidates
+        
+        if not module.startswith('.'):
+            return []  # packages from node_modules
+        base = posixpath.normpath(posixpath.join(posixpath.dirname(path), module))
+        if base.endswith(JS_EXTENSIONS):
+            return [(base, name)]
+        return [(base + extension, name) for extension in JS_EXTENSIONS] + \
+               [(f"{base}/index{extension}", name) for extension in JS_EXTENSIONS]
+    
+    def references(self, path: str, added_text: str) -> List[Tuple[List[str], List[Tuple[str, Optional[str]]]]]:
+        """(wanted attributes, (file, symbol) candidates) for each import whose name the added lines of one file use"""
+        language = file_language(path)
+        parsed = self._parsed_file(path)
+        if parsed is None:
+            return []
+        references = set(IDENTIFIER.findall(added_text))
+        bindings = list(parsed['imports'])
+        if language == 'php' and parsed.get('namespace'):
+            # Classes of the same namespace are used without an import
+            imported = {binding[0] for binding in bindings}
+            bindings += [
+                [name, f"{parsed['namespace']}\\{name}", name]
+                for name in sorted(references)
+                if name[0].isupper() and name not in imported and name not in PHP_BUILTINS
+            ]
+        
+        used = []
+        for alias, module, name in bindings:
+            if alias.split('.')[0] not in references:
+                continue
+            attributes = list(dict.fromkeys(re.findall(rf'(?<![\w$]){re.escape(alias)}\.([A-Za-z_$][\w$]*)', added_text)))
+            candidates = [(candidate, symbol) for candidate, symbol in self._candidates(path, language, module, name) if candidate != path]
+            if candidates:
+                used.append((attributes, candidates))
+        return used
+    
+    def first_candidates(self, references: Dict[str, List]) -> List[str]:
+        """The first existing candidate file of every import, listing candidate directories in parallel"""
+        all_candidates = [[candidate for candidate, _ in candidates]
+                          for file_references in references.values() for _, candidates in file_references]
+        self._parallel(self._listing, [
+            directory for directory in dict.fromkeys(posixpath.dirname(candidate) for candidates in all_candidates for candidate in candidates)
+            if directory not in self.listings
+        ])
+        return [next((candidate for candidate in candidates if self._exists(candidate)), None) for candidates in all_candidates]
+    
+    def definitions(self, path: str, references: List[Tuple[List[str], List[Tuple[str, Optional[str]]]]]) -> List[Tuple[str, str, Dict]]:
+        """(file, symbol, definition) for the imports of one file: from the first candidate file found"""
+        entries = []
+        for attributes, candidates in references:
+            for candidate, symbol in candidates:
+                target = self._parsed_file(candidate)
+                if target is None:
+                    continue
+                for wanted in ([symbol] if symbol else attributes):
+                    definition = target['definitions'].get(wanted)
+                    if definition is not None:
+                        entries.append((candidate, wanted, definition))
+                break
+        return entries
@@ -0,0 +1,60 @@
+"""
+Shared fixtures: the repository configuration with every on-disk cache moved into a temporary
+directory, the local fake Bitbucket/OpenAI server (loadtest/fake_servers.py) and clients for it
+"""
+
+import os
+
+import pytest
+
+from clients import BitbucketClient, OpenAIClient
+from config import Config
+from loadtest.fake_servers import FakeServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def config(tmp_path) -> Config:
+    """config.yaml as shipped; caches and stores write below tmp_path only"""
+    config = Config(os.path.join(ROOT, 'config.yaml'))
+    config.config['symbol_context']['cache_path'] = ''
+    config.config['dedupe_store']['path'] = str(tmp_path / 'dedupe.sqlite3')
+    config.config['file_cache']['enabled'] = False
+    return config
+
+
+@pytest.fixture
+def make_server():
+    """Start fake servers (FakeServer keyword arguments) and stop them after the test"""
+    servers = []
+    
+    def start(**kwargs) -> FakeServer:
+        server = FakeServer(**kwargs).__enter__()
+        servers.append(server)
+        return server
+    
+    yield start
+    for server in servers:
+        server.__exit__(None, None, None)
+
+
+@pytest.fixture
+def server(make_server) -> FakeServer:
+    return make_server()
+
+
+@pytest.fixture
+def make_bitbucket_client(config):
+    """BitbucketClient for a fake server"""
+    def build(server: FakeServer, workspace: str = 'ws', repo: str = 'repo') -> BitbucketClient:
+        return BitbucketClient.from_config(workspace, repo, 'token', config, base_url=server.bitbucket_url)
+    return build
+
+
+@pytest.fixture
+def make_openai_client(config):
+    """OpenAIClient for a fake server"""
+    def build(server: FakeServer) -> OpenAIClient:
+        return OpenAIClient('key', model=config.get('model'), max_tokens=config.get('max_tokens', 2000), base_url=server.openai_url)
+    return build
@@ -0,0 +1,102 @@
+"""Batch API review mode: submit, resume after an interruption, collect once the batch completes"""
+
+import json
+
+import pytest
+
+from batch_review import BatchReviewRunner
+
+TARGETS = [('ws', 'repo', '1'), ('ws', 'repo', '2')]
+
+
+@pytest.fixture
+def runner_for(config, tmp_path, make_bitbucket_client, make_openai_client):
+    """Runner factory; runners built for the same server share one state file, like consecutive runs"""
+    def build(server, ai_client=None) -> BatchReviewRunner:
+        return BatchReviewRunner(
+            ai_client or make_openai_client(server),
+            config,
+            lambda workspace, repo: make_bitbucket_client(server, workspace, repo),
+            state_path=str(tmp_path / 'batch_state.json')
+        )
+    return build
+
+
+def test_submit_then_collect(make_server, runner_for):
+    server = make_server(batch_polls=1)
+    
+    batch_id = runner_for(server).submit(TARGETS)
+    
+    assert batch_id in server.batches
+    assert server.comments == []
+    # Still in progress: nothing is posted and collect can run again later
+    assert runner_for(server).collect(wait=False) == 0
+    assert runner_for(server).collect(wait=False) == 2
+    assert sorted(pr_id for pr_id, _ in server.comments) == ['1', '2']
+    assert all('md5 is not a password hash' in body['content']['raw'] for _, body in server.comments)
+    state = runner_for(server).state
+    assert {entry['status'] for entry in state['requests'].values()} == {'posted'}
+    # The reviews went through the batch, not through chat completions
+    assert not any(path.endswith('/chat/completions') for _, path, _ in server.request_log)
+
+
+def test_submit_resumes_after_interruption(server, runner_for, make_openai_client):
+    ai_client = make_openai_client(server)
+    create_batch = ai_client.create_batch
+    
+    def interrupted(*args, **kwargs):
+        raise ConnectionError("interrupted")
+    
+    ai_client.create_batch = interrupted
+    with pytest.raises(ConnectionError):
+        runner_for(server, ai_client).submit(TARGETS)
+    assert len(server.uploaded_files) == 1
+    assert server.batches == {}
+    
+    ai_client.create_batch = create_batch
+    batch_id = runner_for(server, ai_client).submit(TARGETS)
+    
+    # The prepared requests and the uploaded input file are reused
+    assert list(server.batches) == [batch_id]
+    assert len(server.uploaded_files) == 2  # the input file and the batch output file
+    details_requests = [path for _, path, _ in server.request_log if path.endswith(('/pullrequests/1', '/pullrequests/2'))]
+    assert len(details_requests) == 2  # each PR was prepared once
+    # Submitting again only reports the batch already submitted
+    assert runner_for(server, ai_client).submit(TARGETS) == batch_id
+    assert len(server.batches) == 1
+
+
+def test_collect_again_posts_nothing_twice(server, runner_for):
+    runner_for(server).submit(TARGETS)
+    assert runner_for(server).collect(wait=False) == 2
+    
+    assert runner_for(server).collect(wait=False) == 0
+    assert len(server.comments) == 2
+
+
+def test_rejected_requests_keep_the_api_error(make_server, runner_for):
+    server = make_server(batch_errors={'ws/repo#2': "max_tokens is too large for this model"})
+    runner_for(server).submit(TARGETS)
+    
+    assert runner_for(server).collect(wait=False) == 1
+    
+    requests = runner_for(server).state['requests']
+    assert requests['ws/repo#1']['status'] == 'posted'
+    assert requests['ws/repo#2']['status'] == 'failed'
+    assert requests['ws/repo#2']['error'] == "batch request failed: max_tokens is too large for this model"
+    assert [pr_id for pr_id, _ in server.comments] == ['1']
+
+
+def test_packed_request_stays_within_the_model_output_limit(config, make_server, make_openai_client, runner_for):
+    config.config['request_coalescing']['enabled'] = True
+    config.config['max_tokens'] = 3000
+    server = make_server()
+    ai_client = make_openai_client(server)
+    ai_client.model = 'gpt-4'
+    
+    runner_for(server, ai_client).submit(TARGETS)
+    
+    [upload] = [stored for stored in server.uploaded_files.values() if stored['purpose'] == 'batch']
+    bodies = [json.loads(line)['body'] for line in upload['content'].splitlines() if line.strip()]
+    # Two reviews of 3000 tokens in one request, but gpt-4 rejects max_tokens above 4096
+    assert [body['max_tokens'] for body in bodies] == [4096]
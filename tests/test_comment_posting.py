@@ -0,0 +1,72 @@
+"""Long reviews are posted in ordered parts, and re-runs update those parts instead of adding more"""
+
+from collections import Counter
+
+from clients import BitbucketClient
+from comment_posting import WARNING_KEY, CommentPoster, comment_marker
+
+
+def review(sections: int, revision: str = 'first') -> str:
+    return '\n\n'.join(
+        f"### Finding {number}\n" + f"The {revision} review explains finding {number} in detail. " * 6
+        for number in range(1, sections + 1)
+    )
+
+
+def client_for(server) -> BitbucketClient:
+    return BitbucketClient('ws', 'repo', 'token', base_url=server.bitbucket_url, comment_poster=CommentPoster(max_chars=1200))
+
+
+def posted(server):
+    """(part, raw content) of the comments on the PR, in the order Bitbucket shows them"""
+    return [(comment_marker(body['content']['raw'])[1], body['content']['raw']) for _, body in server.comments]
+
+
+def requests_by_method(server) -> Counter:
+    return Counter(method for method, path, _ in server.request_log if '/comments' in path)
+
+
+def test_long_review_is_split_into_ordered_parts(server):
+    client_for(server).post_comment('1', review(8))
+    
+    parts = posted(server)
+    assert len(parts) > 1
+    assert [part for part, _ in parts] == list(range(1, len(parts) + 1))
+    assert all(len(content) <= 1200 for _, content in parts)
+    assert f"*Part 2/{len(parts)} (continued)*" in parts[1][1]
+
+
+def test_rerun_with_the_same_review_changes_nothing(server):
+    client_for(server).post_comment('1', review(8))
+    first = posted(server)
+    server.request_log.clear()
+    
+    client_for(server).post_comment('1', review(8))
+    
+    assert posted(server) == first
+    # Only the lookup of the earlier parts
+    assert requests_by_method(server) == {'GET': 1}
+
+
+def test_rerun_updates_parts_in_place_and_removes_leftovers(server):
+    client_for(server).post_comment('1', review(8))
+    first_ids = sorted(server.pr_comments)
+    
+    client_for(server).post_comment('1', review(3, 'second'))
+    
+    parts = posted(server)
+    assert 1 <= len(parts) < len(first_ids)
+    assert all('second review' in content for _, content in parts)
+    # No new comments: the first parts were updated, the rest deleted
+    assert len(server.pr_comments) == len(first_ids)
+    assert requests_by_method(server).get('DELETE') == len(first_ids) - len(parts)
+
+
+def test_warning_is_kept_apart_from_the_review(server):
+    client = client_for(server)
+    client.post_comment('1', review(2))
+    client.post_comment('1', "## ⚠️ AI Code Review Skipped", key=WARNING_KEY)
+    client.post_comment('1', review(2, 'second'))
+    
+    keys = [comment_marker(body['content']['raw'])[0] for _, body in server.comments]
+    assert sorted(keys) == ['review', 'warning']
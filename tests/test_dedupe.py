@@ -0,0 +1,101 @@
+"""Cross-repository dedupe store: identical normalized changes reuse the stored findings"""
+
+import json
+
+import pytest
+
+from dedupe import fingerprint_diff, neutralize_paths, restore_paths
+from loadtest.fake_servers import SAMPLE_FILES, make_diff
+from pipeline import run_review
+
+PAYMENT = SAMPLE_FILES['app/services/payment.py']
+# The local variable renamed; the 'token' key is data and stays
+RENAMED = PAYMENT.replace('token = ', 'digest = ').replace(': token}', ': digest}')
+
+
+@pytest.fixture
+def review(config, make_bitbucket_client, make_openai_client):
+    """Review PR 1 of a repository on a fake server with the dedupe store on, returns the posted comment"""
+    config.config['dedupe_store']['enabled'] = True
+    
+    def run(server, repo: str) -> str:
+        run_review(make_bitbucket_client(server, repo=repo), make_openai_client(server), '1', config)
+        [(_, body)] = server.comments
+        return body['content']['raw']
+    return run
+
+
+def test_same_change_in_another_repository_reuses_findings(make_server, review):
+    first = make_server(files={'app/services/payment.py': PAYMENT})
+    # Same code at another path, with other local names
+    second = make_server(files={'billing/payment.py': RENAMED})
+    
+    review(first, 'shop')
+    reused = review(second, 'billing')
+    
+    assert first.stats['openai_requests'] == 1
+    assert second.stats['openai_requests'] == 0
+    assert 'md5 is not a password hash' in reused
+    # Paths in the stored findings point at the files of the reviewed change
+    assert '`billing/payment.py` line 5' in reused
+    assert 'app/services/payment.py' not in reused
+
+
+def test_different_change_is_reviewed(make_server, review):
+    first = make_server(files={'app/services/payment.py': PAYMENT})
+    second = make_server(files={'app/services/payment.py': PAYMENT.replace('md5', 'sha256')})
+    
+    review(first, 'shop')
+    review(second, 'shop')
+    
+    assert second.stats['openai_requests'] == 1
+
+
+def test_fingerprint_keeps_called_and_attribute_names():
+    def fingerprint(content: str) -> str:
+        return fingerprint_diff(make_diff({'app/services/payment.py': content}))
+    
+    assert fingerprint(PAYMENT) == fingerprint(RENAMED)
+    assert fingerprint(PAYMENT) != fingerprint(PAYMENT.replace('md5', 'sha256'))
+    assert fingerprint(PAYMENT) != fingerprint(PAYMENT.replace('user.password', 'user.username'))
+
+
+def modification(path: str, start: int) -> str:
+    """Diff switching the payment token hash to md5, with the hunk starting at new line start (the change at start + 2)"""
+    return (
+        f"diff --git a/{path} b/{path}\nindex 1111111..2222222 100644\n--- a/{path}\n+++ b/{path}\n"
+        f"@@ -{start},5 +{start},5 @@\n"
+        " \n"
+        " def charge(user, amount):\n"
+        "-    token = hashlib.sha256(user.password.encode()).hexdigest()\n"
+        "+    token = hashlib.md5(user.password.encode()).hexdigest()\n"
+        "     return {'user': user.id, 'amount': amount, 'token': token}\n"
+        " \n"
+    )
+
+
+def test_reused_findings_cite_the_lines_of_the_reviewed_change(make_server, review):
+    # The fake review cites `app/services/payment.py` line 5, where the first change is
+    first = make_server(files={'app/services/payment.py': PAYMENT}, diff=modification('app/services/payment.py', 3))
+    second = make_server(files={'billing/payment.py': PAYMENT}, diff=modification('billing/payment.py', 238))
+    
+    review(first, 'shop')
+    reused = review(second, 'billing')
+    
+    assert second.stats['openai_requests'] == 0
+    assert '`billing/payment.py` line 240' in reused
+    assert 'line 5' not in reused
+
+
+def test_structured_findings_lines_are_rebased():
+    stored = neutralize_paths(
+        '{"findings": [{"file": "app/services/payment.py", "line": 5, "issue": "md5"},'
+        ' {"line": 99, "file": "app/services/payment.py", "issue": "outside"}]}',
+        modification('app/services/payment.py', 3)
+    )
+    
+    restored = json.loads(restore_paths(stored, modification('billing/payment.py', 238)))
+    
+    assert [(finding['file'], finding['line']) for finding in restored['findings']] == [
+        ('billing/payment.py', 240), ('billing/payment.py', 334)
+    ]
@@ -0,0 +1,67 @@
+"""Compacted diffs keep the line numbers of every change they still show"""
+
+import difflib
+import re
+
+from diff_compaction import DiffCompactor
+
+HUNK = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+
+
+def unified(path: str, old: str, new: str, context: int = 1000) -> str:
+    lines = difflib.unified_diff(
+        old.splitlines(keepends=True), new.splitlines(keepends=True), f"a/{path}", f"b/{path}", n=context
+    )
+    return f"diff --git a/{path} b/{path}\n" + ''.join(lines)
+
+
+def new_lines(diff: str):
+    """(new line number, tag, text) of every added and context line"""
+    numbered = []
+    new_no = None
+    for line in diff.split('\n'):
+        hunk = HUNK.match(line)
+        if hunk:
+            new_no = int(hunk.group(1))
+        elif new_no is not None and line[:1] in ('+', ' ') and not line.startswith('+++'):
+            numbered.append((new_no, line[:1], line[1:]))
+            new_no += 1
+    return numbered
+
+
+def test_line_numbers_survive_context_trimming():
+    old = ''.join(f"value_{number} = {number}\n" for number in range(1, 61))
+    new = old.replace("value_7 = 7\n", "value_7 = 70\n").replace("value_45 = 45\n", "value_45 = 450\nvalue_46b = 0\n")
+    diff = unified('app/values.py', old, new)
+    
+    compacted, stats = DiffCompactor(context_lines=2).compact(diff)
+    
+    original = set(new_lines(diff))
+    kept = new_lines(compacted)
+    assert set(kept) <= original
+    assert [line for line in kept if line[1] == '+'] == [
+        (7, '+', 'value_7 = 70'), (45, '+', 'value_45 = 450'), (46, '+', 'value_46b = 0')
+    ]
+    assert len(kept) < len(original)
+    assert stats['tokens_saved'] > 0
+
+
+def test_whitespace_only_changes_are_dropped_with_their_location():
+    old = "function total(items) {\n  return items.length;\n}\n"
+    new = "function total(items) {\n    return items.length;\n}\n"
+    
+    compacted, stats = DiffCompactor().compact(unified('src/total.js', old, new))
+    
+    assert stats['whitespace_only'] == 1
+    assert "# whitespace-only change omitted (new lines 2)" in compacted
+    assert 'items.length' not in compacted
+
+
+def test_indentation_changes_are_kept_in_python():
+    old = "def total(items):\n    if items:\n        count = len(items)\n    return count\n"
+    new = "def total(items):\n    if items:\n        count = len(items)\n        return count\n"
+    
+    compacted, stats = DiffCompactor().compact(unified('app/total.py', old, new))
+    
+    assert stats['whitespace_only'] == 0
+    assert (4, '+', '        return count') in new_lines(compacted)
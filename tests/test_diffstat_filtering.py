@@ -0,0 +1,50 @@
+"""Exclusion and size limits decided from the diffstat, before any diff is downloaded"""
+
+from loadtest.fake_servers import SAMPLE_FILES
+from pipeline import fetch_filtered_diff
+
+VENDORED = {'vendor/acme/sdk.js': "module.exports = function sdk() {\n  return 42;\n};\n"}
+
+
+def diff_requests(server):
+    return [query for method, path, query in server.request_log if path.endswith('/diff')]
+
+
+def test_excluded_files_are_never_downloaded(make_server, config, make_bitbucket_client):
+    server = make_server(files={**SAMPLE_FILES, **VENDORED})
+    
+    filtered_diff, diff_stats = fetch_filtered_diff(make_bitbucket_client(server), '1', config)
+    
+    assert sorted(diff_stats['changed_files']) == sorted(SAMPLE_FILES)
+    assert 'vendor/' not in filtered_diff
+    # One request per surviving file, none for the whole PR or the vendored file
+    requested = sorted(query['path'][0] for query in diff_requests(server))
+    assert requested == sorted(SAMPLE_FILES)
+
+
+def test_unfiltered_pr_is_downloaded_in_one_request(server, config, make_bitbucket_client):
+    filtered_diff, diff_stats = fetch_filtered_diff(make_bitbucket_client(server), '1', config)
+    
+    assert diff_stats['total_files'] == len(SAMPLE_FILES)
+    assert diff_requests(server) == [{}]
+
+
+def test_too_large_pr_is_skipped_from_the_diffstat(server, config, make_bitbucket_client):
+    config.config['max_diff_size'] = 5
+    
+    assert fetch_filtered_diff(make_bitbucket_client(server), '1', config) is None
+    assert diff_requests(server) == []
+    [(pr_id, body)] = server.comments
+    assert pr_id == '1'
+    assert 'AI Code Review Skipped' in body['content']['raw']
+
+
+def test_full_diff_is_filtered_when_diffstat_is_disabled(make_server, config, make_bitbucket_client):
+    config.config['use_diffstat'] = False
+    server = make_server(files={**SAMPLE_FILES, **VENDORED})
+    
+    filtered_diff, diff_stats = fetch_filtered_diff(make_bitbucket_client(server), '1', config)
+    
+    assert not any(path.endswith('/diffstat') for _, path, _ in server.request_log)
+    assert diff_stats['excluded_files'] == list(VENDORED)
+    assert 'vendor/' not in filtered_diff
@@ -0,0 +1,69 @@
+"""Local git mode: the pipeline reads a local checkout and prints the review instead of posting it"""
+
+import os
+import subprocess
+
+import pytest
+
+from local_git import LocalGitClient
+from loadtest.fake_servers import SAMPLE_FILES
+from pipeline import run_review
+
+
+def git(repo: str, *args: str):
+    subprocess.run(
+        ['git', '-C', repo, '-c', 'user.name=Tester', '-c', 'user.email=tester@example.com', *args],
+        check=True, capture_output=True
+    )
+
+
+def write(repo: str, files):
+    for path, content in files.items():
+        full_path = os.path.join(repo, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            f.write(content)
+
+
+@pytest.fixture
+def repo(tmp_path) -> str:
+    """Repository with an empty main branch and a feature branch adding the sample files and a vendored one"""
+    path = str(tmp_path / 'checkout')
+    os.makedirs(path)
+    git(path, 'init', '-q', '-b', 'main')
+    write(path, {'README.md': "# Shop\n"})
+    git(path, 'add', '.')
+    git(path, 'commit', '-q', '-m', 'Initial commit')
+    git(path, 'checkout', '-q', '-b', 'feature')
+    write(path, {**SAMPLE_FILES, 'vendor/acme/sdk.js': "module.exports = 42;\n"})
+    git(path, 'add', '.')
+    git(path, 'commit', '-q', '-m', 'Add checkout')
+    return path
+
+
+def test_diffstat_and_details_come_from_git(repo):
+    client = LocalGitClient(repo, base='main', head='feature')
+    
+    diffstat = {entry['new']['path']: entry['lines_added'] for entry in client.get_pr_diffstat('local')}
+    details = client.get_pr_details('local')
+    
+    assert diffstat == {
+        'app/services/payment.py': 6,
+        'app/views/orders.py': 5,
+        'vendor/acme/sdk.js': 1
+    }
+    assert details['title'] == 'Add checkout'
+    assert details['destination']['branch']['name'] == 'main'
+
+
+def test_review_of_a_local_diff(repo, server, config, make_openai_client, capsys):
+    client = LocalGitClient(repo, base='main', head='feature')
+    
+    run_review(client, make_openai_client(server), 'local', config)
+    
+    output = capsys.readouterr().out
+    assert 'md5 is not a password hash' in output
+    # Only the LLM is remote in local mode
+    assert server.stats['bitbucket_requests'] == 0
+    assert server.stats['openai_requests'] == 1
+    assert server.comments == []
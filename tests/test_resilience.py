@@ -0,0 +1,26 @@
+"""Circuit breaker probes that end without a verdict from the model"""
+
+import pytest
+
+from clients import OpenAIClient
+from deadline import DeadlineExceeded
+from resilience import CircuitBreaker, LLMResilience
+
+
+def test_deadline_during_the_probe_releases_it(server, monkeypatch):
+    resilience = LLMResilience(breaker={'min_calls': 1, 'cooldown': 0})
+    client = OpenAIClient('key', model='gpt-4o-mini', base_url=server.openai_url, resilience=resilience)
+    breaker = resilience.breaker('gpt-4o-mini')
+    breaker.record_failure()
+    
+    def deadline(*args):
+        raise DeadlineExceeded("no time left for the LLM call")
+    monkeypatch.setattr(client, '_hedged_completion', deadline)
+    with pytest.raises(DeadlineExceeded):
+        client.review_code('system', 'user')
+    
+    # Still half-open (no failure recorded), and the next call may probe
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    monkeypatch.undo()
+    client.review_code('system', 'user')
+    assert breaker.state == CircuitBreaker.CLOSED
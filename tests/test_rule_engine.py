@@ -0,0 +1,120 @@
+"""Whether the local rules let a change skip the LLM review"""
+
+from loadtest.fake_servers import make_diff
+from pipeline import build_prepared, deadline_notice, run_review
+from rule_engine import LocalRuleEngine
+
+
+def file_diff(path: str, hunk: str) -> str:
+    return f"diff --git a/{path} b/{path}\n--- a/{path}\n+++ b/{path}\n{hunk}"
+
+
+def skip_reason(diff: str):
+    return LocalRuleEngine({}).evaluate(diff)['skip_reason']
+
+
+def test_comments_and_blank_lines_only():
+    diff = file_diff('app/tax.py', (
+        "@@ -1,3 +1,5 @@\n"
+        " def rate(region):\n"
+        "+    # Rates are per mille\n"
+        "+\n"
+        "-    # rates in percent\n"
+        "     return RATES[region]\n"
+    ))
+    assert skip_reason(diff) == "only comments, blank lines or documentation changed"
+
+
+def test_block_comment_in_c_style_file():
+    diff = file_diff('src/tax.js', (
+        "@@ -1,2 +1,5 @@\n"
+        "+/*\n"
+        "+ return rate * 2;\n"
+        "+ */\n"
+        " function rate(region) {\n"
+        "   return RATES[region];\n"
+    ))
+    assert skip_reason(diff) == "only comments, blank lines or documentation changed"
+
+
+def test_reordered_imports():
+    diff = file_diff('app/tax.py', (
+        "@@ -1,3 +1,3 @@\n"
+        "-import os\n"
+        " import re\n"
+        "+import os\n"
+        " from app.rates import RATES\n"
+    ))
+    assert skip_reason(diff) == "imports reordered"
+
+
+def test_changed_imports_are_reviewed():
+    diff = file_diff('app/tax.py', (
+        "@@ -1,2 +1,2 @@\n"
+        "-import pickle\n"
+        "+import json\n"
+        " import re\n"
+    ))
+    assert skip_reason(diff) is None
+
+
+def test_moved_code_is_reviewed():
+    diff = file_diff('app/tax.py', (
+        "@@ -1,6 +1,6 @@\n"
+        "-def rate(region):\n"
+        "-    return RATES[region]\n"
+        " \n"
+        " def total(amount, region):\n"
+        "     return amount * rate(region)\n"
+        "+\n"
+        "+def rate(region):\n"
+        "+    return RATES[region]\n"
+    ))
+    assert skip_reason(diff) is None
+
+
+def test_hash_is_not_a_comment_everywhere():
+    rust = file_diff('src/lib.rs', "@@ -1,1 +1,2 @@\n+#[derive(Debug)]\n struct Rate;\n")
+    javascript = file_diff('src/rate.js', "@@ -1,1 +1,2 @@\n class Rate {\n+  #value = 0;\n")
+    assert skip_reason(rust) is None
+    assert skip_reason(javascript) is None
+
+
+def test_documentation_and_manifests():
+    docs = make_diff({'docs/guide.md': "# Guide\n", 'README.md': "Shop\n"})
+    requirements = make_diff({'requirements.txt': "requests==2.31.0\n"})
+    assert skip_reason(docs) == "documentation-only change"
+    assert skip_reason(requirements) is None
+
+
+def test_comment_only_pr_is_not_sent_to_the_llm(make_server, config, make_bitbucket_client, make_openai_client):
+    server = make_server(files={'app/services/payment.py': "# Amounts are in cents\n# Tokens are never logged\n"})
+    
+    run_review(make_bitbucket_client(server), make_openai_client(server), '1', config)
+    
+    assert server.stats['openai_requests'] == 0
+    [(_, body)] = server.comments
+    assert 'only comments, blank lines or documentation changed' in body['content']['raw']
+
+
+def prepared_with_weak_hash(config):
+    diff = make_diff({'app/auth.py': "import hashlib\ndigest = hashlib.md5(password.encode()).hexdigest()\n"})
+    return build_prepared({'id': 1, 'title': 'Hash passwords'}, diff, {'changed_files': ['app/auth.py']},
+                          'python', 'none', 'Python', None, config)
+
+
+def test_markdown_prompt_lists_lines_already_reported(config):
+    prepared = prepared_with_weak_hash(config)
+    
+    [finding] = prepared['local_rules']['findings']
+    assert 'ALREADY REPORTED BY LOCAL RULES' in prepared['user_prompt']
+    assert f"`app/auth.py` line {finding['line']}" in prepared['user_prompt']
+
+
+def test_deadline_notice_keeps_local_findings(config):
+    prepared = prepared_with_weak_hash(config)
+    
+    notice = deadline_notice(prepared)
+    assert 'no findings are available' not in notice
+    assert 'Local Rule Findings' in notice and prepared['local_rules']['findings'][0]['issue'] in notice
+    assert 'no findings are available' in deadline_notice({})
@@ -0,0 +1,45 @@
+"""Review scheduler: one diffstat request per PR, and cancelled jobs resolve their futures"""
+
+import asyncio
+
+from async_clients import AsyncBitbucketClient, AsyncOpenAIClient
+from async_pipeline import run_scheduled_reviews_async
+from scheduler import ReviewScheduler
+
+
+def test_diffstat_of_the_size_estimate_is_reused(server, config):
+    async def run():
+        bb_client = AsyncBitbucketClient.from_config('ws', 'repo', 'token', config, base_url=server.bitbucket_url)
+        ai_client = AsyncOpenAIClient('key', model=config.get('model'), base_url=server.openai_url)
+        try:
+            return await run_scheduled_reviews_async([(bb_client, '1'), (bb_client, '2')], ai_client, config)
+        finally:
+            await bb_client.aclose()
+            await ai_client.aclose()
+    
+    assert asyncio.run(run()) == [None, None]
+    assert sum(path.endswith('/diffstat') for _, path, _ in server.request_log) == 2
+    assert len(server.comments) == 2
+
+
+def test_cancelled_job_does_not_hang_the_queue():
+    async def run():
+        scheduler = ReviewScheduler(max_concurrency=2)
+        started = asyncio.Event()
+        
+        async def slow():
+            started.set()
+            await asyncio.sleep(60)
+        
+        async def quick():
+            return 'done'
+        
+        futures = [scheduler.submit('ws/repo', 1, slow), scheduler.submit('ws/repo', 2, quick)]
+        await started.wait()
+        for task in list(scheduler._tasks):
+            task.cancel()
+        return await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), timeout=5), scheduler.stats()
+    
+    (slow_result, _), stats = asyncio.run(run())
+    assert isinstance(slow_result, asyncio.CancelledError)
+    assert stats['cancelled'] >= 1
@@ -0,0 +1,61 @@
+"""
+Cross-file symbol context against the fake Bitbucket server: definitions of imported names, the
+(commit, path) cache that lets a later run at the same commit skip every lookup, and the deadline
+"""
+
+import time
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from loadtest.fake_servers import make_diff
+from symbol_index import SymbolCache, SymbolIndex
+
+COMMIT = 'a' * 40
+
+FILES = {
+    'app/pricing.py': 'def apply_discount(total, rate):\n    return total * (1 - rate)\n',
+    'app/tax.py': 'def vat(total):\n    return total * 0.2\n',
+    'app/checkout.py': (
+        'from app.pricing import apply_discount\n'
+        'from app import tax\n'
+        '\n'
+        'def charge(total):\n'
+        '    return apply_discount(total, 0.1) + tax.vat(total)\n'
+    ),
+}
+
+
+def source_requests(server):
+    return [path for _, path, _ in server.request_log if '/src/' in path]
+
+
+def test_definitions_are_added_and_reused_at_the_same_commit(make_server, make_bitbucket_client, tmp_path):
+    server = make_server(files=FILES)
+    diff = make_diff({'app/checkout.py': FILES['app/checkout.py']})
+    
+    index = SymbolIndex(SymbolCache(str(tmp_path / 'symbols.sqlite3')), max_workers=4)
+    context = index.context_for(make_bitbucket_client(server), diff, COMMIT, {})
+    index.close()
+    assert 'apply_discount' in context and 'def vat' in context
+    assert source_requests(server)
+    
+    server.request_log.clear()
+    index = SymbolIndex(SymbolCache(str(tmp_path / 'symbols.sqlite3')), max_workers=4)
+    assert index.context_for(make_bitbucket_client(server), diff, COMMIT, {}) == context
+    assert source_requests(server) == []
+
+
+def test_disabled_by_default(config):
+    assert SymbolIndex.from_config(config) is None
+
+
+def test_deadline_stops_the_lookups(make_server, make_bitbucket_client):
+    server = make_server(files=FILES)
+    client = make_bitbucket_client(server)
+    client.deadline = Deadline(0.01)
+    time.sleep(0.02)
+    diff = make_diff({'app/checkout.py': FILES['app/checkout.py']})
+    with pytest.raises(DeadlineExceeded):
+        SymbolIndex(SymbolCache(None)).context_for(client, diff, COMMIT, {})
+    assert source_requests(server) == []
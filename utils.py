@@ -2,28 +2,143 @@
 Utility functions for AI Code Review Bot
 """
 
+import atexit
+import json
 import logging
+import os
+import queue
 import re
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+# Secrets are redacted in one pass; the group that matched picks the replacement
+REDACTION_PATTERN = re.compile(
+    r'(?P<openai>sk-[a-zA-Z0-9_\-]{20,})'
+    r'|(?P<bitbucket>ATB[a-zA-Z0-9_\-]{20,})'
+    r'|(?P<bearer>Bearer\s+[a-zA-Z0-9\-_.=]+)'
 )
-logger = logging.getLogger(__name__)
+REDACTIONS = {
+    'openai': '[REDACTED_OPENAI_KEY]',
+    'bitbucket': '[REDACTED_BB_TOKEN]',
+    'bearer': 'Bearer [REDACTED]'
+}
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _redact_match(match: re.Match) -> str:
+    return REDACTIONS[match.lastgroup]
 
 
 def sanitize_log(message: str) -> str:
     """Sanitize log messages to redact API keys and tokens"""
-    message = re.sub(r'(sk-[a-zA-Z0-9]{20,})', '[REDACTED_OPENAI_KEY]', message)
-    message = re.sub(r'(ATB[a-zA-Z0-9]{20,})', '[REDACTED_BB_TOKEN]', message)
-    message = re.sub(r'(Bearer\s+[a-zA-Z0-9\-_]+)', 'Bearer [REDACTED]', message)
-    return message
+    return REDACTION_PATTERN.sub(_redact_match, message)
+
+
+class RedactingFilter(logging.Filter):
+    """Formats each record's message once (lazy %-args) and redacts secrets from it and its traceback"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = sanitize_log(record.getMessage())
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = sanitize_log(logging.Formatter().formatException(record.exc_info))
+        return True
+
+
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per record, for log ingestion"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, LOG_DATE_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def user_cache_dir() -> str:
+    """Per-user cache directory for data shared between runs: $CODEWISE_CACHE_DIR, else $XDG_CACHE_HOME/codewise"""
+    if os.getenv('CODEWISE_CACHE_DIR'):
+        return os.environ['CODEWISE_CACHE_DIR']
+    return os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'codewise')
+
+
+def configure_logging(level: Optional[str] = None, json_lines: Optional[bool] = None):
+    """
+    Route all logging through a queue: callers only enqueue already-redacted records and a
+    background listener thread does the formatting and I/O (stderr, text or JSON lines).
+    Defaults come from CODEWISE_LOG_LEVEL / CODEWISE_LOG_FORMAT; safe to call again to reconfigure.
+    Called by the entry points (ai_reviewer.main, the loadtest scripts), never on import, so
+    importing these modules leaves the host application's logging alone.
+    """
+    global _listener
+    level = (level or os.getenv('CODEWISE_LOG_LEVEL', 'INFO')).upper()
+    if json_lines is None:
+        json_lines = os.getenv('CODEWISE_LOG_FORMAT', 'text').lower() == 'json'
+    
+    if _listener is not None:
+        _listener.stop()
+    else:
+        atexit.register(shutdown_logging)
+    
+    output = logging.StreamHandler()
+    output.setFormatter(JsonLineFormatter() if json_lines else logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RedactingFilter())
+    
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records; registered to run at exit"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def max_output_tokens(model: str) -> int:
+    """Largest max_tokens the model accepts (requests above it fail with 400); unknown models get the smallest"""
+    if "gpt-4o" in model:
+        return 16384
+    # gpt-4-turbo and gpt-3.5-turbo cap the answer at 4096; gpt-4's 8192 context also holds the prompt
+    return 4096
 
 
-def calculate_cost(input_tokens: int, output_tokens: int, model: str = "gpt-4o-mini") -> float:
-    """Calculate OpenAI API cost"""
+def calculate_cost(
+    input_tokens: int,
+    output_tokens: int,
+    model: str = "gpt-4o-mini",
+    cached_tokens: int = 0,
+    batch: bool = False
+) -> float:
+    """
+    Calculate OpenAI API cost
+    cached_tokens is the part of input_tokens served from the prompt cache, billed at a discount;
+    requests sent through the Batch API are billed at half price
+    """
+    cached_discount = 0.5
     if "gpt-4o" in model or "gpt-4-turbo" in model:
         if "mini" in model:
             input_cost = 0.00015 / 1000
@@ -38,4 +153,6 @@ def calculate_cost(input_tokens: int, output_tokens: int, model: str = "gpt-4o-m
         input_cost = 0.0015 / 1000
         output_cost = 0.002 / 1000
     
-    return (input_tokens * input_cost) + (output_tokens * output_cost)
+    uncached_tokens = input_tokens - cached_tokens
+    cost = (uncached_tokens * input_cost) + (cached_tokens * input_cost * cached_discount) + (output_tokens * output_cost)
+    return cost * 0.5 if batch else cost